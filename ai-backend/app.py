@@ -1,14 +1,36 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from sentence_transformers import SentenceTransformer
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import atexit
+import hmac
 import json
 import re
 import logging
+import os
+import subprocess
+import sys
+import threading
+import time
 from functools import wraps
 
+from batching import MicroBatcher, BatcherOverloadedError
+from context_snapshot import ContextSnapshot, snapshot_path, write_snapshot
+from context_store import create_context_store
+from embedding_cache import intents_fingerprint, load_pattern_matrix, save_pattern_matrix
+from entity_extractor import EntityExtractor, empty_entities
+from encoders import DEFAULT_LENGTH_BUCKETS, BucketedEncoder, default_onnx_dir, load_encoder
+from intent_index import IntentIndex
+from input_validator import InputValidator
+from intent_loader import IntentFileWatcher, build_index_incremental, known_pattern_vectors, load_intents
+from keyword_matcher import KeywordMatcher
+from metrics import Registry
+from profiling import SamplingProfiler, SlowRequestLog
+from response_cache import CachedIntent, IntentCache, normalize_text
+from singleflight import SingleFlight
+from listing_filters import coerce_filters
+from listing_store import ListingStore
+from search import iter_listings
+
 app = Flask(__name__)
 CORS(app)
 
@@ -16,386 +38,677 @@ CORS(app)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Metrics exposed at /metrics (Prometheus text format)
+metrics_registry = Registry()
+STAGE_LATENCY = metrics_registry.histogram(
+    'chat_stage_latency_seconds', 'Latency of each /chat pipeline stage', ('stage',)
+)
+CHAT_REQUESTS = metrics_registry.counter(
+    'chat_requests_total', 'Chat messages answered, by detected intent', ('intent',)
+)
+CHAT_ERRORS = metrics_registry.counter(
+    'chat_errors_total', 'Chat requests that failed, by reason', ('reason',)
+)
+
 # Constants
+MODEL_NAME = os.environ.get('MODEL_NAME', 'paraphrase-multilingual-MiniLM-L12-v2')
+EMBEDDING_CACHE_DIR = os.environ.get(
+    'EMBEDDING_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+)
+# Encoder backend: torch | onnx | onnx-int8 (see encoders.py)
+ENCODER_BACKEND = os.environ.get('ENCODER_BACKEND', 'torch')
+ONNX_MODEL_DIR = os.environ.get('ONNX_MODEL_DIR') or default_onnx_dir(MODEL_NAME)
+ENCODER_NUM_THREADS = os.environ.get('ENCODER_NUM_THREADS')
+# Pattern matrix storage: float32 | float16 | int8 (see quantization.py)
+EMBEDDING_DTYPE = os.environ.get('EMBEDDING_DTYPE', 'float32')
+# Token budget per text (empty = the model's max_seq_length); longer inputs are
+# truncated by the tokenizer. Each encode call is split into batches of similar
+# token length, bucket upper bounds below
+MAX_INPUT_TOKENS = int(os.environ.get('MAX_INPUT_TOKENS') or 0) or None
+ENCODE_LENGTH_BUCKETS = tuple(
+    int(b) for b in os.environ.get('ENCODE_LENGTH_BUCKETS', ','.join(map(str, DEFAULT_LENGTH_BUCKETS))).split(',')
+    if b.strip()
+)
 MAX_INPUT_LENGTH = 500
 MIN_INPUT_LENGTH = 1
+INTENT_THRESHOLD = 0.5
+# Top-k intent candidates returned by /chat (0 to omit)
+TOP_K_INTENTS = int(os.environ.get('TOP_K_INTENTS', '3'))
 
-# Load pre-trained model for Vietnamese
-try:
-    model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-    logger.info("✅ Model loaded successfully")
-except Exception as e:
-    logger.error(f"❌ Failed to load model: {str(e)}")
-    model = None
-
-# Training data - Intents và responses (ENHANCED)
-INTENTS = {
-    "greeting": {
-        "patterns": [
-            "xin chào", "chào", "hello", "hi", "hey", "chào bạn", 
-            "chào bot", "alo", "hế nhô", "hế lô", "good morning",
-            "good afternoon", "good evening", "buổi sáng", "buổi chiều",
-            "buổi tối", "chào buổi sáng", "chào buổi tối"
-        ],
-        "responses": [
-            "Xin chào! 👋 Tôi là trợ lý AI của HomeLand. Tôi có thể giúp bạn tìm căn nhà hoàn hảo!",
-            "Chào bạn! 😊 Rất vui được hỗ trợ bạn tìm nhà hôm nay!",
-            "Hello! Tôi là AI Assistant, sẵn sàng giúp bạn tìm nhà mơ ước! 🏠",
-            "Chào mừng bạn đến với HomeLand! Hãy cho tôi biết bạn đang tìm loại nhà nào nhé! 🏡"
-        ]
-    },
-    "thanks": {
-        "patterns": [
-            "cảm ơn", "cám ơn", "thank", "thanks", "thank you", 
-            "cảm ơn bạn", "cảm ơn nhiều", "thanks a lot", "thank you so much",
-            "cảm ơn rất nhiều", "cảm ơn lắm", "thanks bro", "tks", "ty"
-        ],
-        "responses": [
-            "Rất vui được giúp đỡ bạn! 😊 Nếu cần gì thêm, cứ hỏi tôi nhé!",
-            "Không có gì! Tôi luôn sẵn sàng hỗ trợ bạn! 🤗",
-            "Hân hạnh được phục vụ! Chúc bạn tìm được căn nhà ưng ý! ✨",
-            "Không sao! Đó là nhiệm vụ của tôi mà! 💪"
-        ]
-    },
-    "goodbye": {
-        "patterns": [
-            "tạm biệt", "bye", "goodbye", "see you", "hẹn gặp lại",
-            "chào tạm biệt", "bye bye", "bái bai", "see ya", "catch you later",
-            "tạm biệt nhé", "bye nha", "tạm biệt nha", "đi đây"
-        ],
-        "responses": [
-            "Tạm biệt! Chúc bạn tìm được căn nhà ưng ý! 🏠✨",
-            "Hẹn gặp lại bạn! Chúc một ngày tốt lành! 😊",
-            "Bye bye! Quay lại bất cứ lúc nào bạn cần nhé! 👋",
-            "Chúc bạn may mắn! Hẹn gặp lại! 🍀"
-        ]
-    },
-    "help": {
-        "patterns": [
-            "giúp", "help", "hướng dẫn", "làm sao", "làm thế nào",
-            "tôi cần giúp đỡ", "giúp tôi", "giúp đỡ", "bạn có thể làm gì",
-            "bạn giúp được gì", "tính năng", "chức năng", "hỗ trợ",
-            "what can you do", "how to use", "cách dùng"
-        ],
-        "responses": [
-            "Tôi có thể giúp bạn tìm nhà theo:\n\n🏠 Loại nhà: Apartment, House, Villa\n📍 Vị trí: Canada, USA, Vietnam\n🛏️ Số phòng ngủ (1-5+)\n🛁 Số phòng tắm\n💰 Giá thuê (min-max)\n📐 Diện tích\n\nVí dụ:\n• 'Tôi muốn thuê apartment 2 phòng ngủ ở Canada dưới 50k'\n• 'Tìm house ở USA có 3 phòng ngủ'\n• 'Cần villa ở Vietnam giá từ 100k đến 200k'"
-        ]
-    },
-    "rent_intent": {
-        "patterns": [
-            "tôi muốn thuê", "cần thuê", "tìm nhà", "tìm phòng",
-            "muốn tìm", "đang tìm", "looking for", "need to rent",
-            "want to rent", "cần tìm nhà", "cần tìm phòng", "tìm cho tôi",
-            "có nhà nào", "có phòng nào", "show me", "tìm giúp tôi",
-            "muốn xem", "xem nhà", "tìm kiếm", "search", "find",
-            "có không", "có căn nào", "giới thiệu", "recommend"
-        ],
-        "responses": [
-            "Tuyệt! Tôi sẽ giúp bạn tìm nhà. Bạn muốn tìm loại nhà nào? (Apartment, House, hay Villa?) 🏠",
-            "Được rồi! Hãy cho tôi biết thêm chi tiết: loại nhà, vị trí, số phòng ngủ, giá... 🔍",
-            "OK! Tôi sẵn sàng tìm kiếm cho bạn. Bạn có thể cho tôi biết thêm về yêu cầu không? 📝"
-        ]
-    },
-    "price_inquiry": {
-        "patterns": [
-            "giá bao nhiêu", "giá", "price", "cost", "how much",
-            "giá thuê", "chi phí", "mức giá", "giá cả", "bao nhiêu tiền",
-            "giá khoảng", "trong khoảng giá", "budget", "ngân sách"
-        ],
-        "responses": [
-            "Giá thuê nhà của chúng tôi dao động từ $20,000 đến $300,000/tháng tùy loại nhà và vị trí. Bạn có ngân sách bao nhiêu? 💰"
-        ]
-    },
-    "location_inquiry": {
-        "patterns": [
-            "ở đâu", "vị trí", "location", "where", "khu vực nào",
-            "quốc gia nào", "thành phố nào", "địa điểm", "nơi nào",
-            "có ở", "có tại", "available in", "khu nào"
-        ],
-        "responses": [
-            "Chúng tôi có nhà tại:\n🇨🇦 Canada\n🇺🇸 United States (USA)\n🇻🇳 Vietnam\n\nBạn muốn tìm nhà ở quốc gia nào? 🌍"
-        ]
-    },
-    "bedrooms_inquiry": {
-        "patterns": [
-            "mấy phòng ngủ", "bao nhiêu phòng ngủ", "số phòng ngủ",
-            "phòng ngủ", "bedroom", "bedrooms", "how many bedrooms",
-            "có mấy phòng", "phòng", "rooms"
-        ],
-        "responses": [
-            "Chúng tôi có nhà từ 1 đến 5+ phòng ngủ. Bạn cần bao nhiêu phòng ngủ? 🛏️"
-        ]
-    },
-    "house_type_inquiry": {
-        "patterns": [
-            "loại nhà", "kiểu nhà", "type", "house type", "loại nào",
-            "có loại gì", "apartment hay house", "villa hay apartment",
-            "chung cư", "biệt thự", "nhà riêng", "căn hộ"
-        ],
-        "responses": [
-            "Chúng tôi có 3 loại nhà:\n🏢 Apartment (Căn hộ/Chung cư)\n🏠 House (Nhà riêng)\n🏰 Villa (Biệt thự)\n\nBạn thích loại nào? 😊"
-        ]
-    },
-    "positive_feedback": {
-        "patterns": [
-            "tốt", "hay", "đẹp", "ưng", "thích", "ok", "okay",
-            "good", "great", "nice", "perfect", "excellent",
-            "tuyệt", "tuyệt vời", "xuất sắc", "ổn", "được",
-            "hợp", "phù hợp", "ưng ý"
-        ],
-        "responses": [
-            "Tuyệt vời! 🎉 Bạn có muốn xem thêm thông tin chi tiết không?",
-            "Rất vui vì bạn thích! 😊 Hãy click vào căn nhà để xem chi tiết nhé!",
-            "Tốt quá! Bạn có thể đặt lịch xem nhà hoặc liên hệ với chúng tôi! 📞"
-        ]
-    },
-    "negative_feedback": {
-        "patterns": [
-            "không", "không thích", "không ưng", "không phù hợp",
-            "không hợp", "chưa ưng", "chưa hợp", "no", "not good",
-            "bad", "tệ", "không được", "không ổn", "không hay"
-        ],
-        "responses": [
-            "Không sao! Hãy cho tôi biết thêm về yêu cầu của bạn để tôi tìm căn phù hợp hơn nhé! 🔍",
-            "Được rồi! Bạn muốn thay đổi điều gì? (Giá, vị trí, số phòng...) 🤔",
-            "OK! Tôi sẽ tìm các lựa chọn khác cho bạn! 💪"
-        ]
-    },
-    "name_introduction": {
-        "patterns": [
-            "tên tôi là", "tôi là", "my name is", "i am", "i'm",
-            "mình là", "mình tên", "tên mình", "call me", "gọi tôi"
-        ],
-        "responses": []  # Will be handled specially
-    }
-}
+# Micro-batching for model.encode (set ENCODE_BATCHING=0 to disable)
+ENCODE_BATCHING = os.environ.get('ENCODE_BATCHING', '1') == '1'
+ENCODE_BATCH_WINDOW_MS = float(os.environ.get('ENCODE_BATCH_WINDOW_MS', '5'))
+ENCODE_MAX_BATCH_SIZE = int(os.environ.get('ENCODE_MAX_BATCH_SIZE', '32'))
+ENCODE_MAX_QUEUE_SIZE = int(os.environ.get('ENCODE_MAX_QUEUE_SIZE', '256'))
+ENCODE_TIMEOUT = float(os.environ.get('ENCODE_TIMEOUT', '5'))
 
-# Pre-compute embeddings for patterns
-pattern_embeddings = {}
-try:
-    if model:
-        for intent, data in INTENTS.items():
-            pattern_embeddings[intent] = model.encode(data["patterns"])
-        logger.info("✅ Pattern embeddings computed successfully")
-except Exception as e:
-    logger.error(f"❌ Failed to compute embeddings: {str(e)}")
+# Conversation context store: memory (LRU + idle TTL) | sqlite (shared per host)
+CONTEXT_STORE = os.environ.get('CONTEXT_STORE', 'memory')
+CONTEXT_MAX_ENTRIES = int(os.environ.get('CONTEXT_MAX_ENTRIES', '10000'))
+CONTEXT_TTL_SECONDS = float(os.environ.get('CONTEXT_TTL_SECONDS', '1800'))
+CONTEXT_DB_PATH = os.environ.get('CONTEXT_DB_PATH', os.path.join(EMBEDDING_CACHE_DIR, 'contexts.sqlite3'))
+# Shared directory for binary context snapshots: dumped on shutdown, restored
+# lazily by any replica (empty = disabled, see context_snapshot.py)
+CONTEXT_SNAPSHOT_DIR = os.environ.get('CONTEXT_SNAPSHOT_DIR', '')
 
-# Context storage (in-memory, should use Redis in production)
-user_contexts = {}
+# Production profiling (see profiling.py): sampling profiler toggled at runtime
+# via POST /debug/profiler or PROFILER_SIGNAL; slow /chat requests above
+# SLOW_REQUEST_THRESHOLD_MS are kept with stage timings (0 = disabled)
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '0') == '1'
+PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', '5'))
+PROFILER_SIGNAL = os.environ.get('PROFILER_SIGNAL', 'SIGUSR2')
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', '0'))
+SLOW_REQUEST_CAPACITY = int(os.environ.get('SLOW_REQUEST_CAPACITY', '20'))
+# Admin endpoints (listing writes, /debug/*) require X-Admin-Token when set;
+# unset, they only answer requests from localhost
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
 
-def validate_input(user_input):
-    """Validate user input"""
-    if not user_input:
-        return False, "Input không được để trống"
-    
-    if not isinstance(user_input, str):
-        return False, "Input phải là chuỗi ký tự"
-    
-    user_input = user_input.strip()
-    
-    if len(user_input) < MIN_INPUT_LENGTH:
-        return False, f"Input quá ngắn (tối thiểu {MIN_INPUT_LENGTH} ký tự)"
-    
-    if len(user_input) > MAX_INPUT_LENGTH:
-        return False, f"Input quá dài (tối đa {MAX_INPUT_LENGTH} ký tự)"
+# /chat/batch payload limits
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '256'))
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', str(1024 * 1024)))
+
+# LRU of normalized message -> embedding + intent (0 to disable)
+INTENT_CACHE_SIZE = int(os.environ.get('INTENT_CACHE_SIZE', '4096'))
+
+# Concurrent identical messages share one encode + scoring pass
+INTENT_COALESCING = os.environ.get('INTENT_COALESCING', '1') == '1'
+
+# Keyword fast path that skips the encoder: exact | contains | off
+KEYWORD_FAST_PATH = os.environ.get('KEYWORD_FAST_PATH', 'exact')
+KEYWORD_MIN_COVERAGE = float(os.environ.get('KEYWORD_MIN_COVERAGE', '0.6'))
+
+# Semantic listing search (see search.py, listing_store.py). The store is
+# synced offline with `python search.py build <export.json>` or via
+# PUT/DELETE /listings; LISTINGS_PATH lets a non-prefork process fill an
+# empty store on first start
+LISTING_INDEX_DIR = os.environ.get('LISTING_INDEX_DIR', os.path.join(EMBEDDING_CACHE_DIR, 'listings'))
+LISTINGS_PATH = os.environ.get('LISTINGS_PATH')
+SEARCH_IVF_LISTS = int(os.environ.get('SEARCH_IVF_LISTS', '0'))
+SEARCH_IVF_NPROBE = int(os.environ.get('SEARCH_IVF_NPROBE', '8'))
+SEARCH_DEFAULT_K = int(os.environ.get('SEARCH_DEFAULT_K', '10'))
+SEARCH_MAX_K = int(os.environ.get('SEARCH_MAX_K', '50'))
+SEARCH_COMPACT_INTERVAL = float(os.environ.get('SEARCH_COMPACT_INTERVAL', '60'))
+SEARCH_COMPACT_DEAD_RATIO = float(os.environ.get('SEARCH_COMPACT_DEAD_RATIO', '0.2'))
+SEARCH_MAX_SEGMENTS = int(os.environ.get('SEARCH_MAX_SEGMENTS', '8'))
+SEARCH_FILTER_CACHE_SIZE = int(os.environ.get('SEARCH_FILTER_CACHE_SIZE', '64'))
+# Listing vectors storage for new segments (compaction converts older ones)
+SEARCH_EMBEDDING_DTYPE = os.environ.get('SEARCH_EMBEDDING_DTYPE', EMBEDDING_DTYPE)
+
+# Intents file (JSON, or YAML with PyYAML); polled every INTENTS_WATCH_INTERVAL
+# seconds and hot-reloaded on change (0 = never)
+INTENTS_PATH = os.environ.get(
+    'INTENTS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intents.json')
+)
+INTENTS_WATCH_INTERVAL = float(os.environ.get('INTENTS_WATCH_INTERVAL', '5'))
+
+# Model loading: background (import returns at once, load on a thread) |
+# eager (block at import) | prefork (load in the gunicorn master, warmup +
+# batcher per worker, see gunicorn.conf.py) | manual (call load_model() yourself)
+MODEL_LOAD_MODE = os.environ.get('MODEL_LOAD_MODE', 'background')
+
+# Pre-trained model for Vietnamese, set by load_model()
+model = None
+
+# Training data - Intents và responses, loaded from INTENTS_PATH and
+# hot-reloaded by reload_intents()
+INTENTS = load_intents(INTENTS_PATH)
+
+def current_fingerprint(intents=None):
+    """Identity of the active model + storage dtype + INTENTS, used to key every cache"""
+    model_key = f"{MODEL_NAME}:{ENCODER_BACKEND}"
+    if EMBEDDING_DTYPE != 'float32':
+        model_key += f":{EMBEDDING_DTYPE}"
+    if MAX_INPUT_TOKENS:
+        model_key += f":t{MAX_INPUT_TOKENS}"
+    return intents_fingerprint(model_key, INTENTS if intents is None else intents)
+
+def create_encoder():
+    return BucketedEncoder(
+        load_encoder(ENCODER_BACKEND, MODEL_NAME, ONNX_MODEL_DIR, ENCODER_NUM_THREADS),
+        MAX_INPUT_TOKENS, ENCODE_LENGTH_BUCKETS
+    )
+
+def load_cached_intent_index(intents=None):
+    """Pattern index from the disk cache only (no inference); None on a miss"""
+    cached = load_pattern_matrix(EMBEDDING_CACHE_DIR, current_fingerprint(intents))
+    if cached is None:
+        return None
+    logger.info("✅ Pattern embeddings loaded from cache")
+    return IntentIndex(*cached)
+
+def build_intent_index(intents=None, previous=None):
+    """Load pattern index from disk cache, or encode intents and cache it.
+
+    previous: (intents, index) currently serving; its pattern vectors are
+    reused so only added / changed patterns go through the model.
+    """
+    intents = INTENTS if intents is None else intents
+    fingerprint = current_fingerprint(intents)
+    index = load_cached_intent_index(intents)
+    if index is not None:
+        return index
     
-    # Check for suspicious patterns (SQL injection, XSS, etc.)
-    suspicious_patterns = [
-        r'<script[^>]*>.*?</script>',
-        r'javascript:',
-        r'on\w+\s*=',
-        r'DROP\s+TABLE',
-        r'DELETE\s+FROM',
-        r'INSERT\s+INTO',
-        r'UPDATE\s+\w+\s+SET'
-    ]
+    known = known_pattern_vectors(*previous) if previous else {}
+    index, encoded, reused = build_index_incremental(intents, model.encode, known, EMBEDDING_DTYPE)
+    logger.info(f"✅ Pattern embeddings computed successfully ({encoded} encoded, {reused} reused)")
+    if save_pattern_matrix(EMBEDDING_CACHE_DIR, fingerprint, index.matrix,
+                           index.row_intents, index.intent_names):
+        # Re-open from disk so the matrix is a read-only mmap (page cache is
+        # shared between pre-forked workers instead of copied into each one)
+        cached = load_pattern_matrix(EMBEDDING_CACHE_DIR, fingerprint)
+        if cached is not None:
+            return IntentIndex(*cached)
+    return index
+
+def build_pattern_cache():
+    """Encode INTENTS into the disk cache and return (child process of a prefork master)"""
+    global model
+    model = create_encoder()
+    build_intent_index()
+    return load_cached_intent_index() is not None
+
+def prefork_intent_index():
+    """Pattern index for the prefork master without running inference in it.
+
+    A cache miss is encoded by a throwaway subprocess (fork + exec, no state
+    shared with the master); if that fails too, each worker encodes after fork.
+    """
+    index = load_cached_intent_index()
+    if index is not None:
+        return index
+    logger.info("⏳ Pattern cache miss: encoding patterns in a subprocess...")
+    try:
+        subprocess.run(
+            [sys.executable, '-c', 'import sys, app; sys.exit(0 if app.build_pattern_cache() else 1)'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=dict(os.environ, MODEL_LOAD_MODE='manual'),
+            check=True
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.error(f"❌ Failed to build pattern cache in a subprocess: {str(e)}")
+    index = load_cached_intent_index()
+    if index is None:
+        logger.warning("⚠️ Pattern cache unavailable: each worker will encode patterns after fork")
+    return index
+
+# Cached intent results are only valid for one model + INTENTS combination
+intent_cache = IntentCache(INTENT_CACHE_SIZE)
+
+# In-flight dedup of cache misses (see singleflight.py)
+scoring_flight = SingleFlight()
+
+# Unambiguous literal patterns are answered without calling the model
+keyword_matcher = KeywordMatcher(INTENTS, KEYWORD_FAST_PATH, KEYWORD_MIN_COVERAGE)
+
+# Pattern index + batching stage + listing store, set by load_model()
+pattern_embeddings = {}
+intent_index = None
+encode_batcher = None
+listing_store = None
+intents_watcher = None
+_intents_reload_lock = threading.Lock()
+intents_state = {
+    'path': INTENTS_PATH,
+    'reloads': 0,
+    'failures': 0,
+    'last_reload': None,
+    'last_error': None
+}
+
+# Readiness: /chat only serves once model, pattern index and warmup are done
+model_ready = threading.Event()
+model_state = {
+    'status': 'not_started',
+    'error': None,
+    'load_seconds': None
+}
+_model_load_lock = threading.Lock()
+
+WARMUP_TEXTS = [
+    "xin chào",
+    "Tìm apartment 2 phòng ngủ ở Canada dưới 50k",
+    "Tôi muốn thuê biệt thự ở Việt Nam giá từ 100 đến 200 triệu, có hồ bơi và 4 phòng tắm"
+]
+
+def warmup_model(encoder):
+    """Single + batched forward passes so the first real request doesn't pay
+    for lazy init / allocator growth"""
+    for text in WARMUP_TEXTS:
+        encoder.encode([text])
+    encoder.encode(WARMUP_TEXTS)
+
+def start_encode_batcher(encoder):
+    if not ENCODE_BATCHING:
+        return None
+    return MicroBatcher(
+        encoder.encode,
+        max_batch_size=ENCODE_MAX_BATCH_SIZE,
+        max_wait_ms=ENCODE_BATCH_WINDOW_MS,
+        max_queue_size=ENCODE_MAX_QUEUE_SIZE,
+        timeout=ENCODE_TIMEOUT
+    ).start()
+
+def load_listing_store(allow_build=True):
+    """Open the on-disk listing store (mmap'd segments), filling it from LISTINGS_PATH if empty"""
+    global listing_store
+    try:
+        store = ListingStore(LISTING_INDEX_DIR, MODEL_NAME, n_lists=SEARCH_IVF_LISTS,
+                             filter_cache_size=SEARCH_FILTER_CACHE_SIZE,
+                             dtype=SEARCH_EMBEDDING_DTYPE).open()
+        if not len(store) and LISTINGS_PATH and allow_build:
+            logger.info(f"🏠 Building listing index from {LISTINGS_PATH}...")
+            store.upsert(iter_listings(LISTINGS_PATH), model.encode)
+            store.compact()
+        logger.info(f"✅ Listing store ready: {len(store)} listings")
+        listing_store = store
+    except Exception as e:
+        logger.error(f"❌ Failed to open listing store: {str(e)}")
+    return listing_store
+
+def reload_intents():
+    """Re-read INTENTS_PATH and swap in a new index if the intents changed.
+
+    The new index and keyword matcher are fully built before the globals are
+    replaced, so in-flight requests keep scoring against the old ones.
+    Returns True if a new version went live.
+    """
+    global INTENTS, intent_index, pattern_embeddings, keyword_matcher
+    with _intents_reload_lock:
+        try:
+            intents = load_intents(INTENTS_PATH)
+            fingerprint = current_fingerprint(intents)
+            if fingerprint == intent_cache.fingerprint:
+                intents_state['last_error'] = None
+                return False
+            
+            start = time.perf_counter()
+            index = build_intent_index(intents, previous=(INTENTS, intent_index))
+            matcher = KeywordMatcher(intents, KEYWORD_FAST_PATH, KEYWORD_MIN_COVERAGE)
+            
+            # Responses first: a request scored on the new index must find its intent
+            INTENTS = intents
+            keyword_matcher = matcher
+            intent_index = index
+            pattern_embeddings = index.pattern_embeddings()
+            intent_cache.ensure_fingerprint(fingerprint)
+            
+            intents_state['reloads'] += 1
+            intents_state['last_reload'] = time.time()
+            intents_state['last_error'] = None
+            logger.info(f"🔄 Intents reloaded: {len(intents)} intents in {time.perf_counter() - start:.2f}s")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Failed to reload intents: {str(e)}")
+            intents_state['failures'] += 1
+            intents_state['last_error'] = str(e)
+            return False
+
+def start_intents_watcher():
+    global intents_watcher
+    if INTENTS_WATCH_INTERVAL <= 0:
+        return None
+    if intents_watcher is None:
+        intents_watcher = IntentFileWatcher(INTENTS_PATH, reload_intents, INTENTS_WATCH_INTERVAL)
+    intents_watcher.start()
+    return intents_watcher
+
+def start_listing_compactor():
+    if listing_store is not None:
+        listing_store.start_compactor(SEARCH_COMPACT_INTERVAL, SEARCH_COMPACT_DEAD_RATIO, SEARCH_MAX_SEGMENTS)
+
+def load_model(prefork=False, start_threads=True):
+    """Load encoder + pattern index, start the batcher and run a warmup pass.
+
+    With prefork=True (gunicorn master) no inference runs and no thread is
+    started: threads don't survive fork and torch's OpenMP pool can hang in
+    a child forked after it was used. The pattern index only comes from the
+    disk cache (see prefork_intent_index) and the ONNX session (onnx and
+    onnx-int8), which is not fork-safe, is left to the workers.
+    init_worker() finishes after fork.
+
+    With start_threads=False (offline tools, e.g. replay.py) the encoder and
+    the pattern index are always built in this process, but there is no
+    warmup, no background thread and the listing store is not opened.
+    """
+    global model, intent_index, pattern_embeddings, encode_batcher
     
-    for pattern in suspicious_patterns:
-        if re.search(pattern, user_input, re.IGNORECASE):
-            return False, "Input chứa nội dung không hợp lệ"
+    with _model_load_lock:
+        if model_state['status'] in ('loading', 'ready'):
+            return model_ready.is_set()
+        model_state['status'] = 'loading'
     
-    return True, user_input.strip()
-
-def detect_intent(user_input):
-    """Detect user intent using semantic similarity"""
+    start = time.perf_counter()
     try:
-        if not model or not pattern_embeddings:
-            logger.error("Model or embeddings not available")
-            return None, 0
+        if prefork and ENCODER_BACKEND != 'torch':
+            # An ORT session and its thread pool must be created in the process using them
+            loaded = None
+            logger.info("⏳ ONNX session deferred to the workers")
+        else:
+            loaded = create_encoder()
+            logger.info(f"✅ Model loaded successfully ({ENCODER_BACKEND})")
+        model = loaded
         
-        user_embedding = model.encode([user_input])
+        index = prefork_intent_index() if prefork else build_intent_index()
+        intent_cache.ensure_fingerprint(current_fingerprint())
         
-        best_intent = None
-        best_score = 0
+        if start_threads and not prefork:
+            warmup_model(loaded)
+            encode_batcher = start_encode_batcher(loaded)
+            start_listing_compactor()
+            start_intents_watcher()
         
-        for intent, embeddings in pattern_embeddings.items():
-            similarities = cosine_similarity(user_embedding, embeddings)
-            max_similarity = np.max(similarities)
-            
-            if max_similarity > best_score:
-                best_score = max_similarity
-                best_intent = intent
+        if start_threads or prefork:
+            # Building runs inference, which the prefork master must not do
+            load_listing_store(allow_build=not prefork)
         
-        # Threshold for confidence
-        if best_score > 0.5:
-            return best_intent, best_score
-        return None, 0
-    
+        intent_index = index
+        pattern_embeddings = index.pattern_embeddings() if index is not None else {}
+        model_state['load_seconds'] = round(time.perf_counter() - start, 3)
+        model_state['status'] = 'ready'
+        model_ready.set()
+        logger.info(f"✅ Model ready in {model_state['load_seconds']}s")
+        return True
     except Exception as e:
-        logger.error(f"Error in detect_intent: {str(e)}")
-        return None, 0
+        logger.error(f"❌ Failed to load model: {str(e)}")
+        model_state['status'] = 'failed'
+        model_state['error'] = str(e)
+        return False
 
-def extract_entities(text):
-    """Extract entities from text using enhanced regex and NLP"""
+def init_worker():
+    """Per-worker setup after fork (gunicorn post_fork hook).
+
+    Model weights and the mmap'd pattern matrix are inherited from the master
+    copy-on-write; only per-process state is created here, plus whatever the
+    master had to leave out (ONNX session, pattern index on a cache miss).
+    """
+    global encode_batcher, model, intent_index, pattern_embeddings
+    context_store.after_fork()
+    if PROFILER_ENABLED:
+        profiler.start()
+    if not is_ready():
+        load_model()
+        return
+    if model is None:
+        model = create_encoder()
+        logger.info(f"✅ Model loaded in worker {os.getpid()} ({ENCODER_BACKEND})")
+    if intent_index is None:
+        index = build_intent_index()
+        intent_index = index
+        pattern_embeddings = index.pattern_embeddings()
+    # The file may have changed since the master loaded it
+    reload_intents()
+    warmup_model(model)
+    encode_batcher = start_encode_batcher(model)
+    start_listing_compactor()
+    start_intents_watcher()
+    logger.info(f"✅ Worker {os.getpid()} ready (shared model from master)")
+
+def start_model_loading():
+    """Load the model on a daemon thread so the process can answer liveness at once"""
+    thread = threading.Thread(target=load_model, name='model-loader', daemon=True)
+    thread.start()
+    return thread
+
+def is_ready():
+    return model_ready.is_set()
+
+def wait_until_ready(timeout=None):
+    """Block until the model is ready (or loading failed / timed out)"""
+    if model_state['status'] == 'not_started':
+        start_model_loading()
+    while not model_ready.wait(timeout=0.1 if timeout is None else min(timeout, 0.1)):
+        if model_state['status'] == 'failed':
+            return False
+        if timeout is not None:
+            timeout -= 0.1
+            if timeout <= 0:
+                return False
+    return True
+
+def encode_texts(texts):
+    """Encode texts through the batcher when enabled"""
+    if encode_batcher:
+        return encode_batcher.encode(texts)
+    return model.encode(texts)
+
+# Entity patterns are compiled once at import (see entity_extractor.py)
+entity_extractor = EntityExtractor()
+
+# Suspicious-content rules are one precompiled regex behind a prefilter (see input_validator.py)
+input_validator = InputValidator(MIN_INPUT_LENGTH, MAX_INPUT_LENGTH)
+
+# Opt-in profiling; the histogram listener only exists while slow-request capture is on
+profiler = SamplingProfiler(PROFILER_INTERVAL_MS / 1000.0)
+slow_requests = SlowRequestLog(SLOW_REQUEST_THRESHOLD_MS / 1000.0, SLOW_REQUEST_CAPACITY, profiler)
+if slow_requests.enabled:
+    STAGE_LATENCY.listener = slow_requests.observe
+if PROFILER_ENABLED and MODEL_LOAD_MODE != 'prefork':
+    profiler.start()
+
+def install_profiler_signal():
+    """Toggle the profiler on PROFILER_SIGNAL (main thread only; per worker under gunicorn)"""
+    import signal
+    signum = getattr(signal, PROFILER_SIGNAL, None) if PROFILER_SIGNAL else None
+    if signum is None:
+        return False
+    signal.signal(signum, lambda signum, frame: profiler.toggle())
+    return True
+
+def input_shape(data):
+    """What a slow request looked like, without keeping the message itself"""
+    message = data.get('message') if isinstance(data, dict) else None
+    if not isinstance(message, str):
+        return {'message_type': type(message).__name__}
+    return {'chars': len(message), 'words': len(message.split()), 'has_user_id': 'user_id' in data}
+
+# Context storage, bounded and evicting (see context_store.py)
+context_store = create_context_store(
+    CONTEXT_STORE,
+    max_entries=CONTEXT_MAX_ENTRIES,
+    ttl_seconds=CONTEXT_TTL_SECONDS,
+    db_path=CONTEXT_DB_PATH
+)
+if CONTEXT_SNAPSHOT_DIR:
+    context_store.snapshot = ContextSnapshot.open_dir(CONTEXT_SNAPSHOT_DIR, CONTEXT_TTL_SECONDS)
+    logger.info(f"📥 Indexed {len(context_store.snapshot)} contexts from {CONTEXT_SNAPSHOT_DIR}")
+
+_contexts_dumped = threading.Event()
+
+def dump_contexts():
+    """Write live contexts to CONTEXT_SNAPSHOT_DIR (once per process, on shutdown)"""
+    if not CONTEXT_SNAPSHOT_DIR or _contexts_dumped.is_set():
+        return 0
+    _contexts_dumped.set()
     try:
-        entities = {
-            "type": None,
-            "country": None,
-            "bedrooms": None,
-            "bathrooms": None,
-            "min_price": None,
-            "max_price": None,
-            "area": None
-        }
+        items = context_store.items()
+        if not items:
+            return 0
+        start = time.perf_counter()
+        path = snapshot_path(CONTEXT_SNAPSHOT_DIR)
+        count = write_snapshot(path, items)
+        logger.info(f"💾 Dumped {count} contexts to {path} in {time.perf_counter() - start:.3f}s")
+        return count
     except Exception as e:
-        logger.error(f"Error initializing entities: {str(e)}")
-        return {}
-    
-    text_lower = text.lower()
-    
-    # Type detection (ENHANCED - more patterns)
-    if re.search(r'apartment|căn hộ|chung cư|flat|condo|condominium', text_lower):
-        entities["type"] = "Apartment"
-    elif re.search(r'\bhouse\b|nhà\s+(?:riêng|phố|ở)|townhouse|nhà liền kề', text_lower):
-        entities["type"] = "House"
-    elif re.search(r'villa|biệt thự|mansion|penthouse', text_lower):
-        entities["type"] = "Villa"
-    
-    # Country detection (ENHANCED - more variations)
-    if re.search(r'canada|canadian|ca\b|toronto|vancouver|montreal', text_lower):
-        entities["country"] = "Canada"
-    elif re.search(r'\bmỹ\b|usa|us\b|united states|america|american|new york|california|texas', text_lower):
-        entities["country"] = "United States"
-    elif re.search(r'việt nam|vietnam|vn\b|vietnamese|hà nội|sài gòn|hcm|hanoi|saigon', text_lower):
-        entities["country"] = "Vietnam"
-    
-    # Bedrooms (ENHANCED - more patterns)
-    bed_patterns = [
-        r'(\d+)\s*(?:phòng ngủ|pn|bedroom|bedrooms?|beds?|ngủ)',
-        r'(?:có|with)\s*(\d+)\s*(?:phòng|room)',
-        r'(\d+)br\b',  # 2br, 3br format
-        r'(\d+)\s*(?:phòng|room)'
-    ]
-    for pattern in bed_patterns:
-        bed_match = re.search(pattern, text_lower)
-        if bed_match:
-            entities["bedrooms"] = int(bed_match.group(1))
-            break
-    
-    # Bathrooms (ENHANCED)
-    bath_patterns = [
-        r'(\d+)\s*(?:phòng tắm|wc|bathroom|bathrooms?|baths?|toilet)',
-        r'(\d+)ba\b'  # 2ba format
-    ]
-    for pattern in bath_patterns:
-        bath_match = re.search(pattern, text_lower)
-        if bath_match:
-            entities["bathrooms"] = int(bath_match.group(1))
-            break
-    
-    # Price - Under/Below (ENHANCED - more formats)
-    under_patterns = [
-        r'(?:dưới|under|below|<|<=|max|tối đa)\s*(\d+(?:[,\.]\d+)?)\s*(?:k|triệu|tr|nghìn|ngàn|đô|dollar|\$)?',
-        r'(?:không quá|ko quá|không vượt quá)\s*(\d+(?:[,\.]\d+)?)\s*(?:k|triệu|tr)?'
-    ]
-    for pattern in under_patterns:
-        under_match = re.search(pattern, text_lower)
-        if under_match:
-            price = float(under_match.group(1).replace(',', '.'))
-            # Smart price detection
-            if 'k' in text_lower or 'nghìn' in text_lower or 'ngàn' in text_lower:
-                price *= 1000
-            elif 'triệu' in text_lower or 'tr' in text_lower:
-                price *= 1000000
-            elif price < 1000:  # If number is small, assume it's in thousands
-                price *= 1000
-            entities["max_price"] = int(price)
-            break
-    
-    # Price - Over/Above (ENHANCED)
-    over_patterns = [
-        r'(?:trên|over|above|>|>=|min|tối thiểu|từ)\s*(\d+(?:[,\.]\d+)?)\s*(?:k|triệu|tr|nghìn|ngàn|đô|dollar|\$)?',
-        r'(?:ít nhất|it nhất)\s*(\d+(?:[,\.]\d+)?)\s*(?:k|triệu|tr)?'
-    ]
-    for pattern in over_patterns:
-        over_match = re.search(pattern, text_lower)
-        if over_match:
-            price = float(over_match.group(1).replace(',', '.'))
-            if 'k' in text_lower or 'nghìn' in text_lower or 'ngàn' in text_lower:
-                price *= 1000
-            elif 'triệu' in text_lower or 'tr' in text_lower:
-                price *= 1000000
-            elif price < 1000:
-                price *= 1000
-            entities["min_price"] = int(price)
-            break
-    
-    # Price range (ENHANCED)
-    range_patterns = [
-        r'(?:từ|from)\s*(\d+(?:[,\.]\d+)?)\s*(?:đến|to|-|~)\s*(\d+(?:[,\.]\d+)?)\s*(?:k|triệu|tr|nghìn|ngàn)?',
-        r'(\d+(?:[,\.]\d+)?)\s*(?:đến|to|-|~)\s*(\d+(?:[,\.]\d+)?)\s*(?:k|triệu|tr)?'
-    ]
-    for pattern in range_patterns:
-        range_match = re.search(pattern, text_lower)
-        if range_match:
-            min_p = float(range_match.group(1).replace(',', '.'))
-            max_p = float(range_match.group(2).replace(',', '.'))
-            if 'k' in text_lower or 'nghìn' in text_lower or 'ngàn' in text_lower:
-                min_p *= 1000
-                max_p *= 1000
-            elif 'triệu' in text_lower or 'tr' in text_lower:
-                min_p *= 1000000
-                max_p *= 1000000
-            elif min_p < 1000:
-                min_p *= 1000
-                max_p *= 1000
-            entities["min_price"] = int(min_p)
-            entities["max_price"] = int(max_p)
-            break
-    
-    # Area
-    try:
-        area_match = re.search(r'(\d+)\s*(?:m2|m²|mét vuông|sq\s*ft|ft2|ft²)', text_lower)
-        if area_match:
-            area_value = int(area_match.group(1))
-            # Validate area (reasonable range)
-            if 10 <= area_value <= 10000:
-                entities["area"] = area_value
-    except (ValueError, AttributeError) as e:
-        logger.warning(f"Error parsing area: {str(e)}")
+        logger.error(f"❌ Failed to dump contexts: {str(e)}")
+        return 0
+
+atexit.register(dump_contexts)
+
+# Gauges read at scrape time from the components that own the numbers
+metrics_registry.callback(
+    'context_store_size', 'User contexts currently held', lambda: len(context_store)
+)
+metrics_registry.callback(
+    'context_store_evictions_total', 'Context evictions by reason',
+    lambda: {'lru': context_store.stats['evicted_lru'], 'ttl': context_store.stats['evicted_ttl']},
+    kind='counter', labelname='reason'
+)
+metrics_registry.callback(
+    'context_snapshot_restores_total', 'Contexts looked up in snapshots of other processes, by result',
+    lambda: {
+        'restored': context_store.snapshot.stats['restored'],
+        'expired': context_store.snapshot.stats['expired']
+    } if context_store.snapshot is not None else {},
+    kind='counter', labelname='result'
+)
+metrics_registry.callback(
+    'chat_slow_requests_total', 'Requests slower than SLOW_REQUEST_THRESHOLD_MS',
+    lambda: slow_requests.stats['slow'], kind='counter'
+)
+metrics_registry.callback(
+    'encode_batch_queue_depth', 'Encode requests waiting for a batch',
+    lambda: encode_batcher.queue_depth() if encode_batcher else 0
+)
+metrics_registry.callback(
+    'encode_batches_total', 'Batched encode calls run by the micro-batcher',
+    lambda: encode_batcher.stats['batches'] if encode_batcher else 0, kind='counter'
+)
+metrics_registry.callback(
+    'encode_tokens_total', 'Token positions run through the encoder: real tokens vs after padding',
+    lambda: {'real': model.stats['tokens'], 'padded': model.stats['padded_tokens']} if model else {},
+    kind='counter', labelname='kind'
+)
+metrics_registry.callback(
+    'encode_padding_waste_ratio', 'Fraction of encoded token positions that were padding',
+    lambda: model.padding_waste() if model else 0.0
+)
+metrics_registry.callback(
+    'encode_truncated_total', 'Texts cut to the MAX_INPUT_TOKENS budget',
+    lambda: model.stats['truncated'] if model else 0, kind='counter'
+)
+metrics_registry.callback(
+    'intent_cache_lookups_total', 'Intent cache lookups by result',
+    lambda: {'hit': intent_cache.stats['hits'], 'miss': intent_cache.stats['misses']},
+    kind='counter', labelname='result'
+)
+metrics_registry.callback(
+    'intent_scoring_coalesced_total', 'Requests that reused an identical in-flight encode + scoring',
+    lambda: scoring_flight.stats['coalesced'], kind='counter'
+)
+metrics_registry.callback(
+    'intents_reloads_total', 'Intents file reloads by result',
+    lambda: {'ok': intents_state['reloads'], 'failed': intents_state['failures']},
+    kind='counter', labelname='result'
+)
+metrics_registry.callback(
+    'input_rejects_total', 'Messages rejected by validate_input, by reason',
+    input_validator.snapshot_stats, kind='counter', labelname='reason'
+)
+metrics_registry.callback(
+    'keyword_fast_path_hits_total', 'Messages answered by the keyword fast path',
+    lambda: keyword_matcher.stats['hits'], kind='counter'
+)
+
+def validate_input(user_input):
+    """Validate user input: (True, cleaned text, None) or (False, message, reason code)"""
+    return input_validator.check(user_input)
+
+def _score_uncached(key, fingerprint):
+    index = intent_index
+    with STAGE_LATENCY.time('encode'):
+        user_embedding = encode_texts([key])
+    with STAGE_LATENCY.time('intent_scoring'):
+        best_intent, best_score, candidates = index.rank_many(user_embedding, TOP_K_INTENTS)[0]
+    entry = CachedIntent(user_embedding, best_intent, best_score, candidates)
+    intent_cache.put(key, entry, fingerprint)
+    return entry
+
+def score_input(user_input):
+    """Embedding + best intent for input, served from intent_cache when possible.
+
+    Concurrent misses for the same normalized text share one computation;
+    only the result is shared, each caller still updates its own context.
+    """
+    key = normalize_text(user_input)
+    cached = intent_cache.get(key)
+    if cached is not None:
+        return cached
     
-    # Validate extracted values
+    # Keyed on the intents version too: never join a computation that
+    # started on an index a reload has since replaced
+    fingerprint = intent_cache.fingerprint
+    if not INTENT_COALESCING:
+        return _score_uncached(key, fingerprint)
+    entry, _ = scoring_flight.do((fingerprint, key), lambda: _score_uncached(key, fingerprint))
+    return entry
+
+def apply_threshold(intent, score):
+    """Keep the intent only when it clears the confidence threshold"""
+    if score > INTENT_THRESHOLD:
+        return intent, score
+    return None, 0
+
+def rank_intents(user_input, k=TOP_K_INTENTS):
+    """detect_intent plus the top-k (intent, score) candidates from the same scoring pass"""
     try:
-        if entities.get("bedrooms") and (entities["bedrooms"] < 1 or entities["bedrooms"] > 20):
-            entities["bedrooms"] = None
-        
-        if entities.get("bathrooms") and (entities["bathrooms"] < 1 or entities["bathrooms"] > 20):
-            entities["bathrooms"] = None
-        
-        if entities.get("min_price") and entities["min_price"] < 0:
-            entities["min_price"] = None
+        if not model or intent_index is None:
+            logger.error("Model or embeddings not available")
+            return None, 0, []
         
-        if entities.get("max_price") and entities["max_price"] < 0:
-            entities["max_price"] = None
+        keyword_intent = keyword_matcher.match(user_input)
+        if keyword_intent:
+            return keyword_intent, 1.0, [(keyword_intent, 1.0)] if k > 0 else []
         
-        # Swap if min > max
-        if entities.get("min_price") and entities.get("max_price"):
-            if entities["min_price"] > entities["max_price"]:
-                entities["min_price"], entities["max_price"] = entities["max_price"], entities["min_price"]
+        # Candidates were ranked with the decision, on the same index (no extra matmul)
+        scored = score_input(user_input)
+        candidates = scored.candidates[:k] if k > 0 else []
+        intent, confidence = apply_threshold(scored.intent, scored.score)
+        return intent, confidence, candidates
+    
+    except BatcherOverloadedError:
+        raise
     except Exception as e:
-        logger.warning(f"Error validating entities: {str(e)}")
+        logger.error(f"Error in rank_intents: {str(e)}")
+        return None, 0, []
+
+def detect_intent(user_input):
+    """Detect user intent using semantic similarity"""
+    intent, confidence, _ = rank_intents(user_input, k=0)
+    return intent, confidence
+
+def rank_intents_many(texts, k=TOP_K_INTENTS):
+    """Batched rank_intents: one encode + one scoring pass for all cache misses"""
+    results = [(None, 0, [])] * len(texts)
+    if not model or intent_index is None:
+        logger.error("Model or embeddings not available")
+        return results
     
-    return entities
+    index = intent_index
+    fingerprint = intent_cache.fingerprint
+    pending = {}
+    for i, text in enumerate(texts):
+        keyword_intent = keyword_matcher.match(text)
+        if keyword_intent:
+            results[i] = (keyword_intent, 1.0, [(keyword_intent, 1.0)] if k > 0 else [])
+            continue
+        key = normalize_text(text)
+        cached = intent_cache.get(key)
+        if cached is not None:
+            results[i] = (*apply_threshold(cached.intent, cached.score), cached.candidates[:k] if k > 0 else [])
+            continue
+        pending.setdefault(key, []).append(i)
+    
+    if pending:
+        keys = list(pending)
+        with STAGE_LATENCY.time('encode'):
+            embeddings = model.encode(keys)
+        with STAGE_LATENCY.time('intent_scoring'):
+            scored = index.rank_many(embeddings, TOP_K_INTENTS)
+        for key, embedding, (intent, score, candidates) in zip(keys, embeddings, scored):
+            intent_cache.put(key, CachedIntent(embedding.reshape(1, -1), intent, score, candidates), fingerprint)
+            ranked = (*apply_threshold(intent, score), candidates[:k] if k > 0 else [])
+            for i in pending[key]:
+                results[i] = ranked
+    return results
+
+def extract_entities(text):
+    """Extract entities from text with the precompiled single-pass extractor"""
+    try:
+        with STAGE_LATENCY.time('extract_entities'):
+            return entity_extractor.extract(text)
+    except Exception as e:
+        logger.error(f"Error in extract_entities: {str(e)}")
+        return empty_entities()
 
 def generate_response(intent, entities, user_name=None):
     """Generate contextual response"""
@@ -433,12 +746,124 @@ def generate_response(intent, entities, user_name=None):
     
     return response
 
+def chat_error(error, response, reason=None):
+    """Error body with the same shape as a successful /chat response"""
+    body = {
+        'error': error,
+        'response': response,
+        'success': False,
+        'intent': None,
+        'confidence': 0,
+        'entities': {},
+        'candidates': [],
+        'context': {},
+        'can_search': False
+    }
+    if reason:
+        body['reason'] = reason
+    return body
+
+def chat_reply(user_input, user_id):
+    """Detect intent, extract entities and run chat_turn for one validated message"""
+    # Detect intent
+    with slow_requests.span('detect_intent'):
+        intent, confidence, candidates = rank_intents(user_input)
+    
+    # Extract entities
+    entities = extract_entities(user_input)
+    
+    with slow_requests.span('chat_turn'):
+        return chat_turn(user_input, user_id, intent, confidence, entities, candidates)
+
+def chat_turn(user_input, user_id, intent, confidence, entities, candidates=()):
+    """Update the user's context and build the /chat response body"""
+    # Detect user name
+    context = context_store.get_or_create(user_id)
+    with STAGE_LATENCY.time('name_regex'):
+        name_match = re.search(r'tên\s+(?:tôi|mình|em)\s+là\s+(\w+)', user_input, re.IGNORECASE)
+    user_name = None
+    if name_match:
+        user_name = name_match.group(1)
+        context.name = user_name
+    elif context.name:
+        user_name = context.name
+    
+    # Update context
+    context.update(entities)
+    context_store.save(user_id, context)
+    
+    # Generate response
+    with STAGE_LATENCY.time('generate_response'):
+        response = generate_response(intent, context, user_name)
+    
+    # If no intent detected and no entities found, provide helpful response
+    if not intent and not any(entities.values()):
+        response = "Xin lỗi, tôi không hiểu yêu cầu của bạn. 🤔\n\nBạn có thể thử:\n• 'Tìm apartment 2 phòng ngủ ở Canada'\n• 'Cần thuê house ở USA giá dưới 50k'\n• Hoặc gõ 'help' để xem hướng dẫn"
+    
+    # Check if we have enough info to search
+    can_search = context.get('type') and context.get('country')
+    CHAT_REQUESTS.inc(intent or 'none')
+    
+    return {
+        'response': response,
+        'intent': intent,
+        'confidence': float(confidence) if confidence else 0,
+        'entities': entities,
+        'candidates': [{'intent': name, 'score': round(float(score), 4)} for name, score in candidates],
+        'context': context.to_dict(),
+        'can_search': can_search,
+        'success': True
+    }
+
+def search_entities(query, user_id=None, filters=None):
+    """Pre-filters for /search: entities in the query, then the user's chat
+    context for anything missing, then explicit filters on top"""
+    entities = extract_entities(query)
+    if user_id:
+        context = context_store.get(user_id)
+        if context:
+            for key, value in entities.items():
+                if value is None:
+                    entities[key] = context.get(key)
+    if filters:
+        entities.update({k: v for k, v in filters.items() if k in entities})
+    return entities
+
+def search_listings(query, k=SEARCH_DEFAULT_K, user_id=None, filters=None):
+    """Top-k listings for a free-text query, pre-filtered by chat entities"""
+    entities = search_entities(query, user_id, filters)
+    with STAGE_LATENCY.time('encode'):
+        embedding = encode_texts([query])
+    with STAGE_LATENCY.time('listing_search'):
+        index = listing_store.index()
+        hits = index.search(embedding, k=k, entities=entities, nprobe=SEARCH_IVF_NPROBE)
+    return {
+        'query': query,
+        'filters': {key: value for key, value in entities.items() if value is not None},
+        'results': index.results(hits),
+        'count': len(hits),
+        'success': True
+    }
+
 @app.route('/chat', methods=['POST'])
 def chat():
     """Main chat endpoint"""
+    if not slow_requests.enabled:
+        return chat_response()
+    trace = slow_requests.begin(input_shape(request.get_json(silent=True)))
+    status = 500
+    try:
+        response, status = chat_response()
+        return response, status
+    finally:
+        slow_requests.finish(trace, status)
+
+def chat_response():
+    """/chat body and status"""
     try:
         # Check if model is loaded
-        if not model:
+        if not is_ready():
+            CHAT_ERRORS.inc('model_unavailable')
             return jsonify({
                 'error': 'AI model chưa được tải. Vui lòng thử lại sau.',
                 'response': 'Xin lỗi, hệ thống AI đang gặp sự cố. Vui lòng thử lại sau! 🔧',
@@ -447,6 +872,7 @@ def chat():
         
         # Get request data
         if not request.json:
+            CHAT_ERRORS.inc('bad_request')
             return jsonify({
                 'error': 'Invalid request format',
                 'response': 'Yêu cầu không hợp lệ. Vui lòng gửi dữ liệu JSON.',
@@ -458,93 +884,283 @@ def chat():
         user_id = data.get('user_id', 'default')
         
         # Validate input
-        is_valid, result = validate_input(user_input)
+        with STAGE_LATENCY.time('validate_input'):
+            is_valid, result, reason = validate_input(user_input)
         if not is_valid:
-            return jsonify({
-                'error': result,
-                'response': f'❌ {result}. Vui lòng nhập lại tin nhắn hợp lệ.',
-                'success': False,
-                'intent': None,
-                'confidence': 0,
-                'entities': {},
-                'context': {},
-                'can_search': False
-            }), 400
+            CHAT_ERRORS.inc('invalid_input')
+            return jsonify(chat_error(result, f'❌ {result}. Vui lòng nhập lại tin nhắn hợp lệ.', reason)), 400
         
         user_input = result  # Use cleaned input
-    
-        # Detect user name
-        name_match = re.search(r'tên\s+(?:tôi|mình|em)\s+là\s+(\w+)', user_input, re.IGNORECASE)
-        user_name = None
-        if name_match:
-            user_name = name_match.group(1)
-            if user_id not in user_contexts:
-                user_contexts[user_id] = {}
-            user_contexts[user_id]['name'] = user_name
-        elif user_id in user_contexts and 'name' in user_contexts[user_id]:
-            user_name = user_contexts[user_id]['name']
         
-        # Detect intent
-        intent, confidence = detect_intent(user_input)
+        body = chat_reply(user_input, user_id)
+        with STAGE_LATENCY.time('json_serialization'):
+            response = jsonify(body)
+        return response, 200
+    
+    except BatcherOverloadedError as e:
+        logger.warning(f"Encoder overloaded: {str(e)}")
+        CHAT_ERRORS.inc('overloaded')
+        return jsonify(chat_error(
+            'Service busy',
+            'Hệ thống đang quá tải. Vui lòng thử lại sau giây lát! ⏳'
+        )), 503
+    
+    except Exception as e:
+        logger.error(f"Error in chat endpoint: {str(e)}")
+        CHAT_ERRORS.inc('internal')
+        return jsonify(chat_error(
+            'Internal server error',
+            'Xin lỗi, đã có lỗi xảy ra. Vui lòng thử lại! 😔'
+        )), 500
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """Classify many messages at once: one batched encode + vectorized scoring"""
+    try:
+        if not is_ready():
+            return jsonify({
+                'error': 'AI model chưa được tải. Vui lòng thử lại sau.',
+                'success': False
+            }), 503
         
-        # Extract entities
-        entities = extract_entities(user_input)
+        if request.content_length and request.content_length > BATCH_MAX_BYTES:
+            return jsonify({
+                'error': f'Payload quá lớn (tối đa {BATCH_MAX_BYTES} bytes)',
+                'success': False
+            }), 413
         
-        # Update context
-        if user_id not in user_contexts:
-            user_contexts[user_id] = {}
+        data = request.get_json(silent=True)
+        items = data.get('items') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({
+                'error': 'Invalid request format',
+                'message': 'Cần gửi {"items": [{"message": ..., "user_id": ...}, ...]}',
+                'success': False
+            }), 400
         
-        for key, value in entities.items():
-            if value is not None:
-                user_contexts[user_id][key] = value
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({
+                'error': f'Quá nhiều items (tối đa {BATCH_MAX_ITEMS})',
+                'success': False
+            }), 413
         
-        # Generate response
-        response = generate_response(intent, user_contexts[user_id], user_name)
+        # Validate each item on its own so one bad message doesn't fail the batch
+        results = [None] * len(items)
+        valid = []
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[i] = dict(chat_error('Invalid item format', 'Item phải là object JSON.'), status=400)
+                continue
+            is_valid, result, reason = validate_input(item.get('message', ''))
+            if not is_valid:
+                CHAT_ERRORS.inc('invalid_input')
+                results[i] = dict(chat_error(result, f'❌ {result}. Vui lòng nhập lại tin nhắn hợp lệ.', reason),
+                                  status=400)
+                continue
+            valid.append((i, result, str(item.get('user_id', 'default'))))
         
-        # If no intent detected and no entities found, provide helpful response
-        if not intent and not any(entities.values()):
-            response = "Xin lỗi, tôi không hiểu yêu cầu của bạn. 🤔\n\nBạn có thể thử:\n• 'Tìm apartment 2 phòng ngủ ở Canada'\n• 'Cần thuê house ở USA giá dưới 50k'\n• Hoặc gõ 'help' để xem hướng dẫn"
+        texts = [text for _, text, _ in valid]
+        ranked = rank_intents_many(texts)
+        all_entities = entity_extractor.extract_many(texts)
         
-        # Check if we have enough info to search
-        context = user_contexts[user_id]
-        can_search = context.get('type') and context.get('country')
+        for (i, text, user_id), (intent, confidence, candidates), entities in zip(valid, ranked, all_entities):
+            try:
+                results[i] = dict(chat_turn(text, user_id, intent, confidence, entities, candidates), status=200)
+            except Exception as e:
+                logger.error(f"Error in chat batch item {i}: {str(e)}")
+                CHAT_ERRORS.inc('internal')
+                results[i] = dict(chat_error(
+                    'Internal server error',
+                    'Xin lỗi, đã có lỗi xảy ra. Vui lòng thử lại! 😔'
+                ), status=500)
         
         return jsonify({
-            'response': response,
-            'intent': intent,
-            'confidence': float(confidence) if confidence else 0,
-            'entities': entities,
-            'context': context,
-            'can_search': can_search,
+            'results': results,
+            'count': len(results),
             'success': True
         }), 200
     
     except Exception as e:
-        logger.error(f"Error in chat endpoint: {str(e)}")
+        logger.error(f"Error in chat batch endpoint: {str(e)}")
         return jsonify({
             'error': 'Internal server error',
-            'response': 'Xin lỗi, đã có lỗi xảy ra. Vui lòng thử lại! 😔',
-            'success': False,
-            'intent': None,
-            'confidence': 0,
-            'entities': {},
-            'context': {},
-            'can_search': False
+            'success': False
         }), 500
 
+@app.route('/search', methods=['POST'])
+def search():
+    """Semantic listing search with chat entities as pre-filters"""
+    try:
+        if not is_ready() or listing_store is None:
+            return jsonify({
+                'error': 'Listing index chưa sẵn sàng. Vui lòng thử lại sau.',
+                'success': False
+            }), 503
+        
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data, dict):
+            return jsonify({'error': 'Invalid request format', 'success': False}), 400
+        
+        is_valid, result, reason = validate_input(data.get('query') or data.get('message', ''))
+        if not is_valid:
+            return jsonify({'error': result, 'reason': reason, 'success': False}), 400
+        
+        filters = data.get('filters')
+        if filters is not None and not isinstance(filters, dict):
+            return jsonify({'error': "'filters' must be an object", 'success': False}), 400
+        if filters:
+            try:
+                filters = coerce_filters(filters)
+            except ValueError as e:
+                return jsonify({'error': str(e), 'success': False}), 400
+        try:
+            k = max(1, min(int(data.get('k', SEARCH_DEFAULT_K)), SEARCH_MAX_K))
+        except (TypeError, ValueError):
+            return jsonify({'error': "'k' must be an integer", 'success': False}), 400
+        
+        return jsonify(search_listings(result, k=k, user_id=data.get('user_id'), filters=filters)), 200
+    
+    except BatcherOverloadedError as e:
+        logger.warning(f"Encoder overloaded: {str(e)}")
+        return jsonify({'error': 'Service busy', 'success': False}), 503
+    
+    except Exception as e:
+        logger.error(f"Error in search endpoint: {str(e)}")
+        return jsonify({'error': 'Internal server error', 'success': False}), 500
+
+def admin_authorized():
+    if ADMIN_TOKEN:
+        return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+def admin_required(view):
+    """403 unless the request carries ADMIN_TOKEN (or comes from localhost when unset)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not admin_authorized():
+            return jsonify({'error': 'Forbidden', 'success': False}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/listings', methods=['PUT'])
+@admin_required
+def upsert_listings():
+    """Upsert House documents by _id (only new / changed listings are encoded)"""
+    try:
+        if not is_ready() or listing_store is None:
+            return jsonify({'error': 'Listing store chưa sẵn sàng', 'success': False}), 503
+        
+        data = request.get_json(silent=True)
+        docs = data.get('listings') if isinstance(data, dict) else data
+        if not isinstance(docs, list) or not all(isinstance(d, dict) for d in docs):
+            return jsonify({'error': "Body must be a list of listings or {'listings': [...]}", 'success': False}), 400
+        
+        counts = listing_store.upsert(docs, encode_texts)
+        return jsonify(dict(counts, total=len(listing_store), success=True)), 200
+    
+    except ValueError as e:
+        return jsonify({'error': str(e), 'success': False}), 400
+    
+    except Exception as e:
+        logger.error(f"Error upserting listings: {str(e)}")
+        return jsonify({'error': 'Internal server error', 'success': False}), 500
+
+@app.route('/listings/<listing_id>', methods=['DELETE'])
+@admin_required
+def delete_listing(listing_id):
+    """Tombstone one listing"""
+    try:
+        if listing_store is None:
+            return jsonify({'error': 'Listing store chưa sẵn sàng', 'success': False}), 503
+        if not listing_store.delete([listing_id]):
+            return jsonify({'error': 'Listing not found', 'success': False}), 404
+        return jsonify({'deleted': listing_id, 'total': len(listing_store), 'success': True}), 200
+    except Exception as e:
+        logger.error(f"Error deleting listing: {str(e)}")
+        return jsonify({'error': 'Internal server error', 'success': False}), 500
+
+@app.route('/intents/reload', methods=['POST'])
+@admin_required
+def reload_intents_endpoint():
+    """Reload INTENTS_PATH now instead of waiting for the watcher"""
+    if not is_ready():
+        return jsonify({'error': 'AI model chưa được tải. Vui lòng thử lại sau.', 'success': False}), 503
+    reloaded = reload_intents()
+    if intents_state['last_error'] and not reloaded:
+        return jsonify({'error': intents_state['last_error'], 'success': False}), 400
+    return jsonify({
+        'reloaded': reloaded,
+        'intents': len(INTENTS),
+        'version': intent_cache.fingerprint[:12],
+        'success': True
+    }), 200
+
+@app.route('/debug/profiler', methods=['GET', 'POST'])
+@admin_required
+def debug_profiler():
+    """Sampling profiler: GET the hottest stacks (?format=collapsed for flamegraphs), POST to toggle"""
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            if data.get('reset'):
+                profiler.reset()
+            if 'enabled' in data:
+                interval_ms = data.get('interval_ms')
+                if data['enabled']:
+                    profiler.start(float(interval_ms) / 1000.0 if interval_ms else None)
+                else:
+                    profiler.stop()
+            return jsonify({'profiler': profiler.snapshot_stats(), 'success': True}), 200
+        
+        if request.args.get('format') == 'collapsed':
+            return Response(profiler.collapsed(), content_type='text/plain; charset=utf-8')
+        limit = int(request.args.get('limit', '50'))
+        return jsonify({'profiler': profiler.snapshot_stats(), 'stacks': profiler.top(limit), 'success': True}), 200
+    
+    except ValueError as e:
+        return jsonify({'error': str(e), 'success': False}), 400
+    
+    except Exception as e:
+        logger.error(f"Error in profiler endpoint: {str(e)}")
+        return jsonify({'error': 'Internal server error', 'success': False}), 500
+
+@app.route('/debug/slow-requests', methods=['GET', 'DELETE'])
+@admin_required
+def debug_slow_requests():
+    """Slowest /chat requests above SLOW_REQUEST_THRESHOLD_MS (DELETE clears them)"""
+    if request.method == 'DELETE':
+        slow_requests.clear()
+    return jsonify({
+        'slow_requests': slow_requests.snapshot_stats(),
+        'requests': slow_requests.slowest(),
+        'success': True
+    }), 200
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     try:
-        model_status = 'loaded' if model else 'not_loaded'
+        model_status = 'loaded' if model else model_state['status']
         embeddings_status = 'ready' if pattern_embeddings else 'not_ready'
         
         return jsonify({
-            'status': 'ok' if model and pattern_embeddings else 'degraded',
-            'model': 'paraphrase-multilingual-MiniLM-L12-v2',
+            'status': 'ok' if is_ready() else 'degraded',
+            'ready': is_ready(),
+            'model': MODEL_NAME,
+            'encoder_backend': ENCODER_BACKEND,
+            'encoder': model.snapshot_stats() if model else None,
             'model_status': model_status,
             'embeddings_status': embeddings_status,
-            'active_contexts': len(user_contexts)
+            'load_seconds': model_state['load_seconds'],
+            'active_contexts': len(context_store),
+            'context_store': context_store.snapshot_stats(),
+            'context_snapshot': context_store.snapshot.snapshot_stats() if context_store.snapshot is not None else None,
+            'intent_cache': intent_cache.snapshot_stats(),
+            'intent_coalescing': scoring_flight.snapshot_stats(),
+            'keyword_fast_path': keyword_matcher.snapshot_stats(),
+            'input_rejects': input_validator.snapshot_stats(),
+            'intents': dict(intents_state, count=len(INTENTS), version=(intent_cache.fingerprint or '')[:12]),
+            'listing_store': listing_store.snapshot_stats() if listing_store is not None else None
         }), 200
     except Exception as e:
         logger.error(f"Error in health check: {str(e)}")
@@ -553,6 +1169,28 @@ def health():
             'error': str(e)
         }), 500
 
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    """Liveness: the process is up and serving HTTP, model may still be loading"""
+    return jsonify({'status': 'alive'}), 200
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    """Readiness: model, pattern index and warmup are done"""
+    body = {
+        'ready': is_ready(),
+        'model_status': model_state['status'],
+        'load_seconds': model_state['load_seconds']
+    }
+    if model_state['error']:
+        body['error'] = model_state['error']
+    return jsonify(body), 200 if is_ready() else 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus-style metrics endpoint"""
+    return Response(metrics_registry.render(), content_type=Registry.CONTENT_TYPE)
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({
@@ -575,14 +1213,25 @@ def internal_error(error):
         'message': 'Lỗi hệ thống. Vui lòng thử lại sau'
     }), 500
 
+# Start loading the model without blocking import (see MODEL_LOAD_MODE)
+if MODEL_LOAD_MODE == 'background':
+    start_model_loading()
+elif MODEL_LOAD_MODE == 'eager':
+    load_model()
+elif MODEL_LOAD_MODE == 'prefork':
+    load_model(prefork=True)
+
 if __name__ == '__main__':
-    import sys
     import io
     # Fix Windows console encoding for emoji
     if sys.platform == 'win32':
         sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    # SIGTERM (docker stop, k8s) exits through atexit so contexts get dumped
+    import signal
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    install_profiler_signal()
     
     print("🤖 AI Chatbot Backend is starting...")
-    print("📦 Loading model: paraphrase-multilingual-MiniLM-L12-v2")
-    print("✅ Server ready at http://localhost:5001")
+    print(f"📦 Loading model: {MODEL_NAME}")
+    print("✅ Server listening at http://localhost:5001 (xem /health/ready)")
     app.run(host='0.0.0.0', port=5001, debug=True)
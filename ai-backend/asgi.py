@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI entry point (chế độ chạy thay thế cho Flask dev server):
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5001
+
+- /chat chạy trên event loop; phần xử lý (detect_intent -> encode, trích
+  entity, chat_turn đọc/ghi SQLite) được đẩy sang một ThreadPoolExecutor có
+  giới hạn (torch / sqlite3 nhả GIL khi chạy)
+- Admission control: vượt quá ASGI_MAX_CONCURRENCY request đang xử lý thì trả
+  503 ngay, request chờ quá ASGI_REQUEST_TIMEOUT cũng trả 503
+- Các route khác (/health, /chat/batch, ...) chuyển cho Flask app qua WSGI
+"""
+
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as flask_app
+from batching import BatcherOverloadedError
+
+logger = logging.getLogger(__name__)
+
+ASGI_ENCODE_WORKERS = int(os.environ.get('ASGI_ENCODE_WORKERS', '4'))
+ASGI_MAX_CONCURRENCY = int(os.environ.get('ASGI_MAX_CONCURRENCY', '64'))
+ASGI_REQUEST_TIMEOUT = float(os.environ.get('ASGI_REQUEST_TIMEOUT', '10'))
+ASGI_MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', str(64 * 1024)))
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+class ChatASGIApp:
+    """Async /chat with a bounded model executor and fast-fail admission control"""
+
+    def __init__(self, wsgi_app, encode_workers=ASGI_ENCODE_WORKERS,
+                 max_concurrency=ASGI_MAX_CONCURRENCY, request_timeout=ASGI_REQUEST_TIMEOUT,
+                 max_body_bytes=ASGI_MAX_BODY_BYTES):
+        self.fallback = WsgiToAsgi(wsgi_app)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, encode_workers),
+                                           thread_name_prefix='asgi-encode')
+        self.max_concurrency = max(1, max_concurrency)
+        self.request_timeout = request_timeout
+        self.max_body_bytes = max_body_bytes
+        self.in_flight = 0
+        self.stats = {'accepted': 0, 'rejected': 0, 'timeouts': 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] == 'http' and scope['path'] == '/chat':
+            await self._chat(scope, receive, send)
+            return
+        await self.fallback(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                if flask_app.encode_batcher:
+                    flask_app.encode_batcher.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _send_json(send, status, body, headers=()):
+        with flask_app.STAGE_LATENCY.time('json_serialization'):
+            payload = json.dumps(body).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(payload)).encode()),
+                *headers,
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+    async def _read_body(self, receive):
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_body_bytes:
+                raise PayloadTooLarge()
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def _chat(self, scope, receive, send):
+        if scope['method'] != 'POST':
+            await self._send_json(send, 405, {
+                'error': 'Method not allowed',
+                'message': 'HTTP method không được hỗ trợ'
+            })
+            return
+
+        # Admission control: shed load immediately instead of queueing
+        if self.in_flight >= self.max_concurrency:
+            self.stats['rejected'] += 1
+            flask_app.CHAT_ERRORS.inc('overloaded')
+            await self._send_json(send, 503, flask_app.chat_error(
+                'Service busy',
+                'Hệ thống đang quá tải. Vui lòng thử lại sau giây lát! ⏳'
+            ), headers=[(b'retry-after', b'1')])
+            return
+
+        self.in_flight += 1
+        self.stats['accepted'] += 1
+        try:
+            status, body = await asyncio.wait_for(self._handle_chat(receive), self.request_timeout)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            flask_app.CHAT_ERRORS.inc('timeout')
+            status, body = 503, flask_app.chat_error(
+                'Service busy',
+                'Hệ thống đang quá tải. Vui lòng thử lại sau giây lát! ⏳'
+            )
+        finally:
+            self.in_flight -= 1
+        await self._send_json(send, status, body)
+
+    async def _handle_chat(self, receive):
+        try:
+            if not flask_app.is_ready():
+                return 503, {
+                    'error': 'AI model chưa được tải. Vui lòng thử lại sau.',
+                    'response': 'Xin lỗi, hệ thống AI đang gặp sự cố. Vui lòng thử lại sau! 🔧',
+                    'success': False
+                }
+
+            try:
+                data = json.loads(await self._read_body(receive) or b'null')
+            except PayloadTooLarge:
+                return 413, {'error': 'Payload too large', 'success': False}
+            except ValueError:
+                data = None
+            if not data or not isinstance(data, dict):
+                return 400, {
+                    'error': 'Invalid request format',
+                    'response': 'Yêu cầu không hợp lệ. Vui lòng gửi dữ liệu JSON.',
+                    'success': False
+                }
+
+            user_id = data.get('user_id', 'default')
+            with flask_app.STAGE_LATENCY.time('validate_input'):
+                is_valid, result, reason = flask_app.validate_input(data.get('message', ''))
+            if not is_valid:
+                flask_app.CHAT_ERRORS.inc('invalid_input')
+                return 400, flask_app.chat_error(result, f'❌ {result}. Vui lòng nhập lại tin nhắn hợp lệ.', reason)
+            user_input = result
+
+            # Encode, entity extraction and the SQLite-backed chat turn all leave the event loop
+            loop = asyncio.get_running_loop()
+            body = await loop.run_in_executor(self.executor, flask_app.chat_reply, user_input, user_id)
+            return 200, body
+
+        except BatcherOverloadedError as e:
+            logger.warning(f"Encoder overloaded: {str(e)}")
+            flask_app.CHAT_ERRORS.inc('overloaded')
+            return 503, flask_app.chat_error(
+                'Service busy',
+                'Hệ thống đang quá tải. Vui lòng thử lại sau giây lát! ⏳'
+            )
+        except Exception as e:
+            logger.error(f"Error in async chat endpoint: {str(e)}")
+            flask_app.CHAT_ERRORS.inc('internal')
+            return 500, flask_app.chat_error(
+                'Internal server error',
+                'Xin lỗi, đã có lỗi xảy ra. Vui lòng thử lại! 😔'
+            )
+
+
+application = ChatASGIApp(flask_app.app)
+
+flask_app.metrics_registry.callback(
+    'asgi_in_flight_requests', 'Async /chat requests currently being handled',
+    lambda: application.in_flight
+)
+flask_app.metrics_registry.callback(
+    'asgi_admission_total', 'Async /chat admission decisions',
+    lambda: {'accepted': application.stats['accepted'], 'rejected': application.stats['rejected']},
+    kind='counter', labelname='decision'
+)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-batching cho model.encode: gom các request encode đồng thời trong một
+cửa sổ ngắn (vd 5ms hoặc N items), chạy 1 lần encode theo batch rồi trả kết
+quả về cho từng request đang chờ.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class BatcherOverloadedError(RuntimeError):
+    """Raised when the encode queue is full or a request waited too long"""
+
+
+class MicroBatcher:
+    """Background thread that coalesces single encode calls into batches"""
+
+    def __init__(self, encode_fn, max_batch_size=32, max_wait_ms=5.0,
+                 max_queue_size=256, timeout=5.0, name="encode-batcher"):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.timeout = float(timeout)
+        self.name = name
+
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue_size)))
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "requests": 0,
+            "batches": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "max_batch_seen": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return self
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def submit(self, text):
+        """Enqueue one text, return a Future resolving to its embedding"""
+        if not self.running:
+            self.start()
+
+        future = Future()
+        try:
+            self._queue.put_nowait((text, future, time.monotonic()))
+        except queue.Full:
+            self.stats["rejected"] += 1
+            raise BatcherOverloadedError("Encode queue is full")
+        self.stats["requests"] += 1
+        return future
+
+    def encode(self, texts):
+        """Drop-in for model.encode(list_of_texts) -> (n, dim) array"""
+        if isinstance(texts, str):
+            texts = [texts]
+        futures = [self.submit(text) for text in texts]
+        try:
+            return np.vstack([f.result(timeout=self.timeout) for f in futures])
+        except FutureTimeoutError:
+            for f in futures:
+                f.cancel()
+            self.stats["timeouts"] += 1
+            raise BatcherOverloadedError("Timed out waiting for encode batch")
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+    def _collect(self):
+        """Block for the first item, then gather more until window closes"""
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+
+            now = time.monotonic()
+            live = []
+            for text, future, enqueued_at in batch:
+                # Skip requests the caller already gave up on
+                if now - enqueued_at > self.timeout or not future.set_running_or_notify_cancel():
+                    if not future.done():
+                        future.set_exception(BatcherOverloadedError("Request expired in queue"))
+                    continue
+                live.append((text, future))
+
+            if not live:
+                continue
+
+            self.stats["batches"] += 1
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(live))
+            try:
+                embeddings = self.encode_fn([text for text, _ in live])
+                for (_, future), embedding in zip(live, embeddings):
+                    future.set_result(embedding)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Error in batched encode: {str(e)}")
+                for _, future in live:
+                    future.set_exception(e)
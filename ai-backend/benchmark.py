@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark in-process cho pipeline chat của ai-backend (không cần chạy server).
+
+Chạy /chat qua Flask test client và gọi trực tiếp detect_intent /
+extract_entities trên một corpus tổng hợp cố định (tiếng Việt + tiếng Anh,
+seed cố định). Mỗi scenario báo throughput, latency p50/p95/p99 và RSS hiện
+tại + phần RSS tăng thêm trong scenario đó (cold start: peak RSS của process con);
+kết quả xuất JSON để so sánh với baseline đã lưu.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --compare bench.json --tolerance 0.2
+    python benchmark.py --scenarios warm,cache_hits --requests 200
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+SCENARIOS = (
+    'cold_start', 'warm', 'cache_hits', 'long_inputs', 'many_users',
+    'detect_intent', 'extract_entities', 'listing_filter'
+)
+
+LISTING_FILTER_ROWS = 1000000
+
+_TYPES_VI = ['căn hộ', 'chung cư', 'nhà riêng', 'biệt thự', 'apartment', 'house', 'villa']
+_TYPES_EN = ['apartment', 'house', 'villa', 'condo', 'townhouse', 'penthouse']
+_PLACES = ['Canada', 'USA', 'Việt Nam', 'Hà Nội', 'Sài Gòn', 'Toronto', 'New York', 'Vancouver']
+_NAMES = ['Nam', 'Lan', 'Minh', 'Hoa', 'Tuấn', 'Linh', 'An', 'Bình']
+
+_TEMPLATES = [
+    lambda r: f"Tìm {r.choice(_TYPES_VI)} {r.randint(1, 5)} phòng ngủ ở {r.choice(_PLACES)} dưới {r.randint(20, 300)}k",
+    lambda r: f"Cần thuê {r.choice(_TYPES_VI)} ở {r.choice(_PLACES)} giá từ {r.randint(1, 20)} đến {r.randint(21, 60)} triệu",
+    lambda r: f"tôi muốn thuê căn hộ {r.randint(1, 4)}pn {r.randint(1, 3)}wc khoảng {r.randint(40, 200)} m2",
+    lambda r: f"tên tôi là {r.choice(_NAMES)}, mình đang tìm {r.choice(_TYPES_VI)} ở {r.choice(_PLACES)}",
+    lambda r: f"có {r.choice(_TYPES_VI)} nào ở {r.choice(_PLACES)} trên {r.randint(50, 150)}k không",
+    lambda r: f"Looking for a {r.choice(_TYPES_EN)} in {r.choice(_PLACES)} under {r.randint(20, 300)}k",
+    lambda r: f"how much is a {r.randint(1, 5)} bedroom {r.choice(_TYPES_EN)} in {r.choice(_PLACES)}?",
+    lambda r: f"show me {r.choice(_TYPES_EN)}s with {r.randint(1, 4)} bathrooms from {r.randint(10, 90)}k to {r.randint(100, 250)}k",
+    lambda r: r.choice(['xin chào', 'hi', 'hello', 'cảm ơn', 'thanks', 'bye', 'tạm biệt', 'help', 'giúp tôi']),
+    lambda r: r.choice(['không thích lắm', 'tuyệt vời quá', 'giá bao nhiêu vậy', 'ở đâu vậy bạn', 'có mấy phòng ngủ']),
+]
+
+_REPEATED = ['hi', 'xin chào', 'cảm ơn', 'help', 'bye', 'giá bao nhiêu', 'tìm nhà ở Canada', 'thanks']
+
+
+def build_corpus(n, seed=42):
+    """Fixed synthetic corpus of n short messages"""
+    rng = random.Random(seed)
+    return [rng.choice(_TEMPLATES)(rng) for _ in range(n)]
+
+
+def build_long_corpus(n, seed=43, target_chars=480):
+    """Messages close to MAX_INPUT_LENGTH built from several templates"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n):
+        parts = []
+        while sum(len(p) + 2 for p in parts) < target_chars - 100:
+            parts.append(rng.choice(_TEMPLATES[:8])(rng))
+        corpus.append('. '.join(parts)[:target_chars])
+    return corpus
+
+
+def peak_rss_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return round(usage / (1024 * 1024) if sys.platform == 'darwin' else usage / 1024, 1)
+
+
+def current_rss_mb():
+    """Resident set size right now (/proc/self/statm); None where /proc is missing"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return round(resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies, wall_seconds, rss_before=None):
+    latencies = sorted(latencies)
+    # ru_maxrss is the lifetime peak of the process, so it can't be split per scenario
+    rss_after = current_rss_mb()
+    return {
+        'requests': len(latencies),
+        'throughput_rps': round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        'rss_mb': rss_after,
+        'rss_delta_mb': round(rss_after - rss_before, 1) if rss_after is not None and rss_before is not None else None,
+    }
+
+
+def run_calls(fn, inputs, rss_before=None):
+    if rss_before is None:
+        rss_before = current_rss_mb()
+    latencies = []
+    wall_start = time.perf_counter()
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, time.perf_counter() - wall_start, rss_before)
+
+
+def run_cold_start(use_disk_cache=True):
+    """Import app + first /chat in a fresh interpreter"""
+    env = dict(os.environ)
+    tmp = None
+    if not use_disk_cache:
+        tmp = tempfile.TemporaryDirectory()
+        env['EMBEDDING_CACHE_DIR'] = tmp.name
+    try:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--cold-child'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        return json.loads(out.strip().splitlines()[-1])
+    finally:
+        if tmp:
+            tmp.cleanup()
+
+
+def cold_child():
+    start = time.perf_counter()
+    import app
+    imported = time.perf_counter()
+    app.wait_until_ready()
+    ready = time.perf_counter()
+    client = app.app.test_client()
+    client.post('/chat', json={'message': 'Tìm apartment ở Canada', 'user_id': 'bench'})
+    first = time.perf_counter()
+    print(json.dumps({
+        'import_seconds': round(imported - start, 3),
+        'ready_seconds': round(ready - start, 3),
+        'first_request_ms': round((first - ready) * 1000, 3),
+        'peak_rss_mb': peak_rss_mb(),
+    }))
+
+
+def build_listing_attributes(n_rows, seed=44):
+    """Synthetic columnar catalog shaped like the House collection"""
+    import numpy as np
+    from listing_filters import ListingAttributes
+    rng = np.random.default_rng(seed)
+    return ListingAttributes.from_columns({
+        'type': rng.choice(['house', 'apartment', 'villa'], n_rows, p=[0.5, 0.4, 0.1]),
+        'country': rng.choice(['canada', 'united states', 'vietnam'], n_rows),
+        'bedrooms': rng.integers(1, 8, n_rows),
+        'bathrooms': rng.integers(1, 5, n_rows),
+        'area': rng.uniform(20, 500, n_rows),
+        'price': rng.integers(10, 400, n_rows) * 1000.0,
+    })
+
+
+def run_listing_filter(app, corpus):
+    """Entity pre-filter over LISTING_FILTER_ROWS listings, uncached and cached"""
+    from listing_filters import AttributeFilter
+    rss_before = current_rss_mb()  # the delta includes the synthetic catalog
+    attributes = build_listing_attributes(LISTING_FILTER_ROWS)
+    entities = [e for e in map(app.extract_entities, corpus) if any(e.values())]
+    uncached = AttributeFilter(attributes, cache_size=0)
+    cached = AttributeFilter(attributes, cache_size=64)
+    result = run_calls(uncached.mask, entities, rss_before)
+    result['rows'] = LISTING_FILTER_ROWS
+    result['cached'] = run_calls(cached.mask, entities)
+    result['cached']['hits'] = cached.stats['hits']
+    return result
+
+
+def run_benchmarks(scenarios, n_requests, seed):
+    results = {}
+
+    if 'cold_start' in scenarios:
+        results['cold_start'] = run_cold_start(use_disk_cache=True)
+        results['cold_start_no_disk_cache'] = run_cold_start(use_disk_cache=False)
+
+    import app
+    if not app.wait_until_ready():
+        raise RuntimeError(f"Model failed to load: {app.model_state['error']}")
+    client = app.app.test_client()
+    corpus = build_corpus(n_requests, seed)
+
+    def post(message, user_id='bench'):
+        response = client.post('/chat', json={'message': message, 'user_id': user_id})
+        if response.status_code >= 500:
+            raise RuntimeError(f"/chat returned {response.status_code}")
+
+    # Warm up allocations / first-call paths outside of the measurements
+    for message in corpus[:20]:
+        post(message)
+
+    if 'warm' in scenarios:
+        app.intent_cache.clear(app.intent_cache.fingerprint)
+        results['warm'] = run_calls(post, corpus)
+
+    if 'cache_hits' in scenarios:
+        rng = random.Random(seed)
+        repeated = [rng.choice(_REPEATED) for _ in range(n_requests)]
+        for message in _REPEATED:
+            post(message)
+        results['cache_hits'] = run_calls(post, repeated)
+
+    if 'long_inputs' in scenarios:
+        app.intent_cache.clear(app.intent_cache.fingerprint)
+        results['long_inputs'] = run_calls(post, build_long_corpus(n_requests, seed + 1))
+
+    if 'many_users' in scenarios:
+        app.intent_cache.clear(app.intent_cache.fingerprint)
+        items = [(message, f'user-{i}') for i, message in enumerate(corpus)]
+        results['many_users'] = run_calls(lambda item: post(*item), items)
+        results['many_users']['active_contexts'] = len(app.context_store)
+
+    if 'detect_intent' in scenarios:
+        app.intent_cache.clear(app.intent_cache.fingerprint)
+        results['detect_intent'] = run_calls(app.detect_intent, build_corpus(n_requests, seed + 2))
+
+    if 'extract_entities' in scenarios:
+        results['extract_entities'] = run_calls(app.extract_entities, corpus)
+
+    if 'listing_filter' in scenarios:
+        results['listing_filter'] = run_listing_filter(app, corpus)
+
+    meta = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'model': app.MODEL_NAME,
+        'encoder_backend': app.ENCODER_BACKEND,
+        'requests': n_requests,
+        'seed': seed,
+    }
+    return {'meta': meta, 'scenarios': results}
+
+
+def compare(current, baseline, tolerance):
+    """Return (report lines, regressed) comparing p50/p95/throughput per scenario"""
+    lines, regressed = [], False
+    for name, now in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        for key, higher_is_worse in (('p50_ms', True), ('p95_ms', True), ('throughput_rps', False),
+                                     ('import_seconds', True), ('ready_seconds', True),
+                                     ('first_request_ms', True)):
+            if key not in now or not before.get(key):
+                continue
+            change = (now[key] - before[key]) / before[key]
+            worse = change > tolerance if higher_is_worse else change < -tolerance
+            regressed |= worse
+            flag = '❌' if worse else '✅'
+            lines.append(f"{flag} {name:<26} {key:<18} {before[key]:>10} -> {now[key]:>10} ({change:+.1%})")
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='In-process benchmark for the ai-backend chat pipeline')
+    parser.add_argument('--requests', type=int, default=500, help='Requests per scenario')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--output', help='Write JSON results to this file')
+    parser.add_argument('--compare', help='Baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative regression before failing (default 20%%)')
+    parser.add_argument('--cold-child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.cold_child:
+        cold_child()
+        return 0
+
+    scenarios = {s.strip() for s in args.scenarios.split(',') if s.strip()}
+    unknown = scenarios - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = run_benchmarks(scenarios, args.requests, args.seed)
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        lines, regressed = compare(results, baseline, args.tolerance)
+        print('\n'.join(lines), file=sys.stderr)
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
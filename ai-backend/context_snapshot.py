@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshot nhị phân của context hội thoại, để scale replica ra / vào mà không
+cần sticky session:
+
+- Khi tắt, mỗi process ghi các context còn sống vào CONTEXT_SNAPSHOT_DIR
+  (file ``contexts-<host>-<pid>.ctxs``, ghi atomic)
+- Khi khởi động, replica khác chỉ index các file (user_id -> vị trí record);
+  record được giải mã lúc user đó gửi request đầu tiên (restore lazy), sau đó
+  nằm trong context store như bình thường
+
+Format (little-endian, struct):
+    header: magic "CTXS", format version (H), số field (H), số record (I),
+            thời điểm tạo (d), tên các field (H độ dài + utf-8, cách nhau ",")
+    record: độ dài body (I), độ dài user_id (H), user_id utf-8, rồi body:
+            last_seen (d), bitmask field có giá trị (I), mỗi giá trị là
+            1 byte kiểu + payload (str: H + utf-8, int: q, float: d)
+
+Field được ánh xạ theo tên nên thêm / bớt field trong CONTEXT_FIELDS vẫn đọc
+được snapshot cũ; version format khác thì file bị bỏ qua.
+"""
+
+import logging
+import mmap
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+from context_store import CONTEXT_FIELDS, UserContext
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CTXS"
+FORMAT_VERSION = 1
+SNAPSHOT_SUFFIX = ".ctxs"
+
+_HEADER = struct.Struct("<4sHHIdH")
+_RECORD = struct.Struct("<IH")
+_BODY = struct.Struct("<dI")
+_TAG = struct.Struct("<B")
+_STR_LEN = struct.Struct("<H")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+_TAG_STR, _TAG_INT, _TAG_FLOAT = 0, 1, 2
+
+
+def _pack_str(value):
+    raw = value.encode("utf-8")[:0xFFFF]
+    return _STR_LEN.pack(len(raw)) + raw
+
+
+def encode_record(user_id, ctx):
+    """One context -> bytes (record header + body)"""
+    mask = 0
+    values = []
+    for i, field in enumerate(CONTEXT_FIELDS):
+        value = getattr(ctx, field)
+        if value is None:
+            continue
+        mask |= 1 << i
+        if isinstance(value, bool) or isinstance(value, int):
+            values.append(_TAG.pack(_TAG_INT) + _INT.pack(int(value)))
+        elif isinstance(value, float):
+            values.append(_TAG.pack(_TAG_FLOAT) + _FLOAT.pack(value))
+        else:
+            values.append(_TAG.pack(_TAG_STR) + _pack_str(str(value)))
+    body = _BODY.pack(ctx.last_seen, mask) + b"".join(values)
+    uid = str(user_id).encode("utf-8")[:0xFFFF]
+    return _RECORD.pack(len(body), len(uid)) + uid + body
+
+
+def decode_body(buf, offset, fields):
+    """Body at offset -> UserContext, mapping the snapshot's fields by name"""
+    last_seen, mask = _BODY.unpack_from(buf, offset)
+    offset += _BODY.size
+    values = {}
+    for i, field in enumerate(fields):
+        if not mask & (1 << i):
+            continue
+        (tag,) = _TAG.unpack_from(buf, offset)
+        offset += _TAG.size
+        if tag == _TAG_INT:
+            (value,) = _INT.unpack_from(buf, offset)
+            offset += _INT.size
+        elif tag == _TAG_FLOAT:
+            (value,) = _FLOAT.unpack_from(buf, offset)
+            offset += _FLOAT.size
+        elif tag == _TAG_STR:
+            (length,) = _STR_LEN.unpack_from(buf, offset)
+            offset += _STR_LEN.size
+            value = bytes(buf[offset:offset + length]).decode("utf-8")
+            offset += length
+        else:
+            raise ValueError(f"Unknown value tag {tag}")
+        values[field] = value
+    return UserContext(last_seen=last_seen, **{k: v for k, v in values.items() if k in CONTEXT_FIELDS})
+
+
+def write_snapshot(path, items):
+    """Write (user_id, UserContext) pairs atomically; return the record count"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    names = ",".join(CONTEXT_FIELDS).encode("utf-8")
+    count = 0
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # Count is patched in once every record is written
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(CONTEXT_FIELDS), 0, time.time(), len(names)))
+            f.write(names)
+            for user_id, ctx in items:
+                f.write(encode_record(user_id, ctx))
+                count += 1
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(CONTEXT_FIELDS), count, time.time(), len(names)))
+        # mkstemp creates 0600; replicas may run as another user on the shared volume
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return count
+
+
+def snapshot_path(directory):
+    """This process' snapshot file"""
+    return os.path.join(directory, f"contexts-{socket.gethostname()}-{os.getpid()}{SNAPSHOT_SUFFIX}")
+
+
+class _SnapshotFile:
+    __slots__ = ("path", "buf", "fields", "data_start")
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_fields, _, _, names_len = _HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise ValueError("not a context snapshot")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"unsupported snapshot version {version}")
+        names = self.buf[_HEADER.size:_HEADER.size + names_len].decode("utf-8")
+        self.fields = tuple(names.split(",")) if names else ()
+        if len(self.fields) != n_fields:
+            raise ValueError("corrupt field list")
+        self.data_start = _HEADER.size + names_len
+
+    def records(self):
+        """Yield (user_id, body offset) for every record"""
+        offset = self.data_start
+        end = len(self.buf)
+        while offset + _RECORD.size <= end:
+            body_len, uid_len = _RECORD.unpack_from(self.buf, offset)
+            offset += _RECORD.size
+            user_id = self.buf[offset:offset + uid_len].decode("utf-8")
+            offset += uid_len
+            if offset + body_len > end:
+                raise ValueError("truncated record")
+            yield user_id, offset
+            offset += body_len
+
+
+class ContextSnapshot:
+    """Index of snapshot records; each one is decoded when its user comes back"""
+
+    def __init__(self, ttl_seconds=1800):
+        self.ttl_seconds = float(ttl_seconds)
+        self._index = {}
+        self._lock = threading.Lock()
+        self.stats = {"files": 0, "indexed": 0, "restored": 0, "expired": 0}
+
+    @classmethod
+    def open_dir(cls, directory, ttl_seconds=1800):
+        """Index every snapshot in directory, newest file winning; drop files older than the TTL"""
+        snapshot = cls(ttl_seconds)
+        if not directory or not os.path.isdir(directory):
+            return snapshot
+        now = time.time()
+        paths = []
+        for name in os.listdir(directory):
+            if not name.endswith(SNAPSHOT_SUFFIX):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if snapshot.ttl_seconds > 0 and now - mtime > snapshot.ttl_seconds:
+                # Every context in it has expired by now
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            paths.append((mtime, path))
+        for _, path in sorted(paths):
+            snapshot.add_file(path)
+        return snapshot
+
+    def add_file(self, path):
+        try:
+            snapshot_file = _SnapshotFile(path)
+            entries = {user_id: (snapshot_file, offset) for user_id, offset in snapshot_file.records()}
+        except (OSError, ValueError, UnicodeDecodeError, struct.error) as e:
+            logger.warning(f"⚠️ Skipping context snapshot {path}: {str(e)}")
+            return 0
+        with self._lock:
+            self._index.update(entries)
+            self.stats["files"] += 1
+            self.stats["indexed"] += len(entries)
+        return len(entries)
+
+    def pop(self, user_id):
+        """Decode and forget the user's record; None if absent or expired"""
+        with self._lock:
+            entry = self._index.pop(user_id, None)
+        if entry is None:
+            return None
+        snapshot_file, offset = entry
+        try:
+            ctx = decode_body(snapshot_file.buf, offset, snapshot_file.fields)
+        except (ValueError, UnicodeDecodeError, struct.error) as e:
+            logger.warning(f"⚠️ Corrupt context record for {user_id}: {str(e)}")
+            return None
+        if self.ttl_seconds > 0 and time.time() - ctx.last_seen > self.ttl_seconds:
+            self.stats["expired"] += 1
+            return None
+        self.stats["restored"] += 1
+        return ctx
+
+    def __len__(self):
+        return len(self._index)
+
+    def snapshot_stats(self):
+        with self._lock:
+            return dict(self.stats, pending=len(self._index))
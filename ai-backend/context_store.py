@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Lưu context hội thoại theo user_id.
+
+- InMemoryContextStore: LRU + idle TTL + giới hạn số entries (mặc định)
+- SqliteContextStore: SQLite cục bộ, giữ context qua restart và dùng chung
+  giữa các worker trên cùng một máy
+
+Mỗi user là một UserContext với schema cố định (__slots__) thay vì dict tự do.
+Store nào cũng có thể gắn một ContextSnapshot (context_snapshot.py): user
+không có trong store thì được restore từ snapshot ở lần get đầu tiên.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_FIELDS = (
+    'name', 'type', 'country', 'bedrooms', 'bathrooms',
+    'min_price', 'max_price', 'area'
+)
+
+
+class UserContext:
+    """Compact per-user conversation record"""
+
+    __slots__ = CONTEXT_FIELDS + ('last_seen',)
+
+    def __init__(self, last_seen=None, **fields):
+        for field in CONTEXT_FIELDS:
+            setattr(self, field, fields.get(field))
+        self.last_seen = last_seen if last_seen is not None else time.time()
+
+    def get(self, key, default=None):
+        """dict-style access so generate_response can use it unchanged"""
+        if key not in CONTEXT_FIELDS:
+            return default
+        value = getattr(self, key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        if key not in CONTEXT_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def update(self, entities):
+        """Copy every non-None known entity into the context"""
+        for key, value in entities.items():
+            if value is not None and key in CONTEXT_FIELDS:
+                setattr(self, key, value)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in CONTEXT_FIELDS
+                if getattr(self, field) is not None}
+
+    def __repr__(self):
+        return f"UserContext({self.to_dict()})"
+
+
+class InMemoryContextStore:
+    """Process-local store with LRU + idle-TTL eviction and a size cap"""
+
+    backend = 'memory'
+
+    def __init__(self, max_entries=10000, ttl_seconds=1800):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.snapshot = None
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evicted_lru': 0,
+            'evicted_ttl': 0,
+        }
+
+    def _expired(self, ctx, now):
+        return self.ttl_seconds > 0 and now - ctx.last_seen > self.ttl_seconds
+
+    def _sweep(self, now):
+        # Entries are kept in access order, so expired ones sit at the front
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if not self._expired(oldest, now):
+                break
+            self._entries.popitem(last=False)
+            self.stats['evicted_ttl'] += 1
+
+    def get(self, user_id):
+        now = time.time()
+        with self._lock:
+            ctx = self._entries.get(user_id)
+            if ctx is not None and self._expired(ctx, now):
+                del self._entries[user_id]
+                self.stats['evicted_ttl'] += 1
+                ctx = None
+            if ctx is None:
+                self.stats['misses'] += 1
+                return self._restore(user_id)
+            self._entries.move_to_end(user_id)
+            ctx.last_seen = now
+            self.stats['hits'] += 1
+            return ctx
+
+    def _restore(self, user_id):
+        # Called with the lock held; snapshot.pop is cheap (one record decode)
+        ctx = self.snapshot.pop(user_id) if self.snapshot is not None else None
+        if ctx is not None:
+            self._entries[user_id] = ctx
+            self._entries.move_to_end(user_id)
+            ctx.last_seen = time.time()
+        return ctx
+
+    def get_or_create(self, user_id):
+        ctx = self.get(user_id)
+        if ctx is None:
+            ctx = UserContext()
+            self.save(user_id, ctx)
+        return ctx
+
+    def items(self):
+        """Unexpired (user_id, context) pairs, for snapshots"""
+        now = time.time()
+        with self._lock:
+            return [(user_id, ctx) for user_id, ctx in self._entries.items() if not self._expired(ctx, now)]
+
+    def save(self, user_id, ctx):
+        now = time.time()
+        ctx.last_seen = now
+        with self._lock:
+            self._entries[user_id] = ctx
+            self._entries.move_to_end(user_id)
+            self._sweep(now)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evicted_lru'] += 1
+
+    def delete(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def snapshot_stats(self):
+        with self._lock:
+            return dict(self.stats, size=len(self._entries), max_entries=self.max_entries)
+
+    def after_fork(self):
+        """Nothing is shared with the parent beyond copy-on-write memory"""
+
+
+class SqliteContextStore:
+    """SQLite-backed store shared by every worker on one host"""
+
+    backend = 'sqlite'
+
+    # Run TTL / size-cap cleanup every N writes rather than on each request
+    CLEANUP_EVERY = 200
+
+    def __init__(self, path, max_entries=100000, ttl_seconds=1800):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self._local = threading.local()
+        self._writes = 0
+        self.snapshot = None
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evicted_lru': 0,
+            'evicted_ttl': 0,
+        }
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        columns = ', '.join(CONTEXT_FIELDS)
+        conn = self._conn()
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS contexts ("
+            f"user_id TEXT PRIMARY KEY, {columns}, last_seen REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_contexts_last_seen ON contexts(last_seen)")
+
+    def _conn(self):
+        # sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id):
+        now = time.time()
+        row = self._conn().execute(
+            f"SELECT {', '.join(CONTEXT_FIELDS)}, last_seen FROM contexts WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        if row is None:
+            self.stats['misses'] += 1
+            ctx = self.snapshot.pop(user_id) if self.snapshot is not None else None
+            if ctx is not None:
+                self.save(user_id, ctx)
+            return ctx
+
+        ctx = UserContext(last_seen=row[-1], **dict(zip(CONTEXT_FIELDS, row[:-1])))
+        if self.ttl_seconds > 0 and now - ctx.last_seen > self.ttl_seconds:
+            self.delete(user_id)
+            self.stats['evicted_ttl'] += 1
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return ctx
+
+    def get_or_create(self, user_id):
+        ctx = self.get(user_id)
+        return ctx if ctx is not None else UserContext()
+
+    def save(self, user_id, ctx):
+        ctx.last_seen = time.time()
+        placeholders = ', '.join('?' for _ in range(len(CONTEXT_FIELDS) + 2))
+        self._conn().execute(
+            f"INSERT OR REPLACE INTO contexts (user_id, {', '.join(CONTEXT_FIELDS)}, last_seen) "
+            f"VALUES ({placeholders})",
+            (user_id, *(getattr(ctx, field) for field in CONTEXT_FIELDS), ctx.last_seen)
+        )
+        self._writes += 1
+        if self._writes % self.CLEANUP_EVERY == 0:
+            self.cleanup()
+
+    def delete(self, user_id):
+        self._conn().execute("DELETE FROM contexts WHERE user_id = ?", (user_id,))
+
+    def items(self):
+        """Unexpired (user_id, context) pairs, for snapshots"""
+        query = f"SELECT user_id, {', '.join(CONTEXT_FIELDS)}, last_seen FROM contexts"
+        params = ()
+        if self.ttl_seconds > 0:
+            query += " WHERE last_seen >= ?"
+            params = (time.time() - self.ttl_seconds,)
+        return [
+            (row[0], UserContext(last_seen=row[-1], **dict(zip(CONTEXT_FIELDS, row[1:-1]))))
+            for row in self._conn().execute(query, params)
+        ]
+
+    def cleanup(self):
+        """Drop idle entries, then the least recently seen ones over the cap"""
+        try:
+            conn = self._conn()
+            if self.ttl_seconds > 0:
+                cur = conn.execute("DELETE FROM contexts WHERE last_seen < ?",
+                                   (time.time() - self.ttl_seconds,))
+                self.stats['evicted_ttl'] += max(cur.rowcount, 0)
+            cur = conn.execute(
+                "DELETE FROM contexts WHERE user_id IN ("
+                "SELECT user_id FROM contexts ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.stats['evicted_lru'] += max(cur.rowcount, 0)
+        except sqlite3.Error as e:
+            logger.warning(f"Context store cleanup failed: {str(e)}")
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM contexts").fetchone()[0]
+
+    def snapshot_stats(self):
+        return dict(self.stats, size=len(self), max_entries=self.max_entries)
+
+    def after_fork(self):
+        """Drop connections inherited from the parent; each worker opens its own"""
+        self._local = threading.local()
+
+
+def create_context_store(backend='memory', max_entries=10000, ttl_seconds=1800, db_path=None):
+    """Build the context store selected by config"""
+    if backend == 'sqlite':
+        return SqliteContextStore(db_path, max_entries=max_entries, ttl_seconds=ttl_seconds)
+    if backend != 'memory':
+        raise ValueError(f"Unknown context store '{backend}', expected 'memory' or 'sqlite'")
+    return InMemoryContextStore(max_entries=max_entries, ttl_seconds=ttl_seconds)
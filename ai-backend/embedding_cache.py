@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Cache pattern embeddings trên đĩa để worker khởi động lại không phải encode
+lại toàn bộ INTENTS. File .npy được memory-map khi load nên nhiều worker
+gunicorn dùng chung một bản page cache.
+
+Key của cache = version format + tên model + hash nội dung INTENTS, nên đổi
+model hoặc sửa patterns sẽ tự động bỏ qua file cũ. Ma trận float16 / int8
+được lưu nguyên dạng nén (scale int8 nằm trong file .json).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from quantization import from_storage, storage_arrays, storage_dtype
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+CACHE_PREFIX = "patterns"
+
+
+def intents_fingerprint(model_name, intents):
+    """Hash of model name + every intent's patterns (order-sensitive)"""
+    payload = {
+        "version": CACHE_VERSION,
+        "model": model_name,
+        "patterns": [[intent, data.get("patterns", [])] for intent, data in intents.items()],
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _paths(cache_dir, fingerprint):
+    base = os.path.join(cache_dir, f"{CACHE_PREFIX}-v{CACHE_VERSION}-{fingerprint[:16]}")
+    return base + ".npy", base + ".json"
+
+
+def load_pattern_matrix(cache_dir, fingerprint, mmap=True):
+    """Return (matrix, row_intents, intent_names) or None on miss"""
+    matrix_path, meta_path = _paths(cache_dir, fingerprint)
+    if not (os.path.exists(matrix_path) and os.path.exists(meta_path)):
+        return None
+
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") != fingerprint or meta.get("version") != CACHE_VERSION:
+            return None
+
+        data = np.load(matrix_path, mmap_mode="r" if mmap else None)
+        row_intents = np.asarray(meta["row_intents"], dtype=np.int32)
+        if data.shape[0] != len(row_intents):
+            logger.warning("Embedding cache is inconsistent, ignoring it")
+            return None
+        return from_storage(data, meta.get("scales")), row_intents, meta["intent_names"]
+    except Exception as e:
+        logger.warning(f"Failed to read embedding cache: {str(e)}")
+        return None
+
+
+def save_pattern_matrix(cache_dir, fingerprint, matrix, row_intents, intent_names):
+    """Atomically write the matrix + metadata, then drop stale cache files"""
+    matrix_path, meta_path = _paths(cache_dir, fingerprint)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Write to temp files then rename so concurrent workers never see
+        # a half-written file
+        data, scales = storage_arrays(matrix)
+        fd, tmp_matrix = tempfile.mkstemp(dir=cache_dir, suffix=".npy.tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.ascontiguousarray(data))
+        fd, tmp_meta = tempfile.mkstemp(dir=cache_dir, suffix=".json.tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": CACHE_VERSION,
+                "fingerprint": fingerprint,
+                "intent_names": list(intent_names),
+                "row_intents": [int(i) for i in row_intents],
+                "dtype": storage_dtype(matrix),
+                "scales": None if scales is None else [float(s) for s in scales],
+            }, f, ensure_ascii=False)
+
+        os.replace(tmp_matrix, matrix_path)
+        os.replace(tmp_meta, meta_path)
+        _remove_stale(cache_dir, keep={matrix_path, meta_path})
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to write embedding cache: {str(e)}")
+        return False
+
+
+def _remove_stale(cache_dir, keep):
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(CACHE_PREFIX + "-") and path not in keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
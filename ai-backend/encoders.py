@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Encoder backends cho intent detection. Chọn bằng ENCODER_BACKEND:
+
+- torch:     SentenceTransformer gốc (full precision, cần torch)
+- onnx:      graph ONNX export từ model gốc, chạy bằng onnxruntime
+- onnx-int8: graph ONNX được quantize động sang int8
+
+Mọi backend đều có cùng interface với SentenceTransformer:
+``encode(list_of_texts) -> np.ndarray (n, dim)``.
+
+BucketedEncoder bọc một backend: cắt input theo ngân sách token
+(MAX_INPUT_TOKENS) và chia mỗi lần encode thành các batch cùng khoảng độ dài
+token (ENCODE_LENGTH_BUCKETS), để tin nhắn ngắn không bị pad theo tin nhắn
+dài nhất; thống kê số token thật / số token sau khi pad. Text chỉ được
+tokenize một lần, backend nhận thẳng input_ids (``encode_ids``).
+
+Export + parity check:
+    python encoders.py export
+    python encoders.py parity --backend onnx-int8
+"""
+
+import argparse
+import logging
+import os
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ENCODER_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+ONNX_MODEL_FILE = 'model.onnx'
+ONNX_INT8_MODEL_FILE = 'model-int8.onnx'
+DEFAULT_MAX_SEQ_LENGTH = 128
+DEFAULT_LENGTH_BUCKETS = (16, 32, 64)
+
+
+def _hf_model_id(model_name):
+    """SentenceTransformer short names live under sentence-transformers/ on the hub"""
+    return model_name if '/' in model_name else f'sentence-transformers/{model_name}'
+
+
+class TorchEncoder:
+    """Current path: full-precision SentenceTransformer"""
+
+    backend = 'torch'
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device='cpu')
+        self.tokenizer = self.model.tokenizer
+        self.max_seq_length = self.model.max_seq_length or DEFAULT_MAX_SEQ_LENGTH
+
+    def set_max_seq_length(self, max_seq_length):
+        self.model.max_seq_length = self.max_seq_length = int(max_seq_length)
+
+    def encode(self, texts, batch_size=32):
+        return self.model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True,
+                                 show_progress_bar=False)
+
+    def encode_ids(self, input_ids):
+        """Encode rows that are already tokenized and truncated, as one padded batch"""
+        import torch
+        features = self.tokenizer.pad({'input_ids': list(input_ids)}, padding=True, return_tensors='pt')
+        with torch.no_grad():
+            return self.model(dict(features))['sentence_embedding'].cpu().numpy()
+
+
+class OnnxEncoder:
+    """Exported transformer run through onnxruntime, mean pooling in NumPy"""
+
+    def __init__(self, model_name, onnx_dir, quantized=False, num_threads=None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.backend = 'onnx-int8' if quantized else 'onnx'
+
+        model_path = os.path.join(onnx_dir, ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"{model_path} not found, run `python encoders.py export` first"
+            )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = int(num_threads)
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+        self.max_seq_length = min(self.tokenizer.model_max_length, DEFAULT_MAX_SEQ_LENGTH)
+
+    def set_max_seq_length(self, max_seq_length):
+        self.max_seq_length = int(max_seq_length)
+
+    def encode(self, texts, batch_size=32):
+        texts = list(texts)
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            chunk = texts[start:start + batch_size]
+            tokens = self.tokenizer(chunk, padding=True, truncation=True,
+                                    max_length=self.max_seq_length, return_tensors='np')
+            outputs.append(self._run(tokens))
+
+        if not outputs:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack(outputs)
+
+    def encode_ids(self, input_ids):
+        """Encode rows that are already tokenized and truncated, as one padded batch"""
+        return self._run(self.tokenizer.pad({'input_ids': list(input_ids)}, padding=True, return_tensors='np'))
+
+    def _run(self, tokens):
+        feeds = {k: v.astype(np.int64) for k, v in tokens.items() if k in self._input_names}
+        if 'token_type_ids' in self._input_names and 'token_type_ids' not in feeds:
+            feeds['token_type_ids'] = np.zeros_like(feeds['input_ids'])
+        hidden = self.session.run(None, feeds)[0]
+
+        # Mean pooling over real tokens, same as the sentence-transformers config
+        mask = tokens['attention_mask'][..., None].astype(np.float32)
+        summed = (hidden * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        return (summed / counts).astype(np.float32)
+
+
+class BucketedEncoder:
+    """Token-budget truncation + length-bucketed batches around any encoder backend"""
+
+    def __init__(self, encoder, max_tokens=None, buckets=DEFAULT_LENGTH_BUCKETS):
+        self.encoder = encoder
+        limit = encoder.max_seq_length
+        self.max_tokens = min(int(max_tokens), limit) if max_tokens else limit
+        encoder.set_max_seq_length(self.max_tokens)
+        # Upper bounds (inclusive) of each length bucket, the budget closes the last one
+        self.buckets = np.array(sorted({int(b) for b in buckets if 0 < int(b) < self.max_tokens})
+                                + [self.max_tokens])
+        self._lock = threading.Lock()
+        self.stats = {'texts': 0, 'truncated': 0, 'batches': 0, 'tokens': 0, 'padded_tokens': 0}
+
+    def __getattr__(self, name):
+        # backend, tokenizer, model_name... of the wrapped encoder
+        return getattr(self.encoder, name)
+
+    def tokenize(self, texts):
+        """(input_ids cut to max_tokens, token count capped at max_tokens + 1) per text"""
+        ids = self.encoder.tokenizer(list(texts), add_special_tokens=True, truncation=True,
+                                     max_length=self.max_tokens + 1)['input_ids']
+        raw = np.fromiter((len(i) for i in ids), dtype=np.int64, count=len(ids))
+        # One token over budget means truncated: drop it but keep the closing special token
+        ids = [i if len(i) <= self.max_tokens else i[:self.max_tokens - 1] + i[-1:] for i in ids]
+        return ids, raw
+
+    def encode(self, texts, batch_size=32):
+        texts = list(texts)
+        if not texts:
+            return self.encoder.encode(texts, batch_size=batch_size)
+
+        # Tokenized once here; the backend gets the ids, not the texts
+        ids, raw = self.tokenize(texts)
+        lengths = np.minimum(raw, self.max_tokens)
+        bucket_of = np.searchsorted(self.buckets, lengths)
+        # Sorted by length, so every batch pads to (almost) its own length
+        order = np.argsort(lengths, kind='stable')
+
+        out = None
+        batches = padded = 0
+        starts = np.searchsorted(bucket_of[order], np.arange(len(self.buckets) + 1))
+        for bucket in range(len(self.buckets)):
+            rows = order[starts[bucket]:starts[bucket + 1]]
+            for start in range(0, len(rows), batch_size):
+                chunk = rows[start:start + batch_size]
+                embeddings = self.encoder.encode_ids([ids[i] for i in chunk])
+                if out is None:
+                    out = np.empty((len(texts), embeddings.shape[1]), dtype=np.float32)
+                out[chunk] = embeddings
+                batches += 1
+                padded += len(chunk) * int(lengths[chunk].max())
+
+        with self._lock:
+            self.stats['texts'] += len(texts)
+            self.stats['truncated'] += int((raw > self.max_tokens).sum())
+            self.stats['batches'] += batches
+            self.stats['tokens'] += int(lengths.sum())
+            self.stats['padded_tokens'] += padded
+        return out
+
+    def padding_waste(self):
+        """Fraction of encoded positions that were padding"""
+        with self._lock:
+            padded = self.stats['padded_tokens']
+            return 1.0 - self.stats['tokens'] / padded if padded else 0.0
+
+    def snapshot_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        return dict(stats, max_tokens=self.max_tokens, buckets=[int(b) for b in self.buckets],
+                    padding_waste=round(self.padding_waste(), 4))
+
+
+def default_onnx_dir(model_name):
+    """Where exported graphs + tokenizer live for a given model"""
+    base = os.environ.get(
+        'EMBEDDING_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+    )
+    return os.path.join(base, 'onnx', model_name.replace('/', '__'))
+
+
+def load_encoder(backend, model_name, onnx_dir=None, num_threads=None):
+    """Build the encoder selected by config"""
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}', expected one of {ENCODER_BACKENDS}")
+    if backend == 'torch':
+        return TorchEncoder(model_name)
+    return OnnxEncoder(model_name, onnx_dir, quantized=(backend == 'onnx-int8'),
+                       num_threads=num_threads)
+
+
+def export_onnx(model_name, onnx_dir, opset=14, quantize=True):
+    """Export the transformer to ONNX (needs torch) and optionally quantize it"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(onnx_dir, exist_ok=True)
+    hf_id = _hf_model_id(model_name)
+    tokenizer = AutoTokenizer.from_pretrained(hf_id)
+    transformer = AutoModel.from_pretrained(hf_id).eval()
+
+    sample = tokenizer(["xin chào", "tìm apartment ở Canada"], padding=True, return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    model_path = os.path.join(onnx_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    tokenizer.save_pretrained(onnx_dir)
+    logger.info(f"✅ Exported ONNX model to {model_path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        int8_path = os.path.join(onnx_dir, ONNX_INT8_MODEL_FILE)
+        quantize_dynamic(model_path, int8_path, weight_type=QuantType.QInt8)
+        logger.info(f"✅ Quantized ONNX model to {int8_path}")
+
+
+def parity_report(reference, candidate, intents, threshold=0.5):
+    """Compare intent decisions of two encoders on the INTENTS patterns"""
+    from parity import intent_parity
+
+    report, ref_emb, cand_emb = intent_parity(intents, reference.encode, candidate.encode, threshold)
+    cosine = (ref_emb * cand_emb).sum(axis=1) / np.clip(
+        np.linalg.norm(ref_emb, axis=1) * np.linalg.norm(cand_emb, axis=1), 1e-12, None
+    )
+    return dict(
+        report,
+        reference=getattr(reference, 'backend', 'reference'),
+        candidate=getattr(candidate, 'backend', 'candidate'),
+        min_embedding_cosine=float(cosine.min()) if len(cosine) else 1.0,
+        mean_embedding_cosine=float(cosine.mean()) if len(cosine) else 1.0,
+    )
+
+
+def main(argv=None):
+    import json
+
+    parser = argparse.ArgumentParser(description='Encoder backend tools')
+    parser.add_argument('command', choices=['export', 'parity'])
+    parser.add_argument('--model', default=os.environ.get('MODEL_NAME', 'paraphrase-multilingual-MiniLM-L12-v2'))
+    parser.add_argument('--onnx-dir', default=None)
+    parser.add_argument('--backend', default='onnx-int8', choices=ENCODER_BACKENDS)
+    parser.add_argument('--no-quantize', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    onnx_dir = args.onnx_dir or default_onnx_dir(args.model)
+
+    if args.command == 'export':
+        export_onnx(args.model, onnx_dir, quantize=not args.no_quantize)
+        return 0
+
+    # Only INTENTS is needed here, don't let app start its own model load
+    os.environ.setdefault('MODEL_LOAD_MODE', 'manual')
+    from app import INTENTS, INTENT_THRESHOLD
+    reference = load_encoder('torch', args.model)
+    candidate = load_encoder(args.backend, args.model, onnx_dir)
+    report = parity_report(reference, candidate, INTENTS, INTENT_THRESHOLD)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if not report['mismatches'] else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Entity extraction một lượt: mọi pattern (loại nhà, quốc gia, phòng ngủ,
+phòng tắm, giá, diện tích) được gộp thành một regex compile sẵn lúc import.
+Message được lowercase một lần rồi quét bằng một lần finditer; mỗi match
+điền entity tương ứng. Đơn vị giá (k, triệu...) gắn với chính con số được
+match thay vì quét cả câu.
+
+Dùng cho cả request /chat lẫn xử lý offline hàng loạt (extract_many).
+"""
+
+import re
+
+ENTITY_KEYS = ("type", "country", "bedrooms", "bathrooms", "min_price", "max_price", "area")
+
+# The trailing lookahead stops backtracking to a shorter prefix ("25" -> "2")
+# that would slip past the checks below
+_NUM = r'\d+(?:[,\.]\d+)?(?![,\.]?\d)'
+# (?!\w) keeps "k" / "tr" from matching the first letter of the next word
+_UNIT = r'(?:k|triệu|tr|nghìn|ngàn|đô|dollar|\$)(?!\w)'
+# A number followed by a room / area word is not a price
+_NOT_ROOM = (
+    r'(?!\s*(?:phòng|pn\b|bedroom|bed|room|ngủ|br\b|ba\b|wc|bathroom|bath|toilet|'
+    r'm2|m²|mét|sq|ft))'
+)
+# "từ N đến M ..." is only read as a whole; "từ N" / "dưới N" alone must not
+# take the low end of a range the range pattern rejected (e.g. a room range)
+_NOT_RANGE_LO = r'(?!\s*(?:đến|to|-|~)\s*\$?\d)'
+
+_UNIT_SCALE = {
+    'k': 1000, 'nghìn': 1000, 'ngàn': 1000,
+    'triệu': 1000000, 'tr': 1000000,
+}
+
+# Order matters when two alternatives start at the same position
+_TOKEN_PATTERNS = [
+    # Prices
+    ('range', rf'(?:(?:từ|from)\s*)?\$?(?P<range_lo>{_NUM})\s*(?P<range_lo_unit>{_UNIT})?\s*'
+              rf'(?:đến|to|-|~)\s*\$?(?P<range_hi>{_NUM})\s*(?P<range_hi_unit>{_UNIT})?{_NOT_ROOM}'),
+    ('under', rf'(?:dưới|under|below|<=|<|max|tối đa|không quá|ko quá|không vượt quá)\s*'
+              rf'\$?(?P<under_num>{_NUM})\s*(?P<under_unit>{_UNIT})?{_NOT_ROOM}{_NOT_RANGE_LO}'),
+    ('over', rf'(?:trên|over|above|>=|>|min|tối thiểu|từ|ít nhất|it nhất)\s*'
+             rf'\$?(?P<over_num>{_NUM})\s*(?P<over_unit>{_UNIT})?{_NOT_ROOM}{_NOT_RANGE_LO}'),
+    # Area
+    ('area', r'(?P<area_num>\d+)\s*(?:m2|m²|mét vuông|sq\s*ft|ft2|ft²)'),
+    # Bathrooms before the generic "N phòng" bedroom form
+    ('bath', r'(?P<bath_num>\d+)\s*(?:phòng tắm|wc|bathrooms?|baths?|toilet)'),
+    ('bath_ba', r'(?P<bath_ba_num>\d+)ba\b'),
+    # Bedrooms, in the original priority order
+    ('bed', r'(?P<bed_num>\d+)\s*(?:phòng ngủ|pn|bedrooms?|beds?|ngủ)'),
+    ('bed_with', r'(?:có|with)\s*(?P<bed_with_num>\d+)\s*(?:phòng|room)(?!\s*tắm)'),
+    ('bed_br', r'(?P<bed_br_num>\d+)br\b'),
+    ('bed_room', r'(?P<bed_room_num>\d+)\s*(?:phòng|room)'),
+    # House type
+    ('apartment', r'apartment|căn hộ|chung cư|flat|condo|condominium'),
+    ('house', r'\bhouse\b|nhà\s+(?:riêng|phố|ở)|townhouse|nhà liền kề'),
+    ('villa', r'villa|biệt thự|mansion|penthouse'),
+    # Country
+    ('canada', r'canada|canadian|\bca\b|toronto|vancouver|montreal'),
+    ('usa', r'\bmỹ\b|usa|\bus\b|united states|america|american|new york|california|texas'),
+    ('vietnam', r'việt nam|vietnam|\bvn\b|vietnamese|hà nội|sài gòn|hcm|hanoi|saigon'),
+]
+
+_SCANNER = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in _TOKEN_PATTERNS))
+
+# Lower number = higher priority, mirrors the old if/elif chains
+_TYPE_PRIORITY = {'apartment': (0, 'Apartment'), 'house': (1, 'House'), 'villa': (2, 'Villa')}
+_COUNTRY_PRIORITY = {'canada': (0, 'Canada'), 'usa': (1, 'United States'), 'vietnam': (2, 'Vietnam')}
+_BED_PRIORITY = {'bed': 0, 'bed_with': 1, 'bed_br': 2, 'bed_room': 3}
+_BATH_PRIORITY = {'bath': 0, 'bath_ba': 1}
+
+
+def _to_float(raw):
+    return float(raw.replace(',', '.'))
+
+
+def _scale_price(value, unit):
+    """Apply the unit attached to this number; bare small numbers mean thousands"""
+    scale = _UNIT_SCALE.get(unit)
+    if scale:
+        return value * scale
+    if value < 1000:
+        return value * 1000
+    return value
+
+
+def empty_entities():
+    return dict.fromkeys(ENTITY_KEYS)
+
+
+class EntityExtractor:
+    """Single-pass extractor over a precompiled combined scanner"""
+
+    def __init__(self, scanner=_SCANNER):
+        self.scanner = scanner
+
+    def extract(self, text):
+        entities = empty_entities()
+        if not text:
+            return entities
+
+        best_type = best_country = best_bed = best_bath = None
+        under = over = price_range = None
+
+        for match in self.scanner.finditer(text.lower()):
+            kind = match.lastgroup
+            if kind in _TYPE_PRIORITY:
+                if best_type is None or _TYPE_PRIORITY[kind] < best_type:
+                    best_type = _TYPE_PRIORITY[kind]
+            elif kind in _COUNTRY_PRIORITY:
+                if best_country is None or _COUNTRY_PRIORITY[kind] < best_country:
+                    best_country = _COUNTRY_PRIORITY[kind]
+            elif kind in _BED_PRIORITY:
+                candidate = (_BED_PRIORITY[kind], int(match.group(f'{kind}_num')))
+                if best_bed is None or candidate[0] < best_bed[0]:
+                    best_bed = candidate
+            elif kind in _BATH_PRIORITY:
+                candidate = (_BATH_PRIORITY[kind], int(match.group(f'{kind}_num')))
+                if best_bath is None or candidate[0] < best_bath[0]:
+                    best_bath = candidate
+            elif kind == 'under' and under is None:
+                under = _scale_price(_to_float(match.group('under_num')), match.group('under_unit'))
+            elif kind == 'over' and over is None:
+                over = _scale_price(_to_float(match.group('over_num')), match.group('over_unit'))
+            elif kind == 'range' and price_range is None:
+                price_range = self._range(match)
+            elif kind == 'area' and entities['area'] is None:
+                area_value = int(match.group('area_num'))
+                # Validate area (reasonable range)
+                if 10 <= area_value <= 10000:
+                    entities['area'] = area_value
+
+        if best_type:
+            entities['type'] = best_type[1]
+        if best_country:
+            entities['country'] = best_country[1]
+        if best_bed:
+            entities['bedrooms'] = best_bed[1]
+        if best_bath:
+            entities['bathrooms'] = best_bath[1]
+        if under is not None:
+            entities['max_price'] = int(under)
+        if over is not None:
+            entities['min_price'] = int(over)
+        if price_range is not None:
+            entities['min_price'], entities['max_price'] = price_range
+
+        return self._validate(entities)
+
+    @staticmethod
+    def _range(match):
+        lo = _to_float(match.group('range_lo'))
+        hi = _to_float(match.group('range_hi'))
+        # "từ 100 đến 200k": the trailing unit applies to both ends
+        hi_unit = match.group('range_hi_unit')
+        lo_unit = match.group('range_lo_unit') or hi_unit
+        if _UNIT_SCALE.get(lo_unit) or _UNIT_SCALE.get(hi_unit):
+            lo *= _UNIT_SCALE.get(lo_unit, 1)
+            hi *= _UNIT_SCALE.get(hi_unit, 1)
+        elif lo < 1000:
+            lo *= 1000
+            hi *= 1000
+        return int(lo), int(hi)
+
+    @staticmethod
+    def _validate(entities):
+        if entities["bedrooms"] is not None and not 1 <= entities["bedrooms"] <= 20:
+            entities["bedrooms"] = None
+        if entities["bathrooms"] is not None and not 1 <= entities["bathrooms"] <= 20:
+            entities["bathrooms"] = None
+        if entities["min_price"] is not None and entities["min_price"] < 0:
+            entities["min_price"] = None
+        if entities["max_price"] is not None and entities["max_price"] < 0:
+            entities["max_price"] = None
+
+        # Swap if min > max
+        if entities["min_price"] and entities["max_price"]:
+            if entities["min_price"] > entities["max_price"]:
+                entities["min_price"], entities["max_price"] = entities["max_price"], entities["min_price"]
+        return entities
+
+    def extract_many(self, texts):
+        """Batch API: list of entity dicts, one per message"""
+        return [self.extract(text) for text in texts]
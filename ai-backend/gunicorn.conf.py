@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Cấu hình gunicorn nhiều worker dùng chung model (pre-fork, copy-on-write):
+
+    gunicorn -c gunicorn.conf.py app:app
+
+- Master import app.py một lần (preload_app) và load model + pattern matrix
+  trước khi fork; worker thừa hưởng các trang nhớ này qua copy-on-write
+- Pattern matrix là file .npy mmap read-only nên nằm trong page cache, dùng
+  chung giữa mọi worker
+- gc.freeze() trước khi fork: GC của worker không quét (và không ghi refcount /
+  GC header vào) các object của master, tránh làm bẩn trang nhớ dùng chung
+- Warmup và thread của micro-batcher chạy trong từng worker (post_fork)
+- Worker ghi snapshot context khi thoát (worker_exit, xem CONTEXT_SNAPSHOT_DIR)
+- PROFILER_SIGNAL (mặc định SIGUSR2) gắn trong từng worker sau khi gunicorn đặt
+  signal handler của nó (post_worker_init); gửi vào PID worker, không phải
+  master (USR2 của master là nâng cấp binary)
+"""
+
+import gc
+import os
+import sys
+
+# Must be set before gunicorn preloads app.py in the master
+os.environ.setdefault('MODEL_LOAD_MODE', 'prefork')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('GUNICORN_WORKERS', '4'))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+preload_app = True
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+
+
+def when_ready(server):
+    # Runs in the master after the app is preloaded, before any worker forks
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"Model preloaded, {gc.get_freeze_count()} objects frozen before fork")
+
+
+def post_fork(server, worker):
+    import app
+    app.init_worker()
+
+
+def post_worker_init(worker):
+    import app
+    app.install_profiler_signal()
+
+
+def worker_exit(server, worker):
+    import app
+    app.dump_contexts()
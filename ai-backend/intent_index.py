@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Intent index: tất cả pattern embeddings được gộp thành một ma trận float32
+đã chuẩn hoá L2, kèm mảng ánh xạ mỗi dòng về intent tương ứng.
+Chấm điểm = 1 phép nhân ma trận + reduce max theo từng intent.
+Ma trận có thể lưu dạng float16 / int8 (xem quantization.py).
+"""
+
+import numpy as np
+
+from quantization import quantize
+
+
+def l2_normalize(vectors):
+    """L2-normalize rows of a 2D array (float32)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class IntentIndex:
+    """Stacked, normalized pattern matrix for single-matmul intent scoring"""
+
+    def __init__(self, matrix, row_intents, intent_names):
+        # matrix: (n_patterns, dim) float32 or QuantizedMatrix, rows already L2-normalized
+        # row_intents: (n_patterns,) int32, index into intent_names
+        self.matrix = matrix
+        self.row_intents = np.asarray(row_intents, dtype=np.int32)
+        self.intent_names = list(intent_names)
+        # Rows are grouped by intent, so reduceat over the group starts
+        # gives the per-intent max in one call
+        self._group_starts = np.flatnonzero(
+            np.r_[True, self.row_intents[1:] != self.row_intents[:-1]]
+        )
+        self._group_intents = self.row_intents[self._group_starts]
+
+    @classmethod
+    def from_pattern_embeddings(cls, pattern_embeddings, dtype="float32"):
+        """Build index from {intent: (n_i, dim) embeddings}, stored as ``dtype``"""
+        names = []
+        blocks = []
+        rows = []
+        for intent, embeddings in pattern_embeddings.items():
+            embeddings = np.asarray(embeddings)
+            if embeddings.size == 0:
+                continue
+            rows.append(np.full(len(embeddings), len(names), dtype=np.int32))
+            names.append(intent)
+            blocks.append(embeddings)
+
+        if not blocks:
+            raise ValueError("pattern_embeddings is empty")
+
+        matrix = quantize(l2_normalize(np.vstack(blocks)), dtype)
+        return cls(matrix, np.concatenate(rows), names)
+
+    def pattern_embeddings(self):
+        """Return {intent: rows of the normalized matrix (float32)}"""
+        result = {}
+        ends = np.r_[self._group_starts[1:], len(self.row_intents)]
+        for start, end, intent in zip(self._group_starts, ends, self._group_intents):
+            result[self.intent_names[intent]] = self.matrix[start:end]
+        return result
+
+    def __len__(self):
+        return len(self.intent_names)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    def intent_scores(self, query_embeddings):
+        """Return (n_queries, n_intents) max cosine similarity per intent"""
+        queries = l2_normalize(query_embeddings)
+        sims = (self.matrix @ queries.T).T
+        grouped = np.maximum.reduceat(sims, self._group_starts, axis=1)
+
+        scores = np.full((len(queries), len(self.intent_names)), -1.0, dtype=np.float32)
+        scores[:, self._group_intents] = grouped
+        return scores
+
+    def best(self, query_embedding):
+        """Return (intent, score) of the best match for a single query"""
+        scores = self.intent_scores(query_embedding)[0]
+        idx = int(np.argmax(scores))
+        return self.intent_names[idx], float(scores[idx])
+
+    def best_many(self, query_embeddings):
+        """Return [(intent, score), ...], one per query row"""
+        scores = self.intent_scores(query_embeddings)
+        idx = np.argmax(scores, axis=1)
+        best = scores[np.arange(len(idx)), idx]
+        return [(self.intent_names[i], float(score)) for i, score in zip(idx, best)]
+
+    def _top(self, scores, k):
+        k = max(1, min(k, len(scores)))
+        idx = np.argpartition(-scores, k - 1)[:k]
+        idx = idx[np.argsort(-scores[idx])]
+        return [(self.intent_names[i], float(scores[i])) for i in idx]
+
+    def top_k(self, query_embedding, k=3):
+        """Return [(intent, score), ...] sorted by score, highest first"""
+        return self._top(self.intent_scores(query_embedding)[0], k)
+
+    def rank_many(self, query_embeddings, k=3):
+        """Return [(intent, score, top-k [(intent, score), ...]), ...] from one scoring pass"""
+        scores = self.intent_scores(query_embeddings)
+        rows = np.arange(len(scores))
+        best = scores.argmax(axis=1)
+        k = min(k, scores.shape[1])
+        if k > 0:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+        names = self.intent_names
+        return [
+            (names[best[r]], float(scores[r, best[r]]),
+             [(names[i], float(scores[r, i])) for i in top[r]] if k > 0 else [])
+            for r in rows
+        ]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+INTENTS (patterns + responses) nạp từ file ngoài (intents.json, hoặc YAML nếu
+có PyYAML) thay vì hard-code trong app.py, và được theo dõi để hot-reload:
+
+- IntentFileWatcher: thread poll mtime/size của file, gọi callback khi đổi
+- build_index_incremental: chỉ encode pattern mới / đã sửa, các pattern còn lại
+  dùng lại vector từ index đang chạy
+- app.reload_intents() build index mới ở bên ngoài rồi mới gán đè global, nên
+  request đang chạy vẫn dùng trọn index cũ, không bị chặn
+"""
+
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from intent_index import IntentIndex
+
+logger = logging.getLogger(__name__)
+
+
+def validate_intents(intents):
+    """Raise ValueError unless intents is {name: {"patterns": [str], "responses": [str]}}"""
+    if not isinstance(intents, dict) or not intents:
+        raise ValueError("INTENTS must be a non-empty object of intents")
+    for name, data in intents.items():
+        if not isinstance(data, dict):
+            raise ValueError(f"Intent '{name}' must be an object")
+        for field in ("patterns", "responses"):
+            values = data.get(field, [])
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                raise ValueError(f"Intent '{name}': '{field}' must be a list of strings")
+    if not any(data.get("patterns") for data in intents.values()):
+        raise ValueError("INTENTS has no patterns")
+    return intents
+
+
+def load_intents(path):
+    """Read and validate an intents file (.json, or .yaml / .yml with PyYAML)"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("PyYAML is required for YAML intents files: pip install pyyaml")
+            intents = yaml.safe_load(f)
+        else:
+            intents = json.load(f)
+    return validate_intents(intents)
+
+
+def known_pattern_vectors(intents, index):
+    """{pattern: normalized vector} for every pattern already in a live index"""
+    if index is None:
+        return {}
+    vectors = {}
+    blocks = index.pattern_embeddings()
+    for intent, data in intents.items():
+        block = blocks.get(intent)
+        patterns = data.get("patterns", [])
+        # Rows of an intent follow its patterns in order
+        if block is None or len(block) != len(patterns):
+            continue
+        for pattern, vector in zip(patterns, block):
+            vectors[pattern] = vector
+    return vectors
+
+
+def build_index_incremental(intents, encode_fn, known=None, dtype="float32"):
+    """IntentIndex over intents, encoding only patterns missing from ``known``.
+
+    Returns (index, number of patterns encoded, number reused).
+    """
+    known = known or {}
+    missing = []
+    for data in intents.values():
+        for pattern in data.get("patterns", []):
+            if pattern not in known and pattern not in missing:
+                missing.append(pattern)
+
+    vectors = dict(known)
+    if missing:
+        vectors.update(zip(missing, np.asarray(encode_fn(missing), dtype=np.float32)))
+
+    embeddings = {}
+    reused = 0
+    for intent, data in intents.items():
+        patterns = data.get("patterns", [])
+        if patterns:
+            embeddings[intent] = np.stack([vectors[p] for p in patterns])
+            reused += sum(1 for p in patterns if p in known)
+    return IntentIndex.from_pattern_embeddings(embeddings, dtype), len(missing), reused
+
+
+class IntentFileWatcher:
+    """Poll a file's (mtime, size) and call ``on_change()`` when it moves"""
+
+    def __init__(self, path, on_change, interval=5.0):
+        self.path = path
+        self.on_change = on_change
+        self.interval = float(interval)
+        self._signature = self._stat()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def check(self):
+        """Call on_change() if the file changed since the last check; True if it did"""
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            self.on_change()
+        except Exception as e:
+            logger.error(f"❌ Intents reload failed: {str(e)}")
+        return True
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return self._thread
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self.interval):
+                self.check()
+
+        self._thread = threading.Thread(target=run, name="intents-watcher", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(1.0)
+            self._thread = None
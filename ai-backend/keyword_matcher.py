@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Fast path theo từ khoá: automaton Aho-Corasick build từ patterns của INTENTS.
+Nếu input khớp rõ ràng với pattern của đúng một intent thì trả kết quả luôn,
+không cần gọi model.encode. Trường hợp mơ hồ vẫn đi qua semantic scoring.
+
+Modes:
+- exact:    cả câu (đã chuẩn hoá, bỏ dấu câu 2 đầu) trùng đúng 1 pattern
+- contains: các pattern khớp (theo ranh giới từ, ưu tiên cụm dài nhất) đều
+            thuộc 1 intent và phủ ít nhất ``min_coverage`` độ dài input
+- off:      tắt fast path
+"""
+
+import threading
+from collections import deque
+
+from response_cache import normalize_text
+
+KEYWORD_MODES = ('exact', 'contains', 'off')
+_EDGE_PUNCTUATION = ' .,!?~…;:"\'()'
+
+
+class _Node:
+    __slots__ = ('children', 'fail', 'outputs')
+
+    def __init__(self):
+        self.children = {}
+        self.fail = None
+        self.outputs = []  # (pattern_length, intents)
+
+
+class KeywordMatcher:
+    """Precompiled multi-pattern matcher over INTENTS patterns"""
+
+    def __init__(self, intents, mode='exact', min_coverage=0.6):
+        if mode not in KEYWORD_MODES:
+            raise ValueError(f"Unknown keyword mode '{mode}', expected one of {KEYWORD_MODES}")
+        self.mode = mode
+        self.min_coverage = float(min_coverage)
+        self._lock = threading.Lock()
+        self.stats = {'lookups': 0, 'hits': 0, 'ambiguous': 0}
+
+        # pattern -> set of intents; a pattern listed under several intents
+        # is ambiguous by definition
+        self.patterns = {}
+        for intent, data in intents.items():
+            for pattern in data.get('patterns', []):
+                key = self._clean(pattern)
+                if key:
+                    self.patterns.setdefault(key, set()).add(intent)
+
+        self._root = self._build(self.patterns)
+
+    @staticmethod
+    def _clean(text):
+        return normalize_text(text).strip(_EDGE_PUNCTUATION)
+
+    @staticmethod
+    def _build(patterns):
+        root = _Node()
+        for pattern, intents in patterns.items():
+            node = root
+            for ch in pattern:
+                node = node.children.setdefault(ch, _Node())
+            node.outputs.append((len(pattern), frozenset(intents)))
+
+        # BFS to wire failure links
+        root.fail = root
+        queue = deque()
+        for child in root.children.values():
+            child.fail = root
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for ch, child in node.children.items():
+                fail = node.fail
+                while fail is not root and ch not in fail.children:
+                    fail = fail.fail
+                child.fail = fail.children.get(ch, root)
+                child.outputs = child.outputs + child.fail.outputs
+                queue.append(child)
+        return root
+
+    def find_all(self, text):
+        """Return [(start, end, intents)] for whole-word pattern hits"""
+        matches = []
+        node = self._root
+        for i, ch in enumerate(text):
+            while node is not self._root and ch not in node.children:
+                node = node.fail
+            node = node.children.get(ch, self._root)
+            for length, intents in node.outputs:
+                start, end = i - length + 1, i + 1
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                if end < len(text) and text[end].isalnum():
+                    continue
+                matches.append((start, end, intents))
+        return matches
+
+    def _contains(self, text):
+        """Return (intent or None, ambiguous)"""
+        matches = self.find_all(text)
+        if not matches:
+            return None, False
+
+        # Keep only maximal matches: "không được" wins over "không" / "được"
+        maximal = [
+            m for m in matches
+            if not any(o is not m and o[0] <= m[0] and m[1] <= o[1] and (o[1] - o[0]) > (m[1] - m[0])
+                       for o in matches)
+        ]
+        intents = set()
+        for _, _, hit in maximal:
+            intents |= hit
+        if len(intents) != 1:
+            return None, True
+
+        covered = set()
+        for start, end, _ in maximal:
+            covered.update(range(start, end))
+        letters = sum(1 for ch in text if not ch.isspace())
+        covered_letters = sum(1 for i in covered if not text[i].isspace())
+        if not letters or covered_letters / letters < self.min_coverage:
+            return None, False
+        return next(iter(intents)), False
+
+    def match(self, text):
+        """Return the intent for an unambiguous keyword hit, else None"""
+        if self.mode == 'off':
+            return None
+
+        cleaned = self._clean(text)
+        if self.mode == 'exact':
+            intents = self.patterns.get(cleaned)
+            ambiguous = bool(intents) and len(intents) > 1
+            intent = next(iter(intents)) if intents and not ambiguous else None
+        else:
+            intent, ambiguous = self._contains(cleaned)
+
+        with self._lock:
+            self.stats['lookups'] += 1
+            if ambiguous:
+                self.stats['ambiguous'] += 1
+            if intent:
+                self.stats['hits'] += 1
+        return intent
+
+    def snapshot_stats(self):
+        with self._lock:
+            lookups = self.stats['lookups']
+            return dict(
+                self.stats,
+                mode=self.mode,
+                patterns=len(self.patterns),
+                match_rate=round(self.stats['hits'] / lookups, 4) if lookups else 0.0
+            )
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-filter listings theo entities của chat (type, country, bedrooms,
+bathrooms, min_price, max_price, area) trên dữ liệu dạng cột:
+
+- type / country: mã categorical (int16) + bảng từ vựng, so sánh 1 số nguyên
+- bedrooms / bathrooms / area / price: mảng NumPy, predicate dạng khoảng
+- Mask kết hợp được cache (LRU) theo tuple entities, nên các câu hỏi lặp lại
+  của cùng một bộ lọc không phải tính lại
+
+Các cột được build một lần cho mỗi segment của listing store rồi ghép lại
+(chỉ remap mã categorical), hoặc nạp thẳng từ file export JSON / NDJSON.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+FILTER_KEYS = ("type", "country", "bedrooms", "bathrooms", "min_price", "max_price", "area")
+
+CATEGORICAL_COLUMNS = ("type", "country")
+# name -> (dtype, missing value); NaN / -1 never pass a predicate
+NUMERIC_COLUMNS = {
+    "bedrooms": (np.int16, -1),
+    "bathrooms": (np.int16, -1),
+    "area": (np.float32, np.nan),
+    "price": (np.float64, np.nan),
+}
+
+# "khoảng 80 m2" matches listings within ±25% of the requested area
+AREA_TOLERANCE = 0.25
+
+
+def _encode(values):
+    """Strings -> (sorted vocabulary, int16/int32 codes)"""
+    vocab, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    dtype = np.int16 if len(vocab) < np.iinfo(np.int16).max else np.int32
+    return [str(v) for v in vocab], codes.astype(dtype, copy=False)
+
+
+class ListingAttributes:
+    """Columnar listing attributes: categorical codes + numeric arrays"""
+
+    def __init__(self, vocab, codes, numeric, size):
+        self.vocab = vocab
+        self.codes = codes
+        self.numeric = numeric
+        self.size = size
+        self._lookup = {name: {value: i for i, value in enumerate(values)} for name, values in vocab.items()}
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Build from raw columns (see search.listing_columns); missing columns are all-missing"""
+        size = len(next(iter(columns.values()))) if columns else 0
+        vocab, codes, numeric = {}, {}, {}
+        for name in CATEGORICAL_COLUMNS:
+            values = columns.get(name)
+            vocab[name], codes[name] = _encode(values if values is not None else [""] * size)
+        for name, (dtype, missing) in NUMERIC_COLUMNS.items():
+            values = columns.get(name)
+            if values is None:
+                numeric[name] = np.full(size, missing, dtype=dtype)
+            else:
+                numeric[name] = np.asarray(values, dtype=dtype)
+        return cls(vocab, codes, numeric, size)
+
+    @classmethod
+    def from_listings(cls, listings):
+        from search import listing_columns
+        return cls.from_columns(listing_columns(listings))
+
+    @classmethod
+    def from_export(cls, path, chunk_size=100000):
+        """Stream a House export (JSON array / NDJSON) into columns, chunk by chunk"""
+        from search import iter_listings, listing_columns
+        parts, chunk = [], []
+        for listing in iter_listings(path):
+            chunk.append(listing)
+            if len(chunk) >= chunk_size:
+                parts.append(cls.from_columns(listing_columns(chunk)))
+                chunk = []
+        if chunk or not parts:
+            parts.append(cls.from_columns(listing_columns(chunk)))
+        return cls.concat(parts)
+
+    @classmethod
+    def concat(cls, parts):
+        """Concatenate row-wise, merging vocabularies and remapping codes"""
+        parts = list(parts)
+        if len(parts) == 1:
+            return parts[0]
+        if not parts:
+            return cls.from_columns({})
+        vocab, codes, numeric = {}, {}, {}
+        for name in CATEGORICAL_COLUMNS:
+            merged = sorted(set().union(*(p.vocab[name] for p in parts)))
+            index = {value: i for i, value in enumerate(merged)}
+            dtype = np.int16 if len(merged) < np.iinfo(np.int16).max else np.int32
+            remapped = []
+            for part in parts:
+                remap = np.array([index[v] for v in part.vocab[name]], dtype=dtype)
+                remapped.append(remap[part.codes[name]] if len(remap) else part.codes[name].astype(dtype))
+            vocab[name] = merged
+            codes[name] = np.concatenate(remapped)
+        for name in NUMERIC_COLUMNS:
+            numeric[name] = np.concatenate([p.numeric[name] for p in parts])
+        return cls(vocab, codes, numeric, sum(p.size for p in parts))
+
+    def code(self, name, value):
+        """Categorical code for a value, -1 if no listing has it"""
+        return self._lookup[name].get(str(value).lower(), -1)
+
+
+def coerce_filters(filters):
+    """Validate explicit /search filters; numbers may be given as numeric strings.
+
+    Returns a new dict of the known keys; raises ValueError naming the bad filter.
+    """
+    coerced = {}
+    for name in FILTER_KEYS:
+        value = filters.get(name)
+        if value is None or value == "":
+            continue
+        if name in CATEGORICAL_COLUMNS:
+            if not isinstance(value, str):
+                raise ValueError(f"Filter '{name}' must be a string")
+            coerced[name] = value
+            continue
+        if isinstance(value, bool):
+            raise ValueError(f"Filter '{name}' must be a number")
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Filter '{name}' must be a number, got {value!r}")
+        if not math.isfinite(number) or number < 0:
+            raise ValueError(f"Filter '{name}' must be a non-negative number")
+        # Same shapes as extracted entities: whole numbers as int
+        coerced[name] = int(number) if name in ("bedrooms", "bathrooms") or number.is_integer() else number
+    return coerced
+
+
+def filter_key(entities):
+    """Normalized, hashable entity tuple; None when nothing filters"""
+    if not entities:
+        return None
+    key = []
+    for name in FILTER_KEYS:
+        value = entities.get(name)
+        if value is None or value == "":
+            key.append(None)
+        elif name in CATEGORICAL_COLUMNS:
+            key.append(str(value).lower())
+        else:
+            key.append(float(value))
+    return tuple(key) if any(v is not None for v in key) else None
+
+
+class AttributeFilter:
+    """Vectorized entity pre-filter with an LRU cache of combined masks.
+
+    ``base`` (e.g. the store's live-row mask) is ANDed into every result.
+    """
+
+    def __init__(self, attributes, base=None, cache_size=64):
+        self.attributes = attributes
+        self.base = base
+        self.cache_size = max(0, int(cache_size))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _compute(self, key):
+        attrs = self.attributes
+        type_, country, bedrooms, bathrooms, min_price, max_price, area = key
+        mask = self.base.copy() if self.base is not None else np.ones(len(attrs), dtype=bool)
+
+        if type_ is not None:
+            mask &= attrs.codes["type"] == attrs.code("type", type_)
+        if country is not None:
+            mask &= attrs.codes["country"] == attrs.code("country", country)
+        # Rooms are a minimum ("2 phòng ngủ" also accepts 3)
+        if bedrooms is not None:
+            mask &= attrs.numeric["bedrooms"] >= bedrooms
+        if bathrooms is not None:
+            mask &= attrs.numeric["bathrooms"] >= bathrooms
+        # NaN (unknown price / area) compares False and drops out
+        price = attrs.numeric["price"]
+        if min_price is not None and max_price is not None:
+            mask &= (price >= min_price) & (price <= max_price)
+        elif min_price is not None:
+            mask &= price >= min_price
+        elif max_price is not None:
+            mask &= price <= max_price
+        if area is not None:
+            values = attrs.numeric["area"]
+            mask &= (values >= area * (1 - AREA_TOLERANCE)) & (values <= area * (1 + AREA_TOLERANCE))
+        return mask
+
+    def mask(self, entities):
+        """Boolean mask (read-only, shared) of rows passing the filters, or ``base``"""
+        key = filter_key(entities)
+        if key is None:
+            return self.base
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return cached
+            self.stats["misses"] += 1
+
+        mask = self._compute(key)
+        mask.flags.writeable = False
+        if self.cache_size:
+            with self._lock:
+                self._cache[key] = mask
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return mask
@@ -0,0 +1,614 @@
+# -*- coding: utf-8 -*-
+"""
+Store embedding của listings trên đĩa, cập nhật tăng dần thay vì encode lại
+cả catalog mỗi khi có thay đổi:
+
+- Mỗi lần upsert ghi 1 segment mới (append-only): vectors (.vec.npy, mmap lúc
+  query; float32, float16 hoặc int8 + .scale.npy), _id, digest nội dung, cột thuộc tính và document (NDJSON + offsets).
+  Các dòng trong segment được sắp theo _id nên tra cứu là searchsorted
+- Upsert theo _id: listing không đổi nội dung thì bỏ qua, không encode lại;
+  bản cũ của listing đã sửa bị segment mới hơn che đi (last write wins)
+- Delete ghi tombstone vào tombstones.ndjson (append + fsync)
+- Compaction (chạy nền) gộp các dòng còn sống thành 1 segment và train lại IVF
+- manifest.json (ghi atomic) quyết định segment nào đang được dùng; process
+  khác (worker gunicorn) thấy generation đổi thì mở lại các segment mới
+
+Mở lại store khi restart chỉ cần mmap các segment + đọc id/cột thuộc tính
+(vectorized, không dựng dict Python theo từng _id), không encode gì cả.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from intent_index import l2_normalize
+from listing_filters import ListingAttributes
+from quantization import EMBEDDING_DTYPES, from_storage, quantize, storage_arrays, storage_dtype
+from search import RESULT_FIELDS, ListingIndex, listing_columns, listing_text, normalize_listing, train_ivf
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single process, no file lock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 1
+MANIFEST = "manifest.json"
+TOMBSTONES = "tombstones.ndjson"
+LOCK_FILE = "LOCK"
+
+# Attribute columns stored per segment: name -> (dtype, missing value)
+_COLUMNS = {
+    "type": (str, ""), "country": (str, ""),
+    "bedrooms": (np.int32, -1), "bathrooms": (np.int32, -1),
+    "area": (np.float32, np.nan), "price": (np.float64, np.nan),
+}
+_TEXT_DIGEST_LEN = 12
+
+
+def _hash(value):
+    raw = json.dumps(value, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:_TEXT_DIGEST_LEN]
+
+
+def listing_digest(listing):
+    """Embedded-text hash + attribute hash.
+
+    Same digest: upsert skips the listing. Same text hash only: the old
+    vector is reused and just the attributes are rewritten (no re-encode).
+    """
+    attributes = [listing.get(f) for f in RESULT_FIELDS] + [listing.get("area")]
+    return _hash(listing_text(listing)) + _hash(attributes)
+
+
+def _atomic_write(path, write_fn, mode="wb"):
+    directory = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+            write_fn(f)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class _Segment:
+    """One immutable segment; only its ``live`` mask changes after writing"""
+
+    SUFFIXES = (".vec.npy", ".scale.npy", ".ids.npy", ".digest.npy", ".attrs.npz", ".docs.ndjson",
+                ".offsets.npy", ".ivf.npy")
+
+    def __init__(self, directory, seq):
+        self.seq = seq
+        base = self.base_path(directory, seq)
+        scales_path = base + ".scale.npy"
+        scales = np.load(scales_path) if os.path.exists(scales_path) else None
+        self.vectors = from_storage(np.load(base + ".vec.npy", mmap_mode="r"), scales)
+        self.ids = np.load(base + ".ids.npy")
+        self.digests = np.load(base + ".digest.npy")
+        with np.load(base + ".attrs.npz") as attrs:
+            self.columns = {name: attrs[name] for name in attrs.files}
+        self.offsets = np.load(base + ".offsets.npy", mmap_mode="r")
+        assignments_path = base + ".ivf.npy"
+        self.assignments = np.load(assignments_path) if os.path.exists(assignments_path) else None
+        with open(base + ".docs.ndjson", "rb") as f:
+            self._docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.live = np.ones(len(self.ids), dtype=bool)
+        self._attributes = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def column(self, name):
+        """Stored attribute column, or all-missing for columns added later"""
+        if name in self.columns:
+            return self.columns[name]
+        dtype, missing = _COLUMNS[name]
+        return np.full(len(self), missing, dtype=dtype)
+
+    @property
+    def attributes(self):
+        """Filter columns of this segment, encoded once (segments are immutable)"""
+        if self._attributes is None:
+            self._attributes = ListingAttributes.from_columns({name: self.column(name) for name in _COLUMNS})
+        return self._attributes
+
+    @staticmethod
+    def base_path(directory, seq):
+        return os.path.join(directory, f"seg-{seq:06d}")
+
+    def doc(self, row):
+        return json.loads(self._docs[int(self.offsets[row]):int(self.offsets[row + 1])])
+
+    def doc_line(self, row):
+        return self._docs[int(self.offsets[row]):int(self.offsets[row + 1])]
+
+    def find(self, ids):
+        """Row of each id in this segment, -1 where absent (ids are stored sorted)"""
+        ids = np.asarray(ids, dtype=str)
+        rows = np.searchsorted(self.ids, ids)
+        found = rows < len(self.ids)
+        found[found] = self.ids[rows[found]] == ids[found]
+        return np.where(found, rows, -1)
+
+    @classmethod
+    def write(cls, directory, seq, vectors, ids, digests, columns, doc_lines, assignments=None,
+              dtype="float32"):
+        """Write every file of a new segment (each one atomically), rows sorted by _id"""
+        base = cls.base_path(directory, seq)
+        ids = np.asarray(ids, dtype=str)
+        order = np.argsort(ids, kind="stable")
+        ids = ids[order]
+        vectors = np.asarray(vectors)[order]
+        digests = np.asarray(digests, dtype=str)[order]
+        columns = {name: np.asarray(values, dtype=_COLUMNS[name][0])[order]
+                   for name, values in columns.items()}
+        doc_lines = [doc_lines[i] for i in order]
+        if assignments is not None:
+            assignments = np.asarray(assignments, dtype=np.int32)[order]
+        offsets = np.zeros(len(doc_lines) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(line) for line in doc_lines])
+
+        _atomic_write(base + ".docs.ndjson", lambda f: f.writelines(doc_lines))
+        _atomic_write(base + ".offsets.npy", lambda f: np.save(f, offsets))
+        _atomic_write(base + ".ids.npy", lambda f: np.save(f, ids))
+        _atomic_write(base + ".digest.npy", lambda f: np.save(f, digests))
+        _atomic_write(base + ".attrs.npz", lambda f: np.savez(f, **columns))
+        if assignments is not None:
+            _atomic_write(base + ".ivf.npy", lambda f: np.save(f, assignments))
+        data, scales = storage_arrays(quantize(vectors, dtype))
+        if scales is not None:
+            _atomic_write(base + ".scale.npy", lambda f: np.save(f, scales))
+        # Vectors last: a segment without .vec.npy is never listed in the manifest
+        _atomic_write(base + ".vec.npy", lambda f: np.save(f, np.ascontiguousarray(data)))
+
+    @classmethod
+    def remove_files(cls, directory, seq):
+        base = cls.base_path(directory, seq)
+        for suffix in cls.SUFFIXES:
+            try:
+                os.remove(base + suffix)
+            except OSError:
+                pass
+
+
+class _StoreDocs:
+    """Global row -> listing dict, read lazily from the segments' NDJSON files"""
+
+    def __init__(self, segments, bases):
+        self.segments = segments
+        self.bases = bases
+
+    def __len__(self):
+        return int(self.bases[-1])
+
+    def __getitem__(self, row):
+        i = int(np.searchsorted(self.bases, row, side="right")) - 1
+        return self.segments[i].doc(row - int(self.bases[i]))
+
+
+class ListingStore:
+    """Append-only, segment-based listing embedding store with upsert by _id"""
+
+    def __init__(self, directory, model_name=None, n_lists=0, refresh_interval=1.0, filter_cache_size=64,
+                 dtype="float32"):
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unknown embedding dtype '{dtype}', expected one of {EMBEDDING_DTYPES}")
+        self.directory = directory
+        self.dtype = dtype
+        self.model_name = model_name
+        self.n_lists = int(n_lists)
+        self.refresh_interval = refresh_interval
+        self.filter_cache_size = filter_cache_size
+        self._lock = threading.RLock()
+        self._segments = []
+        self._centroids = None
+        self._ivf_seq = None
+        self._next_seq = 1
+        self._generation = 0
+        self._manifest_stat = None
+        self._last_refresh_check = 0.0
+        self._snapshot = None
+        self._compactor = None
+        self._compactor_stop = threading.Event()
+        self.stats = {"inserted": 0, "updated": 0, "unchanged": 0, "reused_vectors": 0,
+                      "deleted": 0, "compactions": 0}
+
+    # ------------------------------------------------------------------
+    # Opening / refreshing
+    # ------------------------------------------------------------------
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _stat_manifest(self):
+        try:
+            st = os.stat(self._path(MANIFEST))
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def open(self):
+        """Open (or create) the store and load every live segment"""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            manifest = self._read_manifest()
+            if manifest is None:
+                self._write_manifest()
+            elif self.model_name and manifest.get("model") != self.model_name:
+                logger.warning(f"Listing store was built with {manifest.get('model')}, discarding it")
+                for seq in manifest.get("segments", []):
+                    _Segment.remove_files(self.directory, seq)
+                self._next_seq = max(self._next_seq, manifest.get("next_seq", 1))
+                self._write_manifest()
+                self._truncate_tombstones()
+            else:
+                self._load(manifest)
+        return self
+
+    def _read_manifest(self):
+        try:
+            with open(self._path(MANIFEST), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        if manifest.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported listing store version {manifest.get('version')}")
+        return manifest
+
+    def _load(self, manifest):
+        """(Re)build in-memory state from the manifest, reusing open segments"""
+        opened = {seg.seq: seg for seg in self._segments}
+        segments = []
+        for seq in manifest["segments"]:
+            segment = opened.get(seq) or _Segment(self.directory, seq)
+            segment.live[:] = True
+            segments.append(segment)
+
+        # Later segments shadow earlier rows with the same _id
+        for i, segment in enumerate(segments):
+            for newer in segments[i + 1:]:
+                rows = segment.find(newer.ids)
+                segment.live[rows[rows >= 0]] = False
+
+        # Tombstone {"_id", "seq"} kills the row if it lives in a segment <= seq
+        tombstones = []
+        try:
+            with open(self._path(TOMBSTONES), "r", encoding="utf-8") as f:
+                tombstones = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            pass
+        if tombstones:
+            dead_ids = np.array([t["_id"] for t in tombstones], dtype=str)
+            dead_seqs = np.array([t["seq"] for t in tombstones])
+            for segment in segments:
+                rows = segment.find(dead_ids[dead_seqs >= segment.seq])
+                segment.live[rows[rows >= 0]] = False
+
+        self._centroids = None
+        self._ivf_seq = manifest.get("ivf")
+        if self._ivf_seq is not None:
+            self._centroids = np.load(self._path(f"ivf-{self._ivf_seq:06d}.npy"))
+        self._segments = segments
+        self._next_seq = manifest["next_seq"]
+        self._generation = manifest["generation"]
+        self._manifest_stat = self._stat_manifest()
+        self._snapshot = None
+
+    def _write_manifest(self):
+        self._generation += 1
+        manifest = {
+            "version": STORE_VERSION,
+            "model": self.model_name,
+            "generation": self._generation,
+            "next_seq": self._next_seq,
+            "segments": [seg.seq for seg in self._segments],
+            "ivf": self._ivf_seq,
+        }
+        _atomic_write(self._path(MANIFEST), lambda f: json.dump(manifest, f), mode="w")
+        self._manifest_stat = self._stat_manifest()
+        self._snapshot = None
+
+    def refresh(self):
+        """Pick up writes made by another process (cheap stat when nothing changed)"""
+        with self._lock:
+            stat = self._stat_manifest()
+            if stat is None or stat == self._manifest_stat:
+                return False
+            manifest = self._read_manifest()
+            if manifest["generation"] == self._generation:
+                self._manifest_stat = stat
+                return False
+            self._load(manifest)
+            return True
+
+    @contextmanager
+    def _write_txn(self):
+        """Thread + cross-process exclusive section around a manifest change"""
+        with self._lock:
+            lock_file = open(self._path(LOCK_FILE), "a")
+            try:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self.refresh()
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    def _lookup(self, ids):
+        """[(segment, row) or None] for each id: its newest row, if still live"""
+        result = [None] * len(ids)
+        pending = np.arange(len(ids))
+        ids = np.asarray(ids, dtype=str)
+        for segment in reversed(self._segments):
+            if not len(pending):
+                break
+            rows = segment.find(ids[pending])
+            hit = rows >= 0
+            for i, row in zip(pending[hit].tolist(), rows[hit].tolist()):
+                if segment.live[row]:
+                    result[i] = (segment, row)
+            # A dead newest row means deleted; older copies are dead too
+            pending = pending[~hit]
+        return result
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def upsert(self, docs, encode_fn, batch_size=256):
+        """Insert or replace listings by _id; unchanged listings are not re-encoded"""
+        pending = {}
+        for doc in docs:
+            listing = normalize_listing(doc)
+            if not listing["_id"]:
+                raise ValueError("Listing without _id")
+            pending[listing["_id"]] = listing
+
+        with self._write_txn():
+            changed, digests, previous = [], [], []
+            entries = self._lookup(list(pending))
+            for (listing_id, listing), entry in zip(pending.items(), entries):
+                digest = listing_digest(listing)
+                if entry is not None and entry[0].digests[entry[1]] == digest:
+                    self.stats["unchanged"] += 1
+                    continue
+                changed.append(listing)
+                digests.append(digest)
+                previous.append(entry)
+            if not changed:
+                return {"inserted": 0, "updated": 0, "unchanged": len(pending)}
+
+            # Attribute-only edits (price, status...) keep the old vector
+            vectors = None
+            to_encode = []
+            for i, (digest, entry) in enumerate(zip(digests, previous)):
+                if entry is not None and entry[0].digests[entry[1]][:_TEXT_DIGEST_LEN] == digest[:_TEXT_DIGEST_LEN]:
+                    if vectors is None:
+                        vectors = np.empty((len(changed), entry[0].vectors.shape[1]), dtype=np.float32)
+                    vectors[i] = entry[0].vectors[entry[1]]
+                else:
+                    to_encode.append(i)
+            for start in range(0, len(to_encode), batch_size):
+                rows = to_encode[start:start + batch_size]
+                encoded = l2_normalize(encode_fn([listing_text(changed[i]) for i in rows]))
+                if vectors is None:
+                    vectors = np.empty((len(changed), encoded.shape[1]), dtype=np.float32)
+                vectors[rows] = encoded
+            self.stats["reused_vectors"] += len(changed) - len(to_encode)
+            assignments = None
+            if self._centroids is not None:
+                assignments = np.argmax(vectors @ self._centroids.T, axis=1)
+
+            seq = self._next_seq
+            ids = [l["_id"] for l in changed]
+            doc_lines = [
+                (json.dumps({f: l.get(f) for f in RESULT_FIELDS}, ensure_ascii=False) + "\n").encode("utf-8")
+                for l in changed
+            ]
+            _Segment.write(self.directory, seq, vectors, ids, digests,
+                           listing_columns(changed), doc_lines, assignments, self.dtype)
+            segment = _Segment(self.directory, seq)
+
+            updated = 0
+            for entry in previous:
+                if entry is not None:
+                    entry[0].live[entry[1]] = False
+                    updated += 1
+            self._segments.append(segment)
+            self._next_seq = seq + 1
+            self._write_manifest()
+
+            self.stats["inserted"] += len(ids) - updated
+            self.stats["updated"] += updated
+            return {"inserted": len(ids) - updated, "updated": updated,
+                    "unchanged": len(pending) - len(ids)}
+
+    def delete(self, listing_ids):
+        """Tombstone listings by _id; returns how many existed"""
+        with self._write_txn():
+            listing_ids = list(dict.fromkeys(str(i) for i in listing_ids))
+            lines = []
+            for listing_id, entry in zip(listing_ids, self._lookup(listing_ids)):
+                if entry is None:
+                    continue
+                entry[0].live[entry[1]] = False
+                lines.append(json.dumps({"_id": listing_id, "seq": self._next_seq - 1}) + "\n")
+            if lines:
+                with open(self._path(TOMBSTONES), "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._write_manifest()
+                self.stats["deleted"] += len(lines)
+            return len(lines)
+
+    def _truncate_tombstones(self):
+        _atomic_write(self._path(TOMBSTONES), lambda f: None)
+
+    # ------------------------------------------------------------------
+    # Compaction
+    # ------------------------------------------------------------------
+    def needs_compaction(self, max_dead_ratio=0.2, max_segments=8):
+        with self._lock:
+            rows = sum(len(seg) for seg in self._segments)
+            live = len(self)
+            if not rows:
+                return False
+            untrained = self.n_lists and self._centroids is None and live >= self.n_lists * 4
+            # Segments written before a SEARCH_EMBEDDING_DTYPE change get converted
+            converting = any(storage_dtype(seg.vectors) != self.dtype for seg in self._segments)
+            return bool((rows - live) / rows > max_dead_ratio
+                        or len(self._segments) > max_segments or untrained or converting)
+
+    def compact(self):
+        """Merge live rows into one segment, retrain IVF, drop tombstones"""
+        with self._write_txn():
+            old = list(self._segments)
+            if not old:
+                return False
+            start = time.perf_counter()
+
+            vectors, ids, digests, doc_lines = [], [], [], []
+            columns = {name: [] for name in _COLUMNS}
+            for segment in old:
+                rows = np.flatnonzero(segment.live)
+                if not len(rows):
+                    continue
+                vectors.append(np.asarray(segment.vectors[rows]))
+                ids.extend(segment.ids[rows].tolist())
+                digests.extend(segment.digests[rows].tolist())
+                doc_lines.extend(segment.doc_line(row) for row in rows)
+                for name in _COLUMNS:
+                    columns[name].append(segment.column(name)[rows])
+
+            self._segments = []
+            centroids = assignments = None
+            if vectors:
+                matrix = np.vstack(vectors)
+                columns = {name: np.concatenate(parts) for name, parts in columns.items()}
+                if self.n_lists and len(matrix) >= self.n_lists * 4:
+                    centroids, assignments = train_ivf(matrix, self.n_lists)
+                seq = self._next_seq
+                self._next_seq += 1
+                _Segment.write(self.directory, seq, matrix, ids, digests, columns, doc_lines, assignments,
+                               self.dtype)
+                if centroids is not None:
+                    _atomic_write(self._path(f"ivf-{seq:06d}.npy"), lambda f: np.save(f, centroids))
+                self._segments = [_Segment(self.directory, seq)]
+
+            old_ivf = self._ivf_seq
+            self._centroids = centroids
+            self._ivf_seq = self._segments[0].seq if centroids is not None else None
+            self._write_manifest()
+            self._truncate_tombstones()
+
+            # Open snapshots keep their mmaps; unlinked files stay readable
+            for segment in old:
+                _Segment.remove_files(self.directory, segment.seq)
+            if old_ivf is not None and old_ivf != self._ivf_seq:
+                try:
+                    os.remove(self._path(f"ivf-{old_ivf:06d}.npy"))
+                except OSError:
+                    pass
+            self.stats["compactions"] += 1
+            logger.info(f"✅ Listing store compacted: {len(old)} segments -> {len(self._segments)}, "
+                        f"{len(ids)} live rows in {time.perf_counter() - start:.2f}s")
+            return True
+
+    def start_compactor(self, interval=60.0, max_dead_ratio=0.2, max_segments=8):
+        """Background thread compacting whenever needs_compaction() says so"""
+        if self._compactor and self._compactor.is_alive():
+            return self._compactor
+        self._compactor_stop.clear()
+
+        def run():
+            while not self._compactor_stop.wait(interval):
+                try:
+                    self.refresh()
+                    if self.needs_compaction(max_dead_ratio, max_segments):
+                        self.compact()
+                except Exception as e:
+                    logger.error(f"❌ Listing store compaction failed: {str(e)}")
+
+        self._compactor = threading.Thread(target=run, name="listing-compactor", daemon=True)
+        self._compactor.start()
+        return self._compactor
+
+    def stop_compactor(self):
+        self._compactor_stop.set()
+        if self._compactor:
+            self._compactor.join(1.0)
+            self._compactor = None
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def __len__(self):
+        return sum(int(seg.live.sum()) for seg in list(self._segments))
+
+    def __contains__(self, listing_id):
+        with self._lock:
+            return self._lookup([str(listing_id)])[0] is not None
+
+    def ids(self):
+        with self._lock:
+            return [i for seg in self._segments for i in seg.ids[seg.live].tolist()]
+
+    def index(self):
+        """Current ListingIndex snapshot, rebuilt only when the store changed"""
+        now = time.monotonic()
+        if now - self._last_refresh_check >= self.refresh_interval:
+            self._last_refresh_check = now
+            self.refresh()
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+            segments = list(self._segments)
+            blocks = [seg.vectors for seg in segments]
+            bases = np.cumsum([0] + [len(seg) for seg in segments])
+            attributes = ListingAttributes.concat([seg.attributes for seg in segments])
+            if segments:
+                live = np.concatenate([seg.live for seg in segments])
+            else:
+                live = np.zeros(0, dtype=bool)
+            assignments = None
+            if self._centroids is not None:
+                assignments = np.concatenate([
+                    seg.assignments if seg.assignments is not None else np.full(len(seg), -1, dtype=np.int32)
+                    for seg in segments
+                ])
+            self._snapshot = ListingIndex(blocks, attributes, _StoreDocs(segments, bases), live,
+                                          self._centroids, assignments, self.filter_cache_size)
+            return self._snapshot
+
+    def snapshot_stats(self):
+        with self._lock:
+            rows = sum(len(seg) for seg in self._segments)
+            live = len(self)
+            return dict(
+                self.stats,
+                segments=len(self._segments),
+                rows=rows,
+                live=live,
+                dead=rows - live,
+                ivf_lists=len(self._centroids) if self._centroids is not None else 0,
+                dtype=self.dtype,
+                vector_bytes=int(sum(seg.vectors.nbytes for seg in self._segments)),
+                generation=self._generation
+            )
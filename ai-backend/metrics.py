@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics tối giản theo Prometheus text exposition format (không cần thêm
+thư viện): Counter, Histogram có labels và metric đọc giá trị qua callback
+(cho các số liệu đã có sẵn như context store size, batch queue depth).
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{_escape(v)}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, labels), value) for labels, value in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+        # Optional fn(value, *labelvalues) called on every observation
+        self.listener = None
+
+    def observe(self, value, *labelvalues):
+        listener = self.listener
+        if listener is not None:
+            listener(value, *labelvalues)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def collect(self):
+        with self._lock:
+            items = [(labels, list(s[0]), s[1], s[2]) for labels, s in self._series.items()]
+        samples = []
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((
+                    f'{self.name}_bucket',
+                    _format_labels(self.labelnames, labels, [('le', _format_value(float(bound)))]),
+                    cumulative
+                ))
+            samples.append((f'{self.name}_sum', _format_labels(self.labelnames, labels), total))
+            samples.append((f'{self.name}_count', _format_labels(self.labelnames, labels), count))
+        return samples
+
+
+class CallbackMetric:
+    """Gauge/counter whose value is read from a callback at scrape time.
+
+    The callback returns a number, or a {label_value: number} dict when the
+    metric has a single label.
+    """
+
+    def __init__(self, name, documentation, callback, kind='gauge', labelname=None):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.kind = kind
+        self.labelname = labelname
+
+    def collect(self):
+        value = self.callback()
+        if value is None:
+            return []
+        if isinstance(value, dict):
+            return [(self.name, _format_labels((self.labelname,), (key,)), v) for key, v in value.items()]
+        return [(self.name, '', value)]
+
+
+class Registry:
+    """Ordered collection of metrics rendered as text exposition"""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, callback, kind='gauge', labelname=None):
+        return self.register(CallbackMetric(name, documentation, callback, kind, labelname))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.collect()
+            except Exception:
+                # A broken callback must not take down the whole scrape
+                continue
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in samples:
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
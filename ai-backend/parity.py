@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+So sánh quyết định intent (top-1 trên các pattern của INTENTS) giữa một cấu
+hình tham chiếu và một cấu hình thay thế, dùng chung cho:
+
+- encoders.py parity: torch vs ONNX (khác hàm encode)
+- quantization.py parity: float32 vs float16 / int8 (khác hàm chấm điểm)
+
+Mỗi pattern được chấm như một query với mọi pattern khác (bỏ chính nó); hai
+bên lệch nhau ở pattern nào thì pattern đó nằm trong ``mismatches``.
+"""
+
+import numpy as np
+
+from intent_index import l2_normalize
+
+
+def pattern_rows(intents):
+    """(intent names, pattern texts, intent index of each pattern)"""
+    names = list(intents)
+    texts, rows = [], []
+    for i, intent in enumerate(names):
+        for pattern in intents[intent].get("patterns", []):
+            texts.append(pattern)
+            rows.append(i)
+    return names, texts, np.asarray(rows)
+
+
+def self_similarity(queries):
+    """Cosine of every pattern against every pattern (float32 patterns)"""
+    normed = l2_normalize(queries)
+    return normed @ normed.T
+
+
+def leave_one_out_decisions(sims, row_intents, n_intents, threshold):
+    """Best intent of each pattern against every other pattern row; -1 below threshold"""
+    sims = np.array(sims, dtype=np.float32)
+    np.fill_diagonal(sims, -np.inf)
+    scores = np.full((len(sims), n_intents), -np.inf, dtype=np.float32)
+    for intent in range(n_intents):
+        columns = row_intents == intent
+        if columns.any():
+            scores[:, intent] = sims[:, columns].max(axis=1)
+    best = scores.argmax(axis=1)
+    best_scores = scores[np.arange(len(best)), best]
+    return np.where(best_scores > threshold, best, -1), best_scores
+
+
+def intent_parity(intents, reference_encode, candidate_encode, threshold=0.5,
+                  reference_score=self_similarity, candidate_score=self_similarity):
+    """Compare top-1 intent decisions of two (encode, score) pipelines.
+
+    ``*_encode(texts)`` returns float32 query embeddings; ``*_score(queries)``
+    returns the (patterns x patterns) similarity matrix. The same encode
+    callable on both sides is only called once.
+
+    Returns (report, reference embeddings, candidate embeddings).
+    """
+    names, texts, rows = pattern_rows(intents)
+    ref_queries = np.asarray(reference_encode(texts), dtype=np.float32)
+    if candidate_encode is reference_encode:
+        cand_queries = ref_queries
+    else:
+        cand_queries = np.asarray(candidate_encode(texts), dtype=np.float32)
+
+    ref_decisions, ref_scores = leave_one_out_decisions(reference_score(ref_queries), rows, len(names), threshold)
+    cand_decisions, cand_scores = leave_one_out_decisions(candidate_score(cand_queries), rows, len(names), threshold)
+    errors = np.abs(cand_scores - ref_scores)
+
+    def _label(i):
+        return names[i] if i >= 0 else None
+
+    mismatches = [
+        {"pattern": texts[i], "reference": _label(ref_decisions[i]), "candidate": _label(cand_decisions[i]),
+         "reference_score": round(float(ref_scores[i]), 4), "candidate_score": round(float(cand_scores[i]), 4)}
+        for i in np.flatnonzero(ref_decisions != cand_decisions)
+    ]
+    report = {
+        "patterns": len(texts),
+        "agreement": float(1.0 - len(mismatches) / max(len(texts), 1)),
+        "max_score_error": float(errors.max()) if len(errors) else 0.0,
+        "mean_score_error": float(errors.mean()) if len(errors) else 0.0,
+        "mismatches": mismatches,
+    }
+    return report, ref_queries, cand_queries
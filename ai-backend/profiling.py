@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Công cụ tìm chỗ chậm của /chat ngay trên production (mặc định tắt, gần như
+không tốn gì khi tắt):
+
+- SamplingProfiler: thread lấy mẫu stack của mọi thread (sys._current_frames)
+  mỗi ``interval`` giây, gộp thành stack dạng collapsed (``a;b;c count``, dùng
+  được với flamegraph.pl / speedscope). Bật / tắt lúc đang chạy qua
+  POST /debug/profiler hoặc signal (PROFILER_SIGNAL, mặc định SIGUSR2)
+- SlowRequestLog: mỗi request /chat có một RequestTrace (thread-local) ghi
+  shape của input, thời gian từng stage (lấy từ histogram chat_stage_latency
+  qua listener) và các stack mẫu của thread đó khi profiler đang bật; giữ N
+  request chậm nhất vượt ngưỡng, xem qua GET /debug/slow-requests
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+_NULL_SPAN = nullcontext()
+_LABELS = {}
+
+
+def _frame_label(code):
+    # Formatting a label per frame per sample is the profiler's main cost
+    label = _LABELS.get(code)
+    if label is None:
+        label = _LABELS[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+
+def collapse_stack(frame, max_depth=64):
+    """Frame -> 'outer;...;inner' (root first, at most max_depth innermost frames)"""
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+class RequestTrace:
+    """Stage timings and stack samples of one request"""
+
+    __slots__ = ("started_at", "start", "shape", "stages", "samples", "duration", "status", "max_samples")
+
+    def __init__(self, shape, max_samples=200):
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.shape = shape
+        self.stages = []
+        self.samples = {}
+        self.duration = None
+        self.status = None
+        self.max_samples = max_samples
+
+    def add_sample(self, stack):
+        if stack in self.samples or len(self.samples) < self.max_samples:
+            self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def to_dict(self):
+        return {
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "status": self.status,
+            "input": self.shape,
+            "stages_ms": [{"stage": name, "ms": round(seconds * 1000, 3)} for name, seconds in self.stages],
+            "samples": [
+                {"stack": stack, "count": count}
+                for stack, count in sorted(self.samples.items(), key=lambda kv: -kv[1])
+            ],
+        }
+
+
+class SamplingProfiler:
+    """Periodic sys._current_frames() sampler aggregating collapsed stacks"""
+
+    def __init__(self, interval=0.005, max_depth=64, max_stacks=5000):
+        self.interval = float(interval)
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self._stacks = {}
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.started_at = None
+        self.stats = {"samples": 0, "sweeps": 0, "dropped": 0}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        if interval:
+            self.interval = float(interval)
+        if self.running:
+            return False
+        self._stop.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        logger.info(f"🔬 Sampling profiler started (every {self.interval * 1000:.1f}ms)")
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self._stop.set()
+        self._thread.join(1.0)
+        self._thread = None
+        logger.info(f"🔬 Sampling profiler stopped ({self.stats['sweeps']} sweeps)")
+        return True
+
+    def toggle(self):
+        """Start if stopped, else stop; return the new state"""
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+        return self.running
+
+    def reset(self):
+        with self._lock:
+            self._stacks = {}
+            self.stats = {"samples": 0, "sweeps": 0, "dropped": 0}
+
+    def watch(self, thread_id, trace):
+        """Also attach samples of thread_id to trace (until unwatch)"""
+        self._watched[thread_id] = trace
+
+    def unwatch(self, thread_id):
+        # Under the lock: no sweep still holds the trace once this returns
+        with self._lock:
+            self._watched.pop(thread_id, None)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """One sweep over every thread but the sampler itself"""
+        own = threading.get_ident()
+        frames = sys._current_frames()
+        with self._lock:
+            for thread_id, frame in frames.items():
+                if thread_id == own:
+                    continue
+                stack = collapse_stack(frame, self.max_depth)
+                count = self._stacks.get(stack)
+                if count is not None:
+                    self._stacks[stack] = count + 1
+                elif len(self._stacks) < self.max_stacks:
+                    self._stacks[stack] = 1
+                else:
+                    self.stats["dropped"] += 1
+                self.stats["samples"] += 1
+                trace = self._watched.get(thread_id)
+                if trace is not None:
+                    trace.add_sample(stack)
+            self.stats["sweeps"] += 1
+
+    def top(self, limit=50):
+        """Most sampled stacks, most frequent first"""
+        with self._lock:
+            items = sorted(self._stacks.items(), key=lambda kv: -kv[1])[:limit]
+        return [{"stack": stack, "count": count} for stack, count in items]
+
+    def collapsed(self):
+        """Every stack in flamegraph collapsed format ('a;b;c count' lines)"""
+        with self._lock:
+            items = sorted(self._stacks.items(), key=lambda kv: -kv[1])
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def snapshot_stats(self):
+        with self._lock:
+            return dict(self.stats, running=self.running, interval_ms=self.interval * 1000,
+                        stacks=len(self._stacks), started_at=self.started_at)
+
+
+class SlowRequestLog:
+    """Per-request traces; keeps the ``capacity`` slowest above ``threshold`` seconds"""
+
+    def __init__(self, threshold=0.0, capacity=20, profiler=None):
+        self.threshold = float(threshold)
+        self.capacity = capacity
+        self.profiler = profiler
+        self._local = threading.local()
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "slow": 0}
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def begin(self, shape):
+        """Start tracing the current thread's request; None when disabled"""
+        if not self.enabled:
+            return None
+        trace = RequestTrace(shape)
+        self._local.trace = trace
+        if self.profiler is not None:
+            self.profiler.watch(threading.get_ident(), trace)
+        return trace
+
+    def finish(self, trace, status):
+        if trace is None:
+            return
+        trace.duration = time.perf_counter() - trace.start
+        trace.status = status
+        self._local.trace = None
+        if self.profiler is not None:
+            self.profiler.unwatch(threading.get_ident())
+        with self._lock:
+            self.stats["requests"] += 1
+            if trace.duration < self.threshold:
+                return
+            self.stats["slow"] += 1
+            # Min-heap on duration: the fastest kept request is dropped first
+            entry = (trace.duration, next(self._seq), trace)
+            if len(self._heap) < self.capacity:
+                heapq.heappush(self._heap, entry)
+            else:
+                heapq.heappushpop(self._heap, entry)
+
+    def observe(self, seconds, *labelvalues):
+        """Histogram listener: record a stage into the current trace, if any"""
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            trace.stages.append((labelvalues[0] if labelvalues else "", seconds))
+
+    def span(self, name):
+        """Time a block into the current trace only (no histogram series)"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name)
+
+    @contextmanager
+    def _span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, name)
+
+    def slowest(self):
+        with self._lock:
+            entries = sorted(self._heap, reverse=True)
+        return [trace.to_dict() for _, _, trace in entries]
+
+    def clear(self):
+        with self._lock:
+            self._heap = []
+
+    def snapshot_stats(self):
+        with self._lock:
+            return dict(self.stats, enabled=self.enabled, threshold_ms=self.threshold * 1000,
+                        capacity=self.capacity, kept=len(self._heap))
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Lưu embeddings gọn hơn float32 (EMBEDDING_DTYPE, SEARCH_EMBEDDING_DTYPE):
+
+- float32: mặc định, ndarray thường
+- float16: 1/2 bộ nhớ, sai số ~1e-3 trên cosine
+- int8:    1/4 bộ nhớ, mỗi vector (đã chuẩn hoá L2) lưu mã int8 + 1 scale
+           float32 riêng: x ≈ code * scale, scale = max|x| / 127
+
+QuantizedMatrix chấm điểm giống một ma trận float32 (``matrix @ query``): dữ
+liệu nén được giải nén theo từng khối nhỏ rồi nhân, nên RAM thường trú chỉ là
+bản nén; query luôn giữ float32.
+
+Parity (top-1 intent trên INTENTS patterns, float32 vs dtype nén):
+    python quantization.py parity --dtype float16 int8
+"""
+
+import argparse
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+INT8_MAX = 127
+# Rows dequantized per step when scoring (~6 MB of float32 at dim 384)
+_SCORE_BLOCK_ROWS = 4096
+
+
+class QuantizedMatrix:
+    """Row-wise float16 / int8 embeddings that score like a float32 matrix"""
+
+    def __init__(self, data, scales=None):
+        self.data = data
+        self.scales = None if scales is None else np.asarray(scales, dtype=np.float32)
+        if self.scales is not None and len(self.scales) != len(data):
+            raise ValueError("One scale per row is required")
+
+    @classmethod
+    def from_float(cls, matrix, dtype):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if dtype == "float16":
+            return cls(matrix.astype(np.float16))
+        if dtype == "int8":
+            peak = np.abs(matrix).max(axis=1) if len(matrix) else np.zeros(0, dtype=np.float32)
+            scales = np.where(peak > 0, peak / INT8_MAX, 1.0).astype(np.float32)
+            codes = np.rint(matrix / scales[:, None]).clip(-INT8_MAX, INT8_MAX).astype(np.int8)
+            return cls(codes, scales)
+        raise ValueError(f"Unknown embedding dtype '{dtype}', expected one of {EMBEDDING_DTYPES}")
+
+    @property
+    def dtype_name(self):
+        return "int8" if self.scales is not None else str(self.data.dtype)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, rows):
+        """Dequantized float32 row(s)"""
+        values = np.asarray(self.data[rows], dtype=np.float32)
+        if self.scales is not None:
+            scales = self.scales[rows]
+            values = values * (scales[..., None] if np.ndim(scales) else scales)
+        return values
+
+    def __matmul__(self, other):
+        """(n, dim) @ (dim,) or (dim, m), decoded one block of rows at a time"""
+        other = np.asarray(other, dtype=np.float32)
+        out = np.empty((len(self),) + other.shape[1:], dtype=np.float32)
+        for start in range(0, len(self), _SCORE_BLOCK_ROWS):
+            end = start + _SCORE_BLOCK_ROWS
+            block = np.asarray(self.data[start:end], dtype=np.float32) @ other
+            if self.scales is not None:
+                scales = self.scales[start:end]
+                block *= scales[:, None] if block.ndim == 2 else scales
+            out[start:end] = block
+        return out
+
+
+def quantize(matrix, dtype="float32"):
+    """Float32 matrix -> the storage form for ``dtype`` (float32 stays an ndarray)"""
+    if dtype == "float32":
+        return np.asarray(matrix, dtype=np.float32)
+    return QuantizedMatrix.from_float(matrix, dtype)
+
+
+def from_storage(data, scales=None):
+    """Wrap arrays loaded from disk (.npy data + optional int8 scales)"""
+    if scales is None and data.dtype == np.float32:
+        return data
+    return QuantizedMatrix(data, scales)
+
+
+def storage_dtype(matrix):
+    return matrix.dtype_name if isinstance(matrix, QuantizedMatrix) else "float32"
+
+
+def storage_arrays(matrix):
+    """(data, scales or None) to write to disk"""
+    if isinstance(matrix, QuantizedMatrix):
+        return matrix.data, matrix.scales
+    return np.asarray(matrix, dtype=np.float32), None
+
+
+def parity_report(embeddings, intents, dtype, threshold=0.5):
+    """Compare top-1 intent decisions of float32 vs ``dtype`` pattern storage.
+
+    ``embeddings`` are the float32 pattern embeddings in INTENTS order; each
+    pattern is scored (as a float32 query) against all other patterns.
+    """
+    from intent_index import l2_normalize
+    from parity import intent_parity
+
+    reference = l2_normalize(embeddings)
+    stored = quantize(reference, dtype)
+
+    def encode(texts):
+        return reference
+
+    report, _, _ = intent_parity(intents, encode, encode, threshold,
+                                 candidate_score=lambda queries: (stored @ queries.T).T)
+    return dict(report, reference="float32", candidate=dtype, dtype=dtype,
+                bytes=int(stored.nbytes), bytes_float32=int(reference.nbytes))
+
+
+def main(argv=None):
+    import json
+
+    parser = argparse.ArgumentParser(description="Compact embedding storage tools")
+    parser.add_argument("command", choices=["parity"])
+    parser.add_argument("--dtype", nargs="+", default=["float16", "int8"], choices=EMBEDDING_DTYPES[1:])
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    # Only the config and the encoder are needed, not a full app start
+    os.environ.setdefault("MODEL_LOAD_MODE", "manual")
+    import app
+    from encoders import load_encoder
+
+    encoder = load_encoder(app.ENCODER_BACKEND, app.MODEL_NAME, app.ONNX_MODEL_DIR, app.ENCODER_NUM_THREADS)
+    patterns = [p for data in app.INTENTS.values() for p in data.get("patterns", [])]
+    embeddings = np.asarray(encoder.encode(patterns), dtype=np.float32)
+    reports = [parity_report(embeddings, app.INTENTS, dtype, app.INTENT_THRESHOLD) for dtype in args.dtype]
+    print(json.dumps(reports, ensure_ascii=False, indent=2))
+    return 0 if not any(r["mismatches"] for r in reports) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Phân loại lại log chat đã lưu trữ (NDJSON) với model + INTENTS hiện tại, chạy
+offline không cần server:
+
+    python replay.py chats.ndjson -o intents.ndjson
+    python replay.py chats.ndjson -o intents.ndjson --resume
+
+Pipeline dạng generator, bộ nhớ bị chặn theo số chunk đang xử lý:
+
+- Đọc file theo từng chunk ``--chunk-lines`` dòng (stream, không load cả file)
+- Thread pool: parse JSON + validate_input + keyword fast path + extract_entities
+- Thread chính: encode các message chưa có trong intent cache thành batch lớn
+  (trùng lặp trong chunk chỉ encode 1 lần) + scoring, trong lúc pool chuẩn bị
+  các chunk tiếp theo (encoder nhả GIL nên 2 bước chạy chồng lên nhau)
+- Kết quả ghi tuần tự theo thứ tự dòng; sau mỗi chunk fsync output rồi mới ghi
+  checkpoint (byte offset đã đọc + kích thước output đã ghi) nên ``--resume``
+  chạy tiếp đúng chỗ; output ngắn hơn checkpoint thì từ chối resume
+
+Mỗi dòng output: ``{"line", <các field --keep>, "intent", "confidence",
+"entities"}`` hoặc ``{"line", "error": <reason code>}`` với dòng không hợp lệ
+(``invalid_json``, ``empty_line`` hoặc reason của validate_input).
+"""
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 1
+
+
+def read_chunks(path, offset=0, line_no=0, chunk_lines=1024):
+    """Yield ([(line_no, raw_bytes)], end_offset) starting at a byte offset"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        lines = []
+        for raw in f:
+            offset += len(raw)
+            line_no += 1
+            lines.append((line_no, raw))
+            if len(lines) >= chunk_lines:
+                yield lines, offset
+                lines = []
+        if lines:
+            yield lines, offset
+
+
+def load_checkpoint(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, state):
+    """Write the checkpoint atomically (a crash never leaves a half-written one)"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Replayer:
+    """Reclassify an NDJSON chat log with the loaded app (model + intent index)"""
+
+    def __init__(self, app, field='message', keep=('user_id', 'timestamp'), encode_batch_size=128):
+        self.app = app
+        self.field = field
+        self.keep = tuple(keep)
+        self.encode_batch_size = encode_batch_size
+        self.stats = {'lines': 0, 'invalid': 0, 'keyword': 0, 'cache_hits': 0, 'encoded': 0}
+
+    def prepare(self, lines):
+        """CPU stage (thread pool): parse, validate, keyword fast path, entities"""
+        app = self.app
+        items = []
+        for line_no, raw in lines:
+            item = {'line': line_no}
+            items.append(item)
+            raw = raw.strip()
+            if not raw:
+                item['error'] = 'empty_line'
+                continue
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                item['error'] = 'invalid_json'
+                continue
+            if isinstance(record, dict):
+                message = record.get(self.field)
+                item.update((k, record[k]) for k in self.keep if k in record)
+            else:
+                message = record
+            is_valid, result, reason = app.validate_input(message)
+            if not is_valid:
+                item['error'] = reason
+                continue
+            item['intent'] = app.keyword_matcher.match(result)
+            item['confidence'] = 1.0 if item['intent'] else 0
+            item['entities'] = app.extract_entities(result)
+            if not item['intent']:
+                item['_key'] = app.normalize_text(result)
+        return items
+
+    def classify(self, items):
+        """Encode stage (calling thread): one batched encode for the chunk's cache misses"""
+        app = self.app
+        fingerprint = app.intent_cache.fingerprint
+        pending = {}
+        for item in items:
+            key = item.get('_key')
+            if key is None:
+                if 'error' in item:
+                    self.stats['invalid'] += 1
+                elif item.get('intent'):
+                    self.stats['keyword'] += 1
+                continue
+            cached = app.intent_cache.get(key)
+            if cached is not None:
+                self.stats['cache_hits'] += 1
+                item['intent'], item['confidence'] = app.apply_threshold(cached.intent, cached.score)
+            else:
+                pending.setdefault(key, []).append(item)
+
+        if pending:
+            keys = list(pending)
+            embeddings = np.asarray(app.model.encode(keys, batch_size=self.encode_batch_size), dtype=np.float32)
+            scored = app.intent_index.best_many(embeddings)
+            self.stats['encoded'] += len(keys)
+            for key, embedding, (intent, score) in zip(keys, embeddings, scored):
+                app.intent_cache.put(key, app.CachedIntent(embedding.reshape(1, -1), intent, score), fingerprint)
+                decision = app.apply_threshold(intent, score)
+                for item in pending[key]:
+                    item['intent'], item['confidence'] = decision
+
+        self.stats['lines'] += len(items)
+        for item in items:
+            item.pop('_key', None)
+            if 'confidence' in item:
+                item['confidence'] = round(float(item['confidence']), 4)
+        return items
+
+    def run(self, input_path, output_path, checkpoint_path=None, resume=False,
+            chunk_lines=1024, workers=4, log_every=10.0):
+        """Stream input_path -> output_path; return stats"""
+        checkpoint_path = checkpoint_path or output_path + '.ckpt.json'
+        fingerprint = self.app.current_fingerprint()
+        offset, line_no, mode = 0, 0, 'wb'
+
+        state = load_checkpoint(checkpoint_path) if resume else None
+        if state is not None:
+            if state.get('version') != CHECKPOINT_VERSION or state.get('input') != os.path.abspath(input_path):
+                raise ValueError(f"Checkpoint {checkpoint_path} belongs to another input file")
+            if state.get('fingerprint') != fingerprint:
+                raise ValueError("Model or INTENTS changed since the checkpoint was written; "
+                                 "rerun without --resume")
+            if state.get('done'):
+                logger.info(f"✅ {input_path} already fully replayed")
+                return dict(self.stats, lines_total=state['line'])
+            offset, line_no = state['offset'], state['line']
+            try:
+                output_size = os.path.getsize(output_path)
+            except OSError:
+                output_size = -1
+            if output_size < state['output_bytes']:
+                # truncate() would pad the gap with NUL bytes
+                raise ValueError(f"{output_path} is shorter than its checkpoint "
+                                 f"({output_size} < {state['output_bytes']} bytes); rerun without --resume")
+            # Drop anything written after the last checkpoint
+            with open(output_path, 'r+b') as out:
+                out.truncate(state['output_bytes'])
+            mode = 'ab'
+            logger.info(f"🔁 Resuming at line {line_no + 1} (byte {offset})")
+
+        start = time.perf_counter()
+        last_log = start
+        chunks = read_chunks(input_path, offset, line_no, chunk_lines)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='replay') as pool, \
+                open(output_path, mode) as out:
+            inflight = deque()
+
+            def fill():
+                # At most workers + 1 chunks in memory besides the one being encoded
+                while len(inflight) <= workers:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        return
+                    lines, end_offset = chunk
+                    inflight.append((pool.submit(self.prepare, lines), end_offset, lines[-1][0]))
+
+            fill()
+            while inflight:
+                future, end_offset, last_line = inflight.popleft()
+                fill()
+                items = self.classify(future.result())
+                out.write(''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items).encode('utf-8'))
+                # The checkpoint must never point past what is on disk
+                out.flush()
+                os.fsync(out.fileno())
+                save_checkpoint(checkpoint_path, {
+                    'version': CHECKPOINT_VERSION,
+                    'input': os.path.abspath(input_path),
+                    'fingerprint': fingerprint,
+                    'offset': end_offset,
+                    'line': last_line,
+                    'output_bytes': out.tell(),
+                    'done': False
+                })
+                offset, line_no = end_offset, last_line
+
+                now = time.perf_counter()
+                if now - last_log >= log_every:
+                    last_log = now
+                    logger.info(f"📈 {self.stats['lines']} lines, "
+                                f"{self.stats['lines'] / (now - start):.0f} lines/s, line {line_no}")
+
+            out.flush()
+            os.fsync(out.fileno())
+            save_checkpoint(checkpoint_path, {
+                'version': CHECKPOINT_VERSION,
+                'input': os.path.abspath(input_path),
+                'fingerprint': fingerprint,
+                'offset': offset,
+                'line': line_no,
+                'output_bytes': out.tell(),
+                'done': True
+            })
+
+        elapsed = time.perf_counter() - start
+        return dict(self.stats, lines_total=line_no, seconds=round(elapsed, 2),
+                    lines_per_second=round(self.stats['lines'] / elapsed, 1) if elapsed else 0.0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reclassify an NDJSON chat log with the current model + INTENTS')
+    parser.add_argument('input', help='NDJSON chat log, one {"message": ...} per line')
+    parser.add_argument('-o', '--output', required=True, help='NDJSON results, one line per input line')
+    parser.add_argument('--field', default='message', help='Field holding the user message')
+    parser.add_argument('--keep', default='user_id,timestamp', help='Comma-separated fields copied to the output')
+    parser.add_argument('--checkpoint', default=None, help='Checkpoint file (default: <output>.ckpt.json)')
+    parser.add_argument('--resume', action='store_true', help='Continue from the checkpoint')
+    parser.add_argument('--chunk-lines', type=int, default=1024, help='Lines per pipeline chunk')
+    parser.add_argument('--encode-batch-size', type=int, default=128, help='Encoder batch size')
+    parser.add_argument('--workers', type=int, default=max(1, min(4, (os.cpu_count() or 2) - 1)),
+                        help='Threads for parsing / validation / entity extraction')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    # Encoder + pattern index only: no warmup, batcher or watcher threads
+    os.environ.setdefault('MODEL_LOAD_MODE', 'manual')
+    import app
+    if not app.load_model(start_threads=False):
+        raise SystemExit(f"Model failed to load: {app.model_state['error']}")
+
+    replayer = Replayer(app, field=args.field, keep=[k for k in args.keep.split(',') if k],
+                        encode_batch_size=args.encode_batch_size)
+    try:
+        stats = replayer.run(args.input, args.output, args.checkpoint, args.resume,
+                             args.chunk_lines, args.workers)
+    except ValueError as e:
+        raise SystemExit(f"❌ {str(e)}")
+    print(json.dumps(stats, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
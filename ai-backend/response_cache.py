@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+LRU cache cho kết quả detect_intent, key là text đã chuẩn hoá (lowercase,
+gộp khoảng trắng, Unicode NFC để các dạng dấu tiếng Việt dựng sẵn / tổ hợp
+cho cùng một key). Lưu cả embedding và intent để bỏ qua model.encode với các
+tin nhắn lặp lại như "hi", "cảm ơn", "bye".
+"""
+
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """Lowercase, NFC accent normalization, collapse whitespace"""
+    text = unicodedata.normalize('NFC', text)
+    return ' '.join(text.lower().split())
+
+
+class CachedIntent:
+    """Embedding + intent decision (and top-k candidates) for one normalized message"""
+
+    __slots__ = ('embedding', 'intent', 'score', 'candidates')
+
+    def __init__(self, embedding, intent, score, candidates=()):
+        self.embedding = embedding
+        self.intent = intent
+        self.score = score
+        self.candidates = candidates
+
+
+class IntentCache:
+    """Size-bounded LRU keyed on normalized input text"""
+
+    def __init__(self, max_size=4096, fingerprint=None):
+        self.max_size = max(0, int(max_size))
+        self.fingerprint = fingerprint
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'clears': 0}
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry
+
+    def put(self, key, entry, fingerprint=None):
+        """Store entry; skipped if it was computed under an older fingerprint"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if fingerprint is not None and fingerprint != self.fingerprint:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self, fingerprint=None):
+        """Drop everything; call whenever the model or INTENTS change"""
+        with self._lock:
+            self._entries.clear()
+            self.fingerprint = fingerprint
+            self.stats['clears'] += 1
+
+    def ensure_fingerprint(self, fingerprint):
+        """Clear the cache if it was filled under a different model/INTENTS"""
+        if fingerprint != self.fingerprint:
+            self.clear(fingerprint)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def snapshot_stats(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(
+                self.stats,
+                size=len(self._entries),
+                max_size=self.max_size,
+                hit_rate=round(self.stats['hits'] / lookups, 4) if lookups else 0.0
+            )
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Semantic search trên danh sách House (backend/models/House.js).
+
+Mỗi listing được embed từ name + type + country + description (load từ file
+export JSON của MongoDB) rồi gộp thành một ma trận float32 đã chuẩn hoá L2.
+Query = entities của chat (type, country, bedrooms, khoảng giá) làm pre-filter
++ cosine similarity trên câu hỏi tự do.
+
+- Flat: 1 phép nhân ma trận trên các dòng qua filter, top-k bằng argpartition
+- IVF (tuỳ chọn): k-means chia listings thành ``n_lists`` cụm, query chỉ chấm
+  điểm các dòng thuộc ``nprobe`` cụm gần nhất
+- Vectors có thể lưu float16 / int8 (SEARCH_EMBEDDING_DTYPE, quantization.py)
+
+Embeddings được lưu trong listing_store.py (segments trên đĩa, upsert theo _id).
+Đồng bộ từ file export (chỉ encode listing mới / đã sửa):
+
+    mongoexport -d <db> -c houses --jsonArray -o houses.json
+    python search.py build houses.json --ivf-lists 256 --prune
+    python search.py query "nhà 3 phòng ngủ ở Canada dưới 200k"
+"""
+
+import json
+import logging
+import os
+import re
+
+import numpy as np
+
+from intent_index import l2_normalize
+from listing_filters import AttributeFilter, ListingAttributes
+
+logger = logging.getLogger(__name__)
+
+# Stored per listing and returned in search results (description is only
+# used for the embedding)
+RESULT_FIELDS = ("_id", "name", "type", "country", "address", "bedrooms", "bathrooms",
+                 "surface", "year", "price", "image", "status")
+
+_LEADING_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+_SQFT = re.compile(r"sq|ft|feet", re.IGNORECASE)
+SQFT_TO_M2 = 0.092903
+
+# Gathering rows costs a copy; past this fraction a full matmul is cheaper
+_GATHER_MAX_FRACTION = 0.25
+
+
+def _object_id(value):
+    # mongoexport writes ObjectIds as {"$oid": "..."}
+    if isinstance(value, dict):
+        value = value.get("$oid", next(iter(value.values()), None))
+    return str(value) if value is not None else None
+
+
+def _number(value):
+    """First number in a House field ("1200 sq ft" -> 1200.0), else None"""
+    if isinstance(value, dict):
+        # Extended JSON numbers: {"$numberInt": "3"}, {"$numberDouble": "1.5"}
+        value = next(iter(value.values()), None)
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = _LEADING_NUMBER.search(value)
+        if match:
+            return float(match.group(0).replace(",", "."))
+    return None
+
+
+def _area_m2(surface):
+    """House.surface ("1200 sq ft" / "85 m2") -> square metres, as in chat entities"""
+    number = _number(surface)
+    if number is None:
+        return None
+    if isinstance(surface, str) and _SQFT.search(surface):
+        return round(number * SQFT_TO_M2, 1)
+    return number
+
+
+def normalize_listing(doc):
+    """House document -> flat dict with numeric bedrooms / bathrooms / surface / price"""
+    listing = {
+        "_id": _object_id(doc.get("_id")),
+        "name": doc.get("name") or "",
+        "type": doc.get("type") or "",
+        "country": doc.get("country") or "",
+        "description": doc.get("description") or "",
+        "address": doc.get("address") or "",
+        "year": doc.get("year") or "",
+        "image": doc.get("image") or "",
+        "status": doc.get("status") or "",
+    }
+    for field in ("bedrooms", "bathrooms", "surface"):
+        number = _number(doc.get(field))
+        listing[field] = int(number) if number is not None else None
+    listing["price"] = _number(doc.get("price"))
+    # Already-normalized listings carry area and an int surface
+    listing["area"] = doc["area"] if "area" in doc else _area_m2(doc.get("surface"))
+    return listing
+
+
+def iter_listings(path):
+    """Stream House documents from a JSON array (mongoexport --jsonArray) or NDJSON file"""
+    with open(path, "r", encoding="utf-8") as f:
+        first = ""
+        while True:
+            ch = f.read(1)
+            if not ch or not ch.isspace():
+                first = ch
+                break
+        f.seek(0)
+        if first == "[":
+            for doc in json.load(f):
+                yield normalize_listing(doc)
+            return
+        for line in f:
+            line = line.strip()
+            if line:
+                yield normalize_listing(json.loads(line))
+
+
+def listing_text(listing):
+    """Text that gets embedded for one listing"""
+    parts = (listing.get("name"), listing.get("type"), listing.get("country"), listing.get("description"))
+    return ". ".join(p.strip() for p in parts if p and p.strip())
+
+
+def listing_columns(listings):
+    """Attribute columns used by the pre-filters, one entry per listing"""
+    return {
+        "type": [(l.get("type") or "").lower() for l in listings],
+        "country": [(l.get("country") or "").lower() for l in listings],
+        "bedrooms": [l["bedrooms"] if l.get("bedrooms") is not None else -1 for l in listings],
+        "bathrooms": [l["bathrooms"] if l.get("bathrooms") is not None else -1 for l in listings],
+        "area": [l["area"] if l.get("area") is not None else np.nan for l in listings],
+        "price": [l["price"] if l.get("price") is not None else np.nan for l in listings],
+    }
+
+
+def train_ivf(matrix, n_lists, iterations=10, sample_size=50000, seed=0):
+    """Spherical k-means; return (centroids, assignment per row)"""
+    rng = np.random.default_rng(seed)
+    n_lists = max(1, min(int(n_lists), len(matrix)))
+    sample = matrix
+    if len(matrix) > sample_size:
+        sample = matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))]
+    centroids = np.array(sample[rng.choice(len(sample), n_lists, replace=False)], dtype=np.float32)
+
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=n_lists) == 0
+        # Re-seed empty clusters from random rows instead of leaving them dead
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = l2_normalize(sums)
+
+    assignments = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), 65536):
+        block = matrix[start:start + 65536]
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return centroids, assignments
+
+
+class ListingIndex:
+    """Read-only search snapshot: embedding blocks + attribute columns + live mask.
+
+    ``blocks`` are the per-segment matrices (mmap'd, never concatenated);
+    rows are numbered globally across blocks in order.
+    """
+
+    def __init__(self, blocks, attributes, docs, live=None, centroids=None, assignments=None,
+                 filter_cache_size=64):
+        self.blocks = list(blocks)
+        self.bases = np.cumsum([0] + [len(b) for b in self.blocks])
+        self.n_rows = int(self.bases[-1])
+        self.docs = docs
+        self.live = live
+        self.size = int(live.sum()) if live is not None else self.n_rows
+
+        self.filter = AttributeFilter(attributes, base=live, cache_size=filter_cache_size)
+
+        self.centroids = centroids
+        self._lists = None
+        self._unassigned = None
+        if centroids is not None and assignments is not None:
+            order = np.argsort(assignments, kind="stable")
+            sorted_assign = assignments[order]
+            bounds = np.searchsorted(sorted_assign, np.arange(len(centroids) + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(centroids))]
+            # Rows appended before any IVF training are always candidates
+            self._unassigned = order[:np.searchsorted(sorted_assign, 0)]
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def dim(self):
+        return self.blocks[0].shape[1] if self.blocks else 0
+
+    @property
+    def n_lists(self):
+        return len(self.centroids) if self.centroids is not None else 0
+
+    @classmethod
+    def from_listings(cls, matrix, listings):
+        """In-memory index over normalized listing dicts (no store, no IVF)"""
+        return cls([matrix], ListingAttributes.from_listings(listings),
+                   [{field: l.get(field) for field in RESULT_FIELDS} for l in listings])
+
+    def filter_mask(self, entities):
+        """Boolean mask of live listings matching the chat entities, None = every row"""
+        return self.filter.mask(entities)
+
+    def _candidates(self, query, nprobe):
+        """Row indices in the nprobe IVF lists closest to the query"""
+        nprobe = max(1, min(int(nprobe), self.n_lists))
+        scores = self.centroids @ query
+        probe = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self._unassigned] + [self._lists[i] for i in probe])
+
+    def _scores(self, query, rows=None):
+        """Scores for every row, or for the given sorted global rows"""
+        if rows is None:
+            if len(self.blocks) == 1:
+                return self.blocks[0] @ query
+            return np.concatenate([block @ query for block in self.blocks])
+        splits = np.searchsorted(rows, self.bases)
+        parts = []
+        for i, block in enumerate(self.blocks):
+            local = rows[splits[i]:splits[i + 1]] - self.bases[i]
+            if len(local):
+                parts.append(block[local] @ query)
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)
+
+    def search(self, query_embedding, k=10, entities=None, nprobe=8):
+        """Return [(row, score)] for the k best live listings passing the filters"""
+        if not self.size:
+            return []
+        query = l2_normalize(query_embedding)[0]
+        mask = self.filter_mask(entities)
+
+        rows = None
+        if self._lists is not None:
+            rows = self._candidates(query, nprobe)
+            if mask is not None:
+                rows = rows[mask[rows]]
+            # Too few hits in the probed lists: fall back to exact search
+            if len(rows) < k:
+                rows = None
+
+        if rows is None and mask is not None:
+            rows = np.flatnonzero(mask)
+            if not len(rows):
+                return []
+
+        if rows is None:
+            scores = self._scores(query)
+        elif len(rows) <= _GATHER_MAX_FRACTION * self.n_rows:
+            rows = np.sort(rows)
+            scores = self._scores(query, rows)
+        else:
+            full = self._scores(query)
+            keep = np.zeros(self.n_rows, dtype=bool)
+            keep[rows] = True
+            scores = np.where(keep, full, -np.inf)
+            rows = None
+
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if rows is not None:
+            return [(int(rows[i]), float(scores[i])) for i in top]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def results(self, hits):
+        return [dict(self.docs[row], score=round(score, 4)) for row, score in hits]
+
+
+def main(argv=None):
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Sync / query the semantic listing index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Upsert a House export into the listing store, then compact")
+    build.add_argument("listings", help="JSON array or NDJSON export of the houses collection")
+    build.add_argument("--ivf-lists", type=int, default=None, help="IVF lists (0 = flat)")
+    build.add_argument("--prune", action="store_true", help="Delete listings missing from the export")
+    query = sub.add_parser("query", help="Search the saved index")
+    query.add_argument("text")
+    query.add_argument("-k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    # Only the encoder and config are needed; load it here, not on a thread
+    os.environ.setdefault("MODEL_LOAD_MODE", "manual")
+    import app
+    from listing_store import ListingStore
+    if not app.load_model():
+        raise SystemExit(f"Model failed to load: {app.model_state['error']}")
+
+    if args.command == "build":
+        start = time.perf_counter()
+        n_lists = app.SEARCH_IVF_LISTS if args.ivf_lists is None else args.ivf_lists
+        store = ListingStore(app.LISTING_INDEX_DIR, app.MODEL_NAME, n_lists=n_lists,
+                             dtype=app.SEARCH_EMBEDDING_DTYPE).open()
+        listings = list(iter_listings(args.listings))
+        counts = store.upsert(listings, app.model.encode)
+        if args.prune:
+            keep = {l["_id"] for l in listings}
+            counts["deleted"] = store.delete([i for i in store.ids() if i not in keep])
+        store.compact()
+        print(f"✅ {counts} -> {len(store)} listings, {store.snapshot_stats()['ivf_lists']} IVF lists "
+              f"in {time.perf_counter() - start:.1f}s ({app.LISTING_INDEX_DIR})")
+    else:
+        print(json.dumps(app.search_listings(args.text, k=args.k), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
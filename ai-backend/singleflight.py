@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Single-flight: các request đồng thời có cùng key (message đã chuẩn hoá) chỉ
+chạy 1 lần tính toán (encode + scoring); các request đến sau chờ và dùng
+chung kết quả (hoặc exception) của request đầu tiên. Khác với intent_cache,
+chỉ gộp những request đang chạy cùng lúc, không giữ lại kết quả.
+"""
+
+import threading
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls that share a key"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {'leaders': 0, 'coalesced': 0}
+
+    def do(self, key, fn):
+        """Run fn() once per in-flight key; return (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.stats['coalesced'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.stats['leaders'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def snapshot_stats(self):
+        with self._lock:
+            return dict(self.stats, in_flight=len(self._calls))